@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Benchmark matching cost of IgnoreMatcher as the number of patterns grows
+
+    $ python benchmarks/bench_ignore.py --patterns 1 10 100 1000 --paths 20000
+
+Compares against matching every name with fnmatch, the way ignore patterns
+were applied before. Prints one JSON object per pattern count.
+"""
+from fnmatch import fnmatch
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from gitsync.lib.ignore import IgnoreMatcher  # noqa: E402
+
+
+def make_patterns(count, rng):
+    kinds = [
+        lambda i: 'name{0}'.format(i),
+        lambda i: '*.ext{0}'.format(i),
+        lambda i: '/root{0}/build'.format(i),
+        lambda i: 'dir{0}/**/tmp'.format(i),
+        lambda i: 'cache{0}/'.format(i),
+    ]
+    patterns = [kinds[i % len(kinds)](i) for i in range(count)]
+    # a few negations so the matcher has more than one run
+    for i in range(0, count, 50):
+        patterns.insert(rng.randrange(len(patterns) + 1), '!keep{0}.ext{0}'.format(i))
+    return patterns
+
+
+def make_paths(count, pattern_count, rng):
+    paths = []
+    for _ in range(count):
+        depth = rng.randint(1, 6)
+        parts = ['d{0}'.format(rng.randrange(50)) for _ in range(depth - 1)]
+        roll = rng.random()
+        if roll < 0.1:
+            parts.append('name{0}'.format(rng.randrange(pattern_count * 2)))
+        elif roll < 0.2:
+            parts.append('f.ext{0}'.format(rng.randrange(pattern_count * 2)))
+        else:
+            parts.append('file{0}.py'.format(rng.randrange(1000)))
+        paths.append('/'.join(parts))
+    return paths
+
+
+def measure(function, paths, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for rel_path in paths:
+            function(rel_path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ignore pattern matching')
+    parser.add_argument('--patterns', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--paths', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for pattern_count in args.patterns:
+        patterns = make_patterns(pattern_count, rng)
+        paths = make_paths(args.paths, pattern_count, rng)
+
+        started = time.perf_counter()
+        matcher = IgnoreMatcher(patterns)
+        compile_time = time.perf_counter() - started
+        matched = measure(matcher.match, paths, args.repeat)
+        names = [rel_path.rpartition('/')[2] for rel_path in paths]
+        baseline = measure(lambda name: any(fnmatch(name, pattern) for pattern in patterns), names, args.repeat)
+
+        print(json.dumps({
+            'patterns': len(patterns),
+            'paths': len(paths),
+            'compile_ms': round(compile_time * 1e3, 3),
+            'matcher_ns_per_path': round(matched / len(paths) * 1e9, 1),
+            'fnmatch_ns_per_path': round(baseline / len(paths) * 1e9, 1),
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Benchmark sync runs end to end against a local bare remote
+
+    $ python benchmarks/bench_sync.py --scenarios dotfiles deep large --output results.json
+
+Every scenario builds a synthetic source tree and a fresh clone of a bare
+origin, then times an initial sync, no-op syncs with nothing changed and
+high-churn syncs with a fraction of the sources rewritten. Each run reports
+wall time per phase (pull, clean_up_repo, check_and_sync, stage, commit,
+push) as one JSON document.
+
+Multi-GB files are only a flag away, e.g. `--large-files 3 --large-mb 2048`.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from gitsync import __version__  # noqa: E402
+from gitsync.__main__ import sync, sync_direct  # noqa: E402
+from gitsync.lib.profile import Phases  # noqa: E402
+
+SCENARIOS = ['dotfiles', 'deep', 'large']
+CHUNK_SIZE = 1 << 20
+
+
+def git(cwd, *args):
+    subprocess.run(['git'] + list(args), cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_remote(work_dir):
+    """Create a bare origin and a clone tracking it, return the clone path"""
+    origin = os.path.join(work_dir, 'origin.git')
+    repo_dir = os.path.join(work_dir, 'repo')
+    git(work_dir, 'init', '-q', '--bare', origin)
+    git(work_dir, 'clone', '-q', origin, repo_dir)
+    git(repo_dir, 'config', 'user.name', 'bench')
+    git(repo_dir, 'config', 'user.email', 'bench@localhost')
+    with open(os.path.join(repo_dir, 'README'), 'w') as f:
+        f.write('gitsync benchmark\n')
+    git(repo_dir, 'add', 'README')
+    git(repo_dir, 'commit', '-q', '-m', 'init')
+    git(repo_dir, 'push', '-q', '-u', 'origin', 'HEAD')
+    return repo_dir
+
+
+def write_small(file_path, rng):
+    with open(file_path, 'w') as f:
+        f.write('# {0}\n'.format(rng.random()) * rng.randint(1, 64))
+
+
+def write_large(file_path, size_mb, rng):
+    block = bytes(rng.getrandbits(8) for _ in range(4096)) * (CHUNK_SIZE // 4096)
+    with open(file_path, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(block)
+
+
+def make_dotfiles(src_dir, args, rng):
+    """Many small files, each mapped on its own"""
+    files = {}
+    for index in range(args.dotfiles):
+        file_path = os.path.join(src_dir, '.dotfile{0}rc'.format(index))
+        write_small(file_path, rng)
+        files[file_path] = '.dotfile{0}rc'.format(index)
+    return files, {}
+
+
+def make_deep(src_dir, args, rng):
+    """A single mapped dir, args.fanout dirs per level down to args.depth"""
+    root = os.path.join(src_dir, 'deep')
+    pending = [(root, 0)]
+    while pending:
+        dir_path, level = pending.pop()
+        os.makedirs(dir_path)
+        for index in range(args.files_per_dir):
+            write_small(os.path.join(dir_path, 'file{0}.txt'.format(index)), rng)
+        if level < args.depth:
+            pending.extend((os.path.join(dir_path, 'dir{0}'.format(index)), level + 1)
+                           for index in range(args.fanout))
+    return {}, {root: 'deep'}
+
+
+def make_large(src_dir, args, rng):
+    """A few large files in a mapped dir"""
+    root = os.path.join(src_dir, 'large')
+    os.makedirs(root)
+    for index in range(args.large_files):
+        write_large(os.path.join(root, 'blob{0}.bin'.format(index)), args.large_mb, rng)
+    return {}, {root: 'large'}
+
+
+def source_files(config):
+    file_paths = list(config['files'])
+    for src_root in config['dirs']:
+        for dir_path, _, file_names in os.walk(src_root):
+            file_paths.extend(os.path.join(dir_path, file_name) for file_name in file_names)
+    return sorted(file_paths)
+
+
+def churn(file_paths, fraction, rng):
+    """Rewrite a fraction of the files, large ones in place, return how many"""
+    chosen = rng.sample(file_paths, max(1, int(len(file_paths) * fraction)))
+    for file_path in chosen:
+        size = os.path.getsize(file_path)
+        if size > CHUNK_SIZE:
+            with open(file_path, 'r+b') as f:
+                f.seek(rng.randrange(size - 4096))
+                f.write(os.urandom(4096))
+        else:
+            write_small(file_path, rng)
+        # make sure the change is visible even on coarse mtime filesystems
+        stat = os.stat(file_path)
+        os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    return len(chosen)
+
+
+def timed_sync(config_file, args):
+    phases = Phases()
+    started = time.perf_counter()
+    if args.direct:
+        changed = sync_direct(config_file, jobs=args.jobs, phases=phases)
+    else:
+        changed = sync(config_file, jobs=args.jobs, copy_strategy=args.copy_strategy, phases=phases)
+    return {
+        'total_s': round(time.perf_counter() - started, 6),
+        'changed': changed,
+        'phases_s': {name: round(seconds, 6) for name, seconds in phases.timings.items()},
+    }
+
+
+def run_scenario(name, work_dir, args, rng):
+    src_dir = os.path.join(work_dir, 'src')
+    os.makedirs(src_dir)
+    started = time.perf_counter()
+    files, dirs = globals()['make_' + name](src_dir, args, rng)
+    generate_time = time.perf_counter() - started
+    config = {
+        'repo_dir': make_remote(work_dir),
+        'files': files,
+        'dirs': dirs,
+        'ignore': {'patterns': ['target', '.DS_Store']},
+    }
+    config_file = os.path.join(work_dir, 'settings.json')
+    with open(config_file, 'w') as f:
+        json.dump(config, f, indent=4)
+
+    file_paths = source_files(config)
+    runs = [dict(kind='initial', **timed_sync(config_file, args))]
+    for _ in range(args.repeat):
+        runs.append(dict(kind='noop', **timed_sync(config_file, args)))
+    for _ in range(args.repeat):
+        churned = churn(file_paths, args.churn, rng)
+        runs.append(dict(kind='churn', churned_files=churned, **timed_sync(config_file, args)))
+    return {
+        'scenario': name,
+        'source_files': len(file_paths),
+        'source_bytes': sum(os.path.getsize(file_path) for file_path in file_paths),
+        'generate_s': round(generate_time, 6),
+        'runs': runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark sync runs against a local bare remote')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--dotfiles', type=int, default=500, help='Number of mapped small files')
+    parser.add_argument('--depth', type=int, default=4, help='Levels of the deep tree')
+    parser.add_argument('--fanout', type=int, default=4, help='Sub dirs per dir of the deep tree')
+    parser.add_argument('--files-per-dir', type=int, default=8, help='Files per dir of the deep tree')
+    parser.add_argument('--large-files', type=int, default=3, help='Number of large files')
+    parser.add_argument('--large-mb', type=int, default=64, help='Size of each large file in MiB')
+    parser.add_argument('--churn', type=float, default=0.2, help='Fraction of files rewritten per churn run')
+    parser.add_argument('--repeat', type=int, default=3, help='No-op and churn runs per scenario')
+    parser.add_argument('-j', '--jobs', type=int, default=8)
+    parser.add_argument('--copy_strategy', default='auto')
+    parser.add_argument('--direct', action='store_true', default=False, help='Benchmark sync_direct instead')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work-dir', help='Where trees and repos are created (default: a temp dir)')
+    parser.add_argument('--keep', action='store_true', default=False, help='Keep the work dir')
+    parser.add_argument('--output', help='Write results to this file instead of stdout')
+    args = parser.parse_args()
+
+    logging.getLogger('gitsync').setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    base_dir = tempfile.mkdtemp(prefix='gitsync-bench-', dir=args.work_dir)
+    results = []
+    try:
+        for name in args.scenarios:
+            work_dir = os.path.join(base_dir, name)
+            os.makedirs(work_dir)
+            results.append(run_scenario(name, work_dir, args, rng))
+    finally:
+        if not args.keep:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+    report = json.dumps({
+        'gitsync': __version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'mode': 'direct' if args.direct else 'sync',
+        'jobs': args.jobs,
+        'scenarios': results,
+    }, indent=4)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
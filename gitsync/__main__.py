@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from git import Repo, Remote, InvalidGitRepositoryError, NoSuchPathError
+# git is imported where a repo is opened, so nothing pays for it when there's nothing to sync
 from .lib import *
 from gitsync import __version__
 import os
@@ -7,6 +7,14 @@ import sys
 import logging
 import argparse
 import json
+import cProfile
+import glob
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+from itertools import chain
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
 
 # DEFAULT_SETTING exported as setting_default.json with argument '--init'
 DEFAULT_SETTING = {
@@ -34,16 +42,40 @@ DEFAULT_SETTING = {
 # Ignore anything would break this system as belows
 IGNORE_PATTERNS = [
     '.state',
+    '.state.*',
     '.gitignore',
     '.git'
 ]
 
+# DEFAULT_DEBOUNCE seconds without source changes close a batch in watch mode
+DEFAULT_DEBOUNCE = 2.0
+
+# DEFAULT_CONCURRENCY configs synced at once in batch mode
+DEFAULT_CONCURRENCY = 4
+
+# PLAN_AHEAD operations at most are planned while the pull is still running
+PLAN_AHEAD = 10000
+
+# dir of the git dir block digests of large repo copies are cached in
+BLOCK_CACHE_DIR = 'gitsync-blocks'
+
+# message of every commit made by a sync
+AUTO_COMMIT_MESSAGE = '[(auto-git) leave it here for later editing]'
+
+# Commands, 'sync' if none is given
+COMMANDS = ['sync', 'status', 'restore']
+
 # Logging
 FORMAT = '%(asctime)-15s %(message)s'
 logging.basicConfig(level=logging.INFO, format=FORMAT)
 logger = logging.getLogger('gitsync')
 
 
+class SyncError(Exception):
+    """Raised when a sync run can't proceed"""
+    pass
+
+
 def init_files(repo_dir, ignore=[]):
     """Initialize all necessary files to proceed
        * alter .gitignore file adapted to newly ignore list
@@ -55,9 +87,10 @@ def init_files(repo_dir, ignore=[]):
         ignore {list} -- Ignore patterns (default: {[]})
     """
     # create ignore list
-    ignore_list = ['.state']
+    ignore_list = ['.state', '.state.*', '*' + TMP_SUFFIX]
     ignore_list.extend(ignore)
-    ignore_list = sorted(list(set(ignore_list)))
+    # keep the order, negated patterns only apply to patterns before them
+    ignore_list = list(OrderedDict.fromkeys(ignore_list))
     with open(os.path.join(repo_dir, '.gitignore'), 'w') as f:
         for item in ignore_list:
             f.write(item+'\n')
@@ -85,7 +118,7 @@ def precheck(files, dirs):
                 'Item declared in dirs {0} is not a directory'.format(d))
 
 
-def clean_up_repo(files, dirs, repo_dir, ignore=IGNORE_PATTERNS):
+def clean_up_repo(files, dirs, repo_dir, ignore=IGNORE_PATTERNS, dry_run=False):
     """Clean up all files/dirs not included in the given list (files/dirs) 
     
     Arguments:
@@ -94,83 +127,302 @@ def clean_up_repo(files, dirs, repo_dir, ignore=IGNORE_PATTERNS):
         repo_dir {[type]} -- [description]
     
     Keyword Arguments:
-        ignore {[type]} -- [description] (default: {IGNORE_PATTERNS})
+        ignore {list} -- Ignore patterns or IgnoreMatcher of entries to keep (default: {IGNORE_PATTERNS})
+        dry_run {bool} -- Only list what would be deleted (default: {False})
+
+    Returns:
+        list -- Paths deleted
     """
-    items_in_repo_root = os.listdir(repo_dir)
-    files_in_repo_root = list(filter(lambda item: os.path.isfile(
-        os.path.join(repo_dir, item)), items_in_repo_root))
-    dirs_in_repo_root = list(filter(lambda item: os.path.isdir(
-        os.path.join(repo_dir, item)), items_in_repo_root))
-    # print(files_in_repo_root, dirs_in_repo_root)
-
-    be_cleaned_files = [
-        item for item in files_in_repo_root if item not in files]
-    be_cleaned_dirs = [item for item in dirs_in_repo_root if item not in dirs]
-    be_cleaned_files = [
-        item for item in be_cleaned_files if item not in ignore]
-    be_cleaned_dirs = [item for item in be_cleaned_dirs if item not in ignore]
+    ignore = as_matcher(ignore, root=repo_dir)
+    files = set(files)
+    dirs = set(dirs)
+    be_cleaned_files = []
+    be_cleaned_dirs = []
+    with os.scandir(repo_dir) as it:
+        for entry in it:
+            is_dir = entry.is_dir()
+            if ignore.match(entry.name, is_dir):
+                continue
+            if is_dir and entry.name not in dirs:
+                be_cleaned_dirs.append(entry.name)
+            elif not is_dir and entry.is_file() and entry.name not in files:
+                be_cleaned_files.append(entry.name)
 
     logger.debug('Cleanup checks result:\n\t\tbe_cleaned_files {0}\n\t\tbe_cleaned_dirs {1}'.format(
         be_cleaned_files, be_cleaned_dirs))
+    cleaned = []
     for f in be_cleaned_files:
-        if f not in ignore:
+        if not dry_run:
             delete_file(os.path.join(repo_dir, f))
+        cleaned.append(os.path.join(repo_dir, f))
 
     for d in be_cleaned_dirs:
-        if d not in ignore:
+        if not dry_run:
             delete_dir(os.path.join(repo_dir, d))
+        cleaned.append(os.path.join(repo_dir, d))
+    return cleaned
 
 
-def main():
-    """Entrypoint to 'gitsync' command-line tool
-    
-    """
-    parser = argparse.ArgumentParser(
-        description='File-sync integrated with Git system solution tool')
-    parser.add_argument('-d', '--debug',
-                        action='store_true',
-                        default=False,
-                        help='show more message for debugging')
-    parser.add_argument('--config_file', help='Specify the location of the settings (Default value: settings.json)',
-                        type=str, default=os.path.join(os.getcwd(), 'settings.json'))
-    parser.add_argument('--init', help='Create a template configuration file',
-                        action='store_true', default=False)
-    parser.add_argument('--version', help='Print the GitSync version number',
-                        action='version', version=__version__)
-
-    # Read a set of arguments
-    args = parser.parse_args()
-    DEBUG = args.debug
-    CONFIG_FILE = args.config_file
-    INIT = args.init
+def load_sync_config(config_file):
+    """Load config and merge the ignore patterns gitsync always needs
 
-    # Set Logging Level
-    if DEBUG:
-        for handler in logging.root.handlers[:]:
-            logging.root.removeHandler(handler)
-        logging.basicConfig(level=logging.DEBUG, format=FORMAT)
+    Arguments:
+        config_file {str} -- Config file path
 
-    logger.debug('Config file: {0}'.format(CONFIG_FILE))
-    
-    if INIT:
-        logger.info('Generate a template setting.json')
-        with open('settings_default.json', 'w') as f:
-            f.writelines(json.dumps(DEFAULT_SETTING, indent=4))
-        sys.exit()
+    Raises:
+        SyncError -- Raises if the config can't be loaded
 
-    # Load config
+    Returns:
+        tuple -- (config, ignore patterns)
+    """
     try:
         logger.debug('Load config...')
-        config = load_config(CONFIG_FILE)
-        repo_dir = config['repo_dir']
-        files_mapping = config['files']
-        dirs_mapping = config['dirs']
+        config = load_config(config_file)
+        for key in ('repo_dir', 'files', 'dirs'):
+            if key not in config:
+                raise KeyError(key)
         ignore_files = config['ignore']['patterns']
         ignore_files.extend(IGNORE_PATTERNS)
-        ignore_files = sorted(list(set(ignore_files)))
+        ignore_files = list(OrderedDict.fromkeys(ignore_files))
+        load_schedule(config)
     except Exception as error:
-        logger.error('Can\'t load config: {0}'.format(error))
-        sys.exit(1)
+        raise SyncError('Can\'t load config: {0}'.format(error))
+    return config, ignore_files
+
+
+def load_index_blobs(repo_dir, compare):
+    """Blob hashes of repo copies to compare changed sources with, None unless compare is COMPARE_INDEX"""
+    if compare != COMPARE_INDEX:
+        return None
+    git_dir = find_git_dir(repo_dir)
+    return IndexBlobs(repo_dir, git_dir) if git_dir is not None else None
+
+
+def due_entries(config, prev_config, changed_paths=None):
+    """Sources the schedule of a config has due since the last sync state, None to check all of them"""
+    if changed_paths is not None or not config.get(SCHEDULE_KEY) or prev_config == NO_LAST_SYNC_STATE:
+        return None
+    due = due_sources(config, (prev_config.get(MANIFEST_KEY) or {}).get(SCANNED_KEY) or {})
+    logger.debug('{0} of {1} entries are due'.format(len(due), len(config['files']) + len(config['dirs'])))
+    return due
+
+
+def load_prev_state(repo_dir, head):
+    """Load the last sync state, dropping its stat manifest unless it describes the repo at given HEAD
+
+    Arguments:
+        repo_dir {str} -- Repo path
+        head {str} -- Hex sha of HEAD, None if unknown
+
+    Returns:
+        dict -- Last sync state or NO_LAST_SYNC_STATE
+    """
+    if not check_last_sync(repo_dir):
+        return NO_LAST_SYNC_STATE
+    logger.debug('Last sync record found!')
+    prev_config = load_last_sync(repo_dir)
+    # the manifest only describes the repo copies if nobody else has committed since
+    prev_manifest = prev_config.get(MANIFEST_KEY)
+    if prev_manifest is not None and (head is None or prev_manifest.get('head') != head
+                                      or DIRECT_MANIFEST_KEY in prev_manifest):
+        logger.debug('Repo changed since last sync, discard stat manifest')
+        del prev_config[MANIFEST_KEY]
+    return prev_config
+
+
+def iter_pending(config, prev_config, ignore, manifest=None, jobs=DEFAULT_JOBS, changed_paths=None, blobs=None,
+                 due=None):
+    """Yield what a sync would do to the repo working tree, without running git or changing anything
+
+    Arguments:
+        config {dict} -- Current config
+        prev_config {dict} -- Last sync state or NO_LAST_SYNC_STATE
+        ignore {IgnoreMatcher} -- Ignore matcher rooted at the repo
+
+    Keyword Arguments:
+        manifest {dict} -- Filled with the stat manifest of current sources once the generator is exhausted (default: {None})
+        jobs {int} -- Number of concurrent scan jobs (default: {DEFAULT_JOBS})
+        changed_paths {iterable} -- Only look at these source paths if known (default: {None})
+        blobs {IndexBlobs} -- Blob hashes of repo copies, compared rather than the copies themselves (default: {None})
+        due {list} -- Only check these sources, in this order, if given (default: {None})
+
+    Yields:
+        Operation -- The operations of iter_sync_state, then cleanups of what isn't moved by them
+    """
+    repo_dir = config['repo_dir']
+    moved = set()
+    for operation in iter_sync_state(prev_config, config, repo_dir, manifest=manifest, workers=jobs,
+                                     changed_paths=changed_paths, blobs=blobs, due=due):
+        if operation.action == MOVE:
+            moved.add(operation.src_path)
+        yield operation
+    for item in clean_up_repo(config['files'].values(), config['dirs'].values(), repo_dir, ignore=ignore, dry_run=True):
+        if item not in moved:
+            yield Operation(DELETE_DIR if os.path.isdir(item) else DELETE_FILE, None, item)
+
+
+def _is_up_to_date(config, ignore, jobs, changed_paths, flush_policy, blobs):
+    """Whether the last sync state proves nothing changed since, checked without git"""
+    repo_dir = config['repo_dir']
+    head = read_head(repo_dir)
+    if head is None or os.path.exists(os.path.join(repo_dir, JOURNAL_FILE)):
+        # an interrupted sync is left to resume
+        return False
+    prev_config = load_prev_state(repo_dir, head)
+    if prev_config == NO_LAST_SYNC_STATE or MANIFEST_KEY not in prev_config:
+        return False
+    pending = load_pending(find_git_dir(repo_dir))
+    if pending['remotes']:
+        # required remotes missed the last push
+        return False
+    if read_upstream(repo_dir) != head:
+        # commits of an earlier sync haven't reached the remote yet, fine as long as the flush policy holds them back
+        if not pending['commits'] or is_flush_due(flush_policy, pending):
+            return False
+    if any(prev_config.get(key) != config.get(key) for key in ('files', 'dirs', 'ignore', LARGE_FILES_KEY)):
+        return False
+    manifest = {}
+    try:
+        for _ in iter_pending(config, prev_config, ignore, manifest=manifest, jobs=jobs, changed_paths=changed_paths,
+                                  blobs=blobs, due=due_entries(config, prev_config, changed_paths)):
+            return False
+    except OSError:
+        # e.g. a missing source, left to the full path to report
+        return False
+    manifest['head'] = head
+    if manifest != prev_config[MANIFEST_KEY]:
+        # sources were only touched, keep their new signatures for next time
+        save_current_sync(repo_dir, config, manifest)
+    return True
+
+
+def _plan_ahead(operations, pull, limit=PLAN_AHEAD):
+    """Buffer planned operations until the pull finished or limit operations are planned"""
+    planned = []
+    while not pull.done() and len(planned) < limit:
+        try:
+            planned.append(next(operations))
+        except StopIteration:
+            break
+    return planned
+
+
+def _is_pushed(repo):
+    try:
+        tracking = repo.active_branch.tracking_branch()
+        return tracking is None or tracking.commit == repo.head.commit
+    except (TypeError, ValueError):
+        # detached HEAD or no such remote-tracking branch
+        return True
+
+
+def _finish_push(git_dir, results):
+    """Log the results of a push and note the required remotes it didn't reach, so the next sync pushes again
+
+    Returns:
+        list -- Names of the required remotes which failed
+    """
+    log_push_summary(results)
+    lagging = [result['remote'] for result in results if result['status'] == 'failed' and result['required']]
+    if lagging:
+        save_pending(git_dir, dict(load_pending(git_dir), remotes=lagging))
+    return lagging
+
+
+def _log_push_result(git_dir, future):
+    error = future.exception()
+    if error is not None:
+        logger.error('Background push failed, it is retried on the next sync: {0}'.format(error))
+    elif _finish_push(git_dir, future.result()):
+        logger.error('Background push failed, it is retried on the next sync')
+    else:
+        logger.info('Background push finished')
+
+
+def _track(operations, added, removed):
+    """Pass operations through, noting their destinations as added or removed"""
+    for operation in operations:
+        logger.debug('Sync operation: {0} {1}'.format(operation.action, operation.dst_path))
+        if operation.action == MOVE:
+            removed.append(operation.src_path)
+        (removed if operation.src_path is None else added).append(operation.dst_path)
+        yield operation
+
+
+def _resume_state(prev_config, config, interrupted, head):
+    """Last sync state with the copies an interrupted sync on the same HEAD finished taken as synced"""
+    if interrupted is not None and interrupted['head'] == head:
+        unfinished = [operation.src_path for operation in interrupted['pending'] if operation.action == COPY_FILE]
+        logger.debug('Keep {0} copies of the interrupted sync'.format(len(interrupted['copied'])))
+        return merge_copied(prev_config, config, interrupted['copied'], unfinished=unfinished)
+    return prev_config
+
+
+def _save_state(repo, config, manifest, journal):
+    """Save the sync state for the current HEAD and drop the journal it supersedes"""
+    logger.debug('Saving current sync state...')
+    manifest['head'] = repo.head.commit.hexsha
+    try:
+        save_current_sync(config['repo_dir'], config, manifest)
+    except Exception as error:
+        raise SyncError('Failed to save current sync state! {0}'.format(error))
+    journal.discard()
+
+
+def sync(config_file, jobs=DEFAULT_JOBS, copy_strategy='auto', changed_paths=None, phases=None,
+         delta_threshold=DELTA_THRESHOLD, full=False, push_mode=PUSH_WAIT, flush_policy=None,
+         compare=COMPARE_CONTENT):
+    """Sync files/dirs into the repo, then commit and push them
+
+    If the last sync state shows no source changed since, nothing else is done:
+    neither git is run nor the repo pulled. Otherwise sources are scanned while
+    pulling, and only writes into the repo wait for the pull. Commits are only
+    pushed once the flush policy says so. Operations are journaled, so a sync
+    which dies halfway is resumed by the next one rather than started over.
+
+    Arguments:
+        config_file {str} -- Config file path
+
+    Keyword Arguments:
+        jobs {int} -- Number of concurrent scan and copy/delete jobs (default: {DEFAULT_JOBS})
+        copy_strategy {str} -- How files are copied into the repo (default: {'auto'})
+        changed_paths {iterable} -- Only look at these source paths if known (default: {None})
+        phases {Phases} -- Records wall time per phase if given (default: {None})
+        delta_threshold {int} -- Files of at least this many bytes already in the repo only get their changed blocks rewritten, 0 disables it (default: {DELTA_THRESHOLD})
+        full {bool} -- Pull and check the repo and every entry, due by its schedule or not, even if no source changed (default: {False})
+        push_mode {str} -- Wait for the push, run it in the background or detach it, see PUSH_MODES (default: {PUSH_WAIT})
+        flush_policy {FlushPolicy} -- When commits are pushed (default: {None}, every commit right away)
+        compare {str} -- Compare changed sources with repo copies by content or with the blobs of the git index,
+                         see COMPARE_MODES (default: {COMPARE_CONTENT})
+
+    Raises:
+        SyncError -- Raises if the sync can't proceed
+
+    Returns:
+        bool -- Whether anything was committed or pushed
+    """
+    phases = phases or Phases()
+    flush_policy = flush_policy or FlushPolicy()
+
+    # Load config
+    config, ignore_files = load_sync_config(config_file)
+    repo_dir = config['repo_dir']
+    files_mapping = config['files']
+    dirs_mapping = config['dirs']
+    ignore = IgnoreMatcher(ignore_files, root=repo_dir)
+
+    if not full:
+        with phases.phase('fast_check'):
+            up_to_date = _is_up_to_date(config, ignore, jobs, changed_paths, flush_policy,
+                                        load_index_blobs(repo_dir, compare))
+        if up_to_date:
+            logger.info('All is up to date')
+            return False
+
+    from git import Repo, Remote, InvalidGitRepositoryError, NoSuchPathError
+
+    # a background push of the last sync goes first
+    wait_for_push()
 
     # Read and check repo has been initialized
     logger.debug('Trying to read repo...')
@@ -178,132 +430,720 @@ def main():
         repo = Repo(repo_dir)
         remote = Remote(repo, 'origin')
         if not remote.exists():
-            logger.error(
+            raise SyncError(
                 'Can\'t find \'origin\' remote url. Please set a \'origin\' remote and upstream branch at first to proceed!')
-            sys.exit(1)
         logger.debug('Repo has been loaded successfully')
-        logger.info('Pulling from repo...')
-        remote.pull()
     except InvalidGitRepositoryError as error:
-        logger.error('Invalid repo. Please check it again!')
-        sys.exit(1)
+        raise SyncError('Invalid repo. Please check it again!')
     except NoSuchPathError as error:
-        logger.error(
+        raise SyncError(
             'No directory \'.git\' found. Did you initialize git project?!')
-        sys.exit(1)
 
     if repo.bare:
-        logger.error('Repo can\'t be a bare!')
-        sys.exit(1)
+        raise SyncError('Repo can\'t be a bare!')
 
-    # initialize runtime files/variables
-    init_files(repo_dir, ignore_files)
-    changed = False
-    logger.info('Repo Initialization completed')
+    try:
+        targets = load_push_targets(config)
+    except (TypeError, ValueError) as error:
+        raise SyncError('Invalid remotes: {0}'.format(error))
+    try:
+        history = load_history_policy(config)
+    except (TypeError, ValueError) as error:
+        raise SyncError('Invalid history policy: {0}'.format(error))
 
     logger.debug('Performing prechecks...')
     try:
         precheck(files_mapping.keys(), dirs_mapping.keys())
     except Exception as error:
-        logger.error('Prechecks failed!')
-        logger.error(error)
-        sys.exit(1)
+        raise SyncError('Prechecks failed! {0}'.format(error))
+
+    # an interrupted sync leaves a journal: what it left unfinished is cleaned up, what it finished is kept
+    journal_path = os.path.join(repo_dir, JOURNAL_FILE)
+    interrupted = load_journal(journal_path)
+    if interrupted is not None:
+        logger.info('Resume an interrupted sync, {0} operations were left unfinished'.format(
+            len(interrupted['pending'])))
+        recover_operations(interrupted['pending'], block_cache=BlockCache(os.path.join(repo.git_dir, BLOCK_CACHE_DIR)))
+
+    if history is not None and is_maintenance_due(repo.git_dir, GC, history.gc_interval):
+        # history the last syncs rewrote goes once git's grace periods are over
+        logger.info('Collect garbage in repo...')
+        with phases.phase('gc'):
+            collect_garbage(repo)
+        mark_maintenance(repo.git_dir, GC)
+
+    def pull():
+        with phases.phase('pull'):
+            if history is None:
+                remote.pull()
+            elif pull_history(repo, remote, AUTO_COMMIT_MESSAGE, depth=history.depth) == 'reset':
+                logger.info('The remote branch was rewritten, reset to it')
+
+    # plan against the current HEAD while pulling, the plan only holds if the pull leaves HEAD as it is
+    logger.info('Pulling from repo...')
+    head = repo.head.commit.hexsha
+    puller = ThreadPoolExecutor(max_workers=1)
+    pulling = puller.submit(pull)
+    puller.shutdown(wait=False)
+    manifest = {}
+    try:
+        with phases.phase('plan_ahead'):
+            logger.debug('Detect if the sync list changes...')
+            prev_config = _resume_state(load_prev_state(repo_dir, head), config, interrupted, head)
+            operations = iter_sync_state(prev_config, config, repo_dir, manifest=manifest, workers=jobs,
+                                         changed_paths=changed_paths, blobs=load_index_blobs(repo_dir, compare),
+                                         due=None if full else due_entries(config, prev_config, changed_paths))
+            planned = _plan_ahead(operations, pulling)
+    finally:
+        wait([pulling])
+    pulling.result()
+    if repo.head.commit.hexsha != head:
+        logger.debug('Pull moved HEAD, plan again')
+        operations.close()
+        prev_config = _resume_state(load_prev_state(repo_dir, repo.head.commit.hexsha), config, interrupted,
+                                    repo.head.commit.hexsha)
+        operations = iter_sync_state(prev_config, config, repo_dir, manifest=manifest, workers=jobs,
+                                     changed_paths=changed_paths, blobs=load_index_blobs(repo_dir, compare),
+                                     due=None if full else due_entries(config, prev_config, changed_paths))
+        planned = []
+    logger.debug('Planned {0} operations while pulling'.format(len(planned)))
+
+    # initialize runtime files/variables
+    init_files(repo_dir, ignore_files)
+    logger.info('Repo Initialization completed')
 
     logger.debug('Perform cleanup task on repo...')
-    clean_up_repo(files_mapping.values(), dirs_mapping.values(),
-                  repo_dir, ignore=ignore_files)
+    # copies at their last destination are kept to be moved to their current one
+    moving = [prev_dst_item for prev_dst_item, _ in moved_destinations(prev_config, config).values()]
+    with phases.phase('clean_up_repo'):
+        cleaned = clean_up_repo(list(files_mapping.values()) + moving, list(dirs_mapping.values()) + moving,
+                                repo_dir, ignore=ignore)
 
-    logger.debug('Proceed to check file changes')
-    logger.debug('Detect if the sync list changes...')
-    prev_config = NO_LAST_SYNC_STATE
-    if check_last_sync(repo_dir):
-        logger.debug('Last sync record found!')
-        prev_config = load_last_sync(repo_dir)
+    # Check whether folder states are identical and perform the sync task as differences are found
+    # (overwrite dst-file / delete dst-file / copy entire src-folder(src-file) to dst-folder(dst-file))
+    logger.info('Check files whether if updated and sync them')
+    added = []
+    removed = []
+    copy_stats = CopyStats()
+    try:
+        large_store = load_large_store(config)
+    except (KeyError, ValueError) as error:
+        raise SyncError('Can\'t set up the large file store: {0}'.format(error))
+    block_cache = None
+    if delta_threshold > 0:
+        # block digests of large repo copies live next to the objects, out of the working tree
+        block_cache = BlockCache(os.path.join(repo.git_dir, BLOCK_CACHE_DIR), threshold=delta_threshold)
+    if interrupted is not None:
+        # what the interrupted sync finished is committed along with this one
+        for _ in _track(interrupted['done'], added, removed):
+            pass
+    journal = Journal(journal_path, repo.head.commit.hexsha)
+    try:
+        with phases.phase('check_and_sync'):
+            failures = execute_operations(_track(chain(planned, operations), added, removed), jobs=jobs,
+                                          ignore=ignore, strategy=copy_strategy, stats=copy_stats,
+                                          block_cache=block_cache, large_store=large_store, journal=journal)
+    finally:
+        journal.close()
+    if moving:
+        # the manifest didn't cover some of them, so they were copied again rather than moved
+        with phases.phase('clean_up_repo'):
+            cleaned.extend(clean_up_repo(files_mapping.values(), dirs_mapping.values(), repo_dir, ignore=ignore))
+    operation_count = len(added) + len(removed)
+    if operation_count:
+        logger.debug('Performed {0} operations with {1} jobs'.format(operation_count, jobs))
+        logger.info('Copy strategy: {0}'.format(copy_stats.summary()))
+    if failures:
+        for operation, error in failures:
+            logger.error('Failed to {0} {1}: {2}'.format(
+                operation.action.replace('_', ' '), operation.dst_path, error))
+        raise SyncError('{0} of {1} operations failed!'.format(len(failures), operation_count))
 
-    # Check whether folder states are identical
-    logger.info('Check files whether if updated')
-    src_files_to_be_copied, src_dirs_to_be_copied, dst_files_to_be_deleted, dst_dirs_to_be_deleted = check_sync_state(
-        prev_config, config, repo_dir)
-    logger.debug('Sync state: \n\t\tFiles be copied {0}\n\t\tDirs be copied {1}\n\t\tFiles be deleted {2}\n\t\tDirs be deleted {3}'.format(
-        src_files_to_be_copied, src_dirs_to_be_copied, dst_files_to_be_deleted, dst_dirs_to_be_deleted))
-
-    # Start to perform sync task (overwrite dst-file / delete dst-file / copy entire src-folder(src-file) to dst-folder(dst-file))
-    change_indicator = 0
-    if (dst_files_to_be_deleted):
-        for file_path in dst_files_to_be_deleted:
-            try:
-                logger.debug('Deleting file {0}'.format(file_path))
-                delete_file(file_path)
-                logger.debug(' ... Successfully')
-            except Exception as error:
-                logger.debug(' ... Failed')
-                raise error
-                
-        logger.debug('Files deletion finished')
-        change_indicator += 1
-
-    if (dst_dirs_to_be_deleted):
-        for dir_path in dst_dirs_to_be_deleted:
-            try:
-                logger.debug('Deleting directory {0}'.format(dir_path))
-                delete_dir(dir_path)
-                logger.debug(' ... Successfully')
-            except Exception as error:
-                logger.debug(' ... Failed')
-                raise error
-        logger.debug('Dirs deletion finished')
-        change_indicator += 1
-
-    if (src_files_to_be_copied):
-        for src_path, dst_path in src_files_to_be_copied.items():
-            try:
-                logger.debug('Copying file {0} to {1}'.format(
-                    src_path, dst_path))
-                copy_file(src_path, dst_path)
-                logger.debug(' ... Successfully')
-            except Exception as error:
-                logger.debug(' ... Failed')
-                raise error
-        logger.debug('Files addition finished')
-        change_indicator += 1
-
-    if (src_dirs_to_be_copied):
-        for src_path, dst_path in src_dirs_to_be_copied.items():
-            try:
-                logger.debug('Copying directory {0} to {1}'.format(
-                    src_path, dst_path))
-                copy_dir(src_path, dst_path, ignore=ignore_files)
-                logger.debug(' ... Successfully')
-            except Exception as error:
-                logger.debug(' ... Failed')
-                raise error
-        logger.debug('Dirs addition finished')
-        change_indicator += 1
-
-    if change_indicator == 0:
+    pending = load_pending(repo.git_dir)
+    committed = False
+    if operation_count or cleaned:
+        logger.debug('Staging files...')
+        with phases.phase('stage'):
+            logger.debug('Reset current staging')
+            reset_staging(repo)
+
+            logger.info('Stage modified files into repo...')
+            added.append(os.path.join(repo_dir, '.gitignore'))
+            stage_paths(repo, added, cleaned + removed)
+
+        # files rewritten with the content they had, e.g. after a crash, leave the tree as it was
+        if repo.head.is_valid() and repo.index.write_tree() == repo.head.commit.tree:
+            logger.debug('Staged files match the last commit, nothing to commit')
+        else:
+            logger.info('Commit to repo...')
+            with phases.phase('commit'):
+                repo.index.commit(AUTO_COMMIT_MESSAGE)
+            pending = add_pending(pending, sum(copy_stats.bytes.values()))
+            committed = True
+    if committed:
+        changed = True
+    elif _is_pushed(repo) and not pending['remotes']:
         logger.info('All is up to date')
-        sys.exit(0)
+        # held back commits may have been pushed by hand
+        clear_pending(repo.git_dir)
+        _save_state(repo, config, manifest, journal)
+        return False
+    else:
+        changed = False
+
+    flush = not pending['commits'] or is_flush_due(flush_policy, pending)
+    if not flush:
+        logger.info('{0} commits are held back until the flush policy pushes them'.format(pending['commits']))
+        save_pending(repo.git_dir, pending)
+    elif flush_policy.squash:
+        squashed = squash_unpushed(repo, AUTO_COMMIT_MESSAGE)
+        if squashed:
+            logger.info('Squashed {0} unpushed commits into one'.format(squashed))
+
+    compacting = history is not None and history.retention is not None
+    if flush and compacting and is_maintenance_due(repo.git_dir, COMPACT, history.compact_interval):
+        with phases.phase('compact'):
+            compacted = compact_history(repo, AUTO_COMMIT_MESSAGE, time.time() - history.retention)
+        mark_maintenance(repo.git_dir, COMPACT)
+        if compacted:
+            logger.info('Squashed {0} commits older than the retention window into a snapshot'.format(compacted))
+
+    # the sync is committed, the push doesn't need the journal
+    _save_state(repo, config, manifest, journal)
+
+    if flush:
+        if not changed:
+            logger.info('Nothing changed, but earlier commits haven\'t reached the remote yet')
+        logger.info('Push to {0}...'.format(', '.join(target.name for target in targets)))
+        # pushed commits which were compacted, now or by a sync whose push failed, are replaced on the remotes
+        expected = rewritten_upstream(repo) if compacting else None
+        with phases.phase('push'):
+            pushing = push(repo, targets, mode=push_mode, log_path=os.path.join(repo.git_dir, 'gitsync-push.log'),
+                           expected=expected)
+        # a push which doesn't make it to origin is retried by the next sync, as the remote-tracking branch lags
+        # behind, other required remotes are noted by _finish_push
+        clear_pending(repo.git_dir)
+        if push_mode == PUSH_BACKGROUND:
+            pushing.add_done_callback(partial(_log_push_result, repo.git_dir))
+        elif pushing is not None:
+            lagging = _finish_push(repo.git_dir, pushing)
+            if lagging:
+                raise SyncError('Push to required remotes {0} failed, it is retried on the next sync'.format(
+                    ', '.join(lagging)))
+        changed = True
+
+    logger.info('Finished')
+    return changed
+
+
+def sync_direct(config_file, jobs=DEFAULT_JOBS, phases=None, push_mode=PUSH_WAIT, flush_policy=None, **sync_options):
+    """Sync files/dirs by writing them straight into the object database of the repo, then commit and push them
+
+    The working tree isn't touched, so the repo may even be bare. Every commit
+    is pushed right away to the remotes of the config, and waited for; push
+    modes, flush policies and a history section aren't supported.
 
-    logger.debug('Staging files...')
-    logger.debug('Reset current staging')
-    repo.index.reset()
+    Arguments:
+        config_file {str} -- Config file path
+
+    Keyword Arguments:
+        jobs {int} -- Number of blobs written concurrently (default: {DEFAULT_JOBS})
+        phases {Phases} -- Records wall time per phase if given (default: {None})
+        push_mode {str} -- Only PUSH_WAIT is supported (default: {PUSH_WAIT})
+        flush_policy {FlushPolicy} -- Only the default policy, every commit right away, is supported (default: {None})
+        sync_options -- Options of how sync copies and compares files in the working tree, which don't apply here
+
+    Raises:
+        SyncError -- Raises if the sync can't proceed, or is asked for what direct mode doesn't support
+
+    Returns:
+        bool -- Whether anything changed
+    """
+    from git import Repo, Remote, InvalidGitRepositoryError, NoSuchPathError
+
+    if push_mode != PUSH_WAIT:
+        raise SyncError('Push mode {0} isn\'t supported in direct mode, it always waits for the push'.format(push_mode))
+    if flush_policy is not None and flush_policy != FlushPolicy():
+        raise SyncError('Flush policies aren\'t supported in direct mode, it pushes every commit right away')
+
+    phases = phases or Phases()
+    config, ignore_files = load_sync_config(config_file)
+    repo_dir = config['repo_dir']
+    if config.get(HISTORY_KEY):
+        raise SyncError('The {0} section of {1} isn\'t supported in direct mode'.format(HISTORY_KEY, config_file))
+
+    logger.debug('Trying to read repo...')
+    try:
+        repo = Repo(repo_dir)
+        remote = Remote(repo, 'origin')
+        if not remote.exists():
+            raise SyncError(
+                'Can\'t find \'origin\' remote url. Please set a \'origin\' remote and upstream branch at first to proceed!')
+        targets = load_push_targets(config)
+        logger.info('Fetching from repo...')
+        with phases.phase('pull'):
+            fetch_fast_forward(repo, remote)
+    except InvalidGitRepositoryError as error:
+        raise SyncError('Invalid repo. Please check it again!')
+    except NoSuchPathError as error:
+        raise SyncError(
+            'No directory \'.git\' found. Did you initialize git project?!')
+    except (TypeError, ValueError) as error:
+        raise SyncError(error)
 
-    logger.info('Stage modified files into repo...')
-    repo.git.add(A=True)
+    if not repo.bare:
+        init_files(repo_dir, ignore_files)
 
-    logger.info('Commit to repo...')
-    repo.index.commit('[(auto-git) leave it here for later editing]')
+    logger.debug('Performing prechecks...')
+    try:
+        precheck(config['files'].keys(), config['dirs'].keys())
+    except Exception as error:
+        raise SyncError('Prechecks failed! {0}'.format(error))
 
-    logger.info('Push to remote origin server...')
-    remote.push()
+    # a bare repo has no working tree to keep the sync state in
+    state_dir = repo.git_dir if repo.bare else repo_dir
+    prev_config = None
+    prev_entries = None
+    if check_last_sync(state_dir):
+        prev_config = load_last_sync(state_dir)
+        prev_manifest = prev_config.get(MANIFEST_KEY) or {}
+        if prev_manifest.get('head') == repo.head.commit.hexsha:
+            prev_entries = prev_manifest.get(DIRECT_MANIFEST_KEY)
+
+    logger.info('Check files whether if updated')
+    with phases.phase('plan_objects'):
+        to_write, to_remove, entries = plan_objects(repo, config, ignore=IgnoreMatcher(ignore_files),
+                                                    prev_entries=prev_entries, prev_config=prev_config)
+    logger.debug('Sync state: \n\t\tFiles be written {0}\n\t\tFiles be removed {1}'.format(
+        list(to_write.keys()), to_remove))
+
+    logger.info('Write objects into repo...')
+    with phases.phase('write_objects'):
+        blobs = write_objects(repo, to_write, entries, jobs=jobs)
+    with phases.phase('commit'):
+        commit = commit_objects(repo, blobs, to_remove, AUTO_COMMIT_MESSAGE)
+    lagging = load_pending(repo.git_dir)['remotes']
+    if commit is None and not lagging:
+        logger.info('All is up to date')
+    else:
+        logger.info('Push to {0}...'.format(', '.join(target.name for target in targets)))
+        with phases.phase('push'):
+            results = push_branch(repo, targets)
+        clear_pending(repo.git_dir)
+        lagging = _finish_push(repo.git_dir, results)
 
     logger.debug('Saving current sync state...')
     try:
-        save_current_sync(repo_dir, config)
+        save_current_sync(state_dir, config, {DIRECT_MANIFEST_KEY: entries, 'head': repo.head.commit.hexsha})
     except Exception as error:
-        logger.error('Failed to save current sync state! {0}'.format(error))
-        sys.exit(1)
+        raise SyncError('Failed to save current sync state! {0}'.format(error))
+    if lagging:
+        raise SyncError('Push to required remotes {0} failed, it is retried on the next sync'.format(', '.join(lagging)))
     logger.info('Finished')
+    return commit is not None
+
+
+def status(config_file, jobs=DEFAULT_JOBS, compare=COMPARE_CONTENT):
+    """Work out what a sync would change, without running git or changing anything
+
+    Arguments:
+        config_file {str} -- Config file path
+
+    Keyword Arguments:
+        jobs {int} -- Number of concurrent scan jobs (default: {DEFAULT_JOBS})
+        compare {str} -- Compare changed sources with repo copies by content or with the blobs of the git index,
+                         see COMPARE_MODES (default: {COMPARE_CONTENT})
+
+    Raises:
+        SyncError -- Raises if the config or repo can't be checked
+
+    Returns:
+        list -- Pending operations
+    """
+    config, ignore_files = load_sync_config(config_file)
+    repo_dir = config['repo_dir']
+    if not os.path.isdir(repo_dir):
+        raise SyncError('Repo directory {0} doesn\'t exist!'.format(repo_dir))
+    try:
+        precheck(config['files'].keys(), config['dirs'].keys())
+    except Exception as error:
+        raise SyncError('Prechecks failed! {0}'.format(error))
+    prev_config = load_prev_state(repo_dir, read_head(repo_dir))
+    return list(iter_pending(config, prev_config, IgnoreMatcher(ignore_files, root=repo_dir), jobs=jobs,
+                             blobs=load_index_blobs(repo_dir, compare)))
+
+
+def print_status(operations):
+    """Print pending operations like `git status --short`
+
+    Arguments:
+        operations {list} -- Operations returned by status
+    """
+    if not operations:
+        print('Nothing to sync, all is up to date')
+        return
+    print('{0} pending changes:'.format(len(operations)))
+    for operation in operations:
+        if operation.src_path is None:
+            print('  {0:<12} {1}'.format(operation.action.replace('_', ' '), operation.dst_path))
+        else:
+            print('  {0:<12} {1} -> {2}'.format(operation.action.replace('_', ' '), operation.src_path, operation.dst_path))
+
+
+def _source_of(config, dst_path):
+    """Source path a repo path is synced from, None if it isn't mapped"""
+    repo_dir = config['repo_dir']
+    for src_path, dst_item in config['files'].items():
+        if os.path.join(repo_dir, dst_item) == dst_path:
+            return src_path
+    for src_root, dst_item in config['dirs'].items():
+        dst_root = os.path.join(repo_dir, dst_item)
+        if dst_path.startswith(os.path.join(dst_root, '')):
+            return os.path.join(src_root, os.path.relpath(dst_path, dst_root))
+    return None
+
+
+def restore(config_file, restore_dir=None):
+    """Write the content of every pointer in the repo from the large file store
+
+    Files which already exist are left alone.
+
+    Arguments:
+        config_file {str} -- Config file path
+
+    Keyword Arguments:
+        restore_dir {str} -- Content goes to the same relative path under this dir, to the mapped source path if not given (default: {None})
+
+    Raises:
+        SyncError -- Raises if there is no store or any pointer can't be restored
+
+    Returns:
+        int -- Number of files restored
+    """
+    config, _ = load_sync_config(config_file)
+    repo_dir = config['repo_dir']
+    try:
+        large_store = load_large_store(config)
+    except (KeyError, ValueError) as error:
+        raise SyncError('Can\'t set up the large file store: {0}'.format(error))
+    if large_store is None:
+        raise SyncError('No \'{0}\' store is set up in {1}'.format(LARGE_FILES_KEY, config_file))
+
+    restored = 0
+    failed = 0
+    for pointer_path, pointer in iter_pointers(repo_dir):
+        if restore_dir is not None:
+            target = os.path.join(restore_dir, os.path.relpath(pointer_path, repo_dir))
+        else:
+            target = _source_of(config, pointer_path)
+            if target is None:
+                logger.warning('{0} isn\'t synced from any source, skip it'.format(pointer_path))
+                continue
+        if os.path.lexists(target):
+            logger.info('{0} exists, skip it'.format(target))
+            continue
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            large_store.restore(pointer, target)
+        except Exception as error:
+            logger.error('Failed to restore {0}: {1}'.format(target, error))
+            failed += 1
+            continue
+        logger.info('Restored {0}'.format(target))
+        restored += 1
+    if failed:
+        raise SyncError('{0} files couldn\'t be restored!'.format(failed))
+    return restored
+
+
+def watch(config_file, debounce=DEFAULT_DEBOUNCE, direct=False, **sync_options):
+    """Keep running and sync debounced batches of source changes
+
+    Arguments:
+        config_file {str} -- Config file path
+
+    Keyword Arguments:
+        debounce {float} -- Seconds without changes closing a batch (default: {DEFAULT_DEBOUNCE})
+        direct {bool} -- Use sync_direct (default: {False})
+        sync_options -- Passed to sync
+    """
+    config, ignore_files = load_sync_config(config_file)
+    with Watcher(config['files'].keys(), config['dirs'], ignore=IgnoreMatcher(ignore_files)) as watcher:
+        # start from a full sync so nothing changed before the watch is missed
+        changed_paths = FULL_RESCAN
+        while True:
+            failed = False
+            try:
+                if direct:
+                    sync_direct(config_file, **sync_options)
+                else:
+                    sync(config_file, changed_paths=changed_paths, **sync_options)
+            except SyncError as error:
+                logger.error(error)
+                failed = True
+            logger.info('Watching for changes...')
+            changes = watcher.wait(debounce=debounce)
+            if changes is FULL_RESCAN or failed:
+                logger.info('Perform a full rescan on this batch')
+                changed_paths = FULL_RESCAN
+            else:
+                changed_paths = changes
+            logger.debug('Changed paths: {0}'.format(changed_paths))
+
+
+def find_config_files(paths):
+    """Expand dirs into the *.json config files they contain
+
+    Arguments:
+        paths {list} -- Config file or dir paths
+
+    Returns:
+        list -- Config file paths, in given order and sorted within dirs
+    """
+    config_files = []
+    for item in paths:
+        if os.path.isdir(item):
+            config_files.extend(sorted(glob.glob(os.path.join(item, '*.json'))))
+        else:
+            config_files.append(item)
+    return list(OrderedDict.fromkeys(os.path.abspath(config_file) for config_file in config_files))
+
+
+def _sync_group(config_files, direct, sync_options):
+    """Sync configs one by one in a batch worker, never raising so other configs go on"""
+    results = []
+    for config_file in config_files:
+        phases = Phases()
+        started = time.perf_counter()
+        result = OrderedDict(config_file=config_file)
+        try:
+            if direct:
+                changed = sync_direct(config_file, phases=phases, **sync_options)
+            else:
+                changed = sync(config_file, phases=phases, **sync_options)
+            result['status'] = 'changed' if changed else 'up to date'
+        except Exception as error:
+            logger.error('{0}: {1}'.format(config_file, error))
+            result['status'] = 'failed'
+            result['error'] = str(error) or error.__class__.__name__
+        result['seconds'] = time.perf_counter() - started
+        result['phases'] = phases.timings
+        results.append(result)
+    # the worker may exit without joining a background push
+    wait_for_push()
+    return results
+
+
+def batch(config_files, concurrency=DEFAULT_CONCURRENCY, direct=False, **sync_options):
+    """Sync many configs in parallel worker processes, started once for the whole batch
+
+    Configs syncing into the same repo run one after another in the same worker.
+
+    Arguments:
+        config_files {list} -- Config file paths
+
+    Keyword Arguments:
+        concurrency {int} -- Maximum number of worker processes (default: {DEFAULT_CONCURRENCY})
+        direct {bool} -- Use sync_direct (default: {False})
+        sync_options -- Passed to sync
+
+    Returns:
+        list -- Result of each config in given order: config_file, status ('changed', 'up to date' or 'failed'), error if failed, seconds and phases
+    """
+    groups = OrderedDict()
+    for config_file in config_files:
+        try:
+            repo_dir = os.path.realpath(load_config(config_file)['repo_dir'])
+        except Exception:
+            # let the sync report what is wrong with it
+            repo_dir = config_file
+        groups.setdefault(repo_dir, []).append(config_file)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=max(1, min(concurrency, len(groups) or 1))) as executor:
+        futures = [executor.submit(_sync_group, group, direct, sync_options) for group in groups.values()]
+        for future in futures:
+            for result in future.result():
+                results[result['config_file']] = result
+    return [results[config_file] for config_file in config_files]
+
+
+def log_batch_summary(results, seconds):
+    """Log status and timings of every config of a batch
+
+    Arguments:
+        results {list} -- Results returned by batch
+        seconds {float} -- Wall time of the whole batch
+    """
+    statuses = [result['status'] for result in results]
+    logger.info('Batch summary: {0} configs in {1:.2f}s, {2} changed, {3} up to date, {4} failed'.format(
+        len(results), seconds, statuses.count('changed'), statuses.count('up to date'), statuses.count('failed')))
+    for result in results:
+        phases = ', '.join('{0} {1:.2f}s'.format(name, elapsed) for name, elapsed in result['phases'].items())
+        logger.info('  {0:<10} {1:>7.2f}s  {2}  ({3})'.format(result['status'], result['seconds'], result['config_file'],
+                                                         result.get('error') or phases or 'no phase reached'))
+
+
+def log_push_summary(results):
+    """Log status and timing of every remote of a push
+
+    Arguments:
+        results {list} -- Results returned by push_targets
+    """
+    for result in results:
+        message = 'Push to {0}: {1} in {2:.2f}s, {3} attempt{4}{5}'.format(
+            result['remote'], result['status'], result['seconds'], result['attempts'],
+            '' if result['attempts'] == 1 else 's', '' if result['required'] else ', best-effort')
+        if result['status'] != 'failed':
+            logger.info(message)
+        elif result['required']:
+            logger.error('{0}: {1}'.format(message, result['error']))
+        else:
+            logger.warning('{0}: {1}'.format(message, result['error']))
+
+
+def main():
+    """Entrypoint to 'gitsync' command-line tool
+    
+    """
+    parser = argparse.ArgumentParser(
+        description='File-sync integrated with Git system solution tool')
+    parser.add_argument('command', help='sync (default), status to list pending changes without running git, or restore to write files kept in the large file store',
+                        nargs='?', choices=COMMANDS, default='sync')
+    parser.add_argument('-d', '--debug',
+                        action='store_true',
+                        default=False,
+                        help='show more message for debugging')
+    parser.add_argument('--config_file', help='Specify the location of the settings (Default value: settings.json)',
+                        type=str, default=os.path.join(os.getcwd(), 'settings.json'))
+    parser.add_argument('-j', '--jobs', help='Number of concurrent scan and copy/delete jobs (Default value: {0})'.format(DEFAULT_JOBS),
+                        type=int, default=DEFAULT_JOBS)
+    parser.add_argument('--copy_strategy', help='How files are copied into the repo: {0} (Default value: auto)'.format('|'.join(COPY_STRATEGIES)),
+                        choices=COPY_STRATEGIES, default='auto')
+    parser.add_argument('--compare', help='Compare changed sources with their repo copies by content, or hash only the sources and compare with the blobs the git index records for the copies: {0} (Default value: {1})'.format('|'.join(COMPARE_MODES), COMPARE_CONTENT),
+                        choices=COMPARE_MODES, default=COMPARE_CONTENT)
+    parser.add_argument('--delta_threshold', help='Size in MiB from which files already in the repo only get their changed blocks rewritten, 0 disables it (Default value: {0})'.format(DELTA_THRESHOLD // (1024 * 1024)),
+                        type=int, default=DELTA_THRESHOLD // (1024 * 1024))
+    parser.add_argument('--push', help='wait for the push, run it in the background (watch and batch mode go on meanwhile) or detach it into a git process outliving gitsync: {0} (Default value: {1})'.format('|'.join(PUSH_MODES), PUSH_WAIT),
+                        choices=PUSH_MODES, default=PUSH_WAIT)
+    parser.add_argument('--flush_commits', help='Push once this many commits are held back, 0 never pushes on the count alone (Default value: 1, every commit)',
+                        type=int, default=1)
+    parser.add_argument('--flush_interval', help='Push once the oldest held back commit is this many seconds old',
+                        type=float, default=None)
+    parser.add_argument('--flush_size', help='Push once held back commits changed this many MiB',
+                        type=float, default=None)
+    parser.add_argument('--squash', help='Squash held back auto-commits into one before pushing them',
+                        action='store_true', default=False)
+    parser.add_argument('--restore_dir', help='Where restore writes files, by their path in the repo (Default value: their source paths)',
+                        type=str, default=None)
+    parser.add_argument('--full', help='Pull and check the repo even if no source changed since the last sync',
+                        action='store_true', default=False)
+    parser.add_argument('--watch', help='Keep running and sync whenever sources change (Linux only)',
+                        action='store_true', default=False)
+    parser.add_argument('--debounce', help='Seconds without changes before a sync starts in watch mode (Default value: {0})'.format(DEFAULT_DEBOUNCE),
+                        type=float, default=DEFAULT_DEBOUNCE)
+    parser.add_argument('--direct', help='Write changed files straight into the object database of the repo without copying them into its working tree',
+                        action='store_true', default=False)
+    parser.add_argument('--batch', help='Sync every given config file and *.json file in given dirs in parallel, then print a summary',
+                        type=str, nargs='+', metavar='PATH', default=None)
+    parser.add_argument('--concurrency', help='Number of configs synced at once in batch mode (Default value: {0})'.format(DEFAULT_CONCURRENCY),
+                        type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--profile', help='Write a JSON report of phase timings, I/O counters and git command durations to this file',
+                        type=str, default=None)
+    parser.add_argument('--cprofile', help='Dump cProfile stats of the run to this file',
+                        type=str, default=None)
+    parser.add_argument('--init', help='Create a template configuration file',
+                        action='store_true', default=False)
+    parser.add_argument('--version', help='Print the GitSync version number',
+                        action='version', version=__version__)
+
+    # Read a set of arguments
+    args = parser.parse_args()
+    COMMAND = args.command
+    FULL = args.full
+    RESTORE_DIR = args.restore_dir
+    PUSH = args.push
+    FLUSH_POLICY = FlushPolicy(commits=args.flush_commits or None, interval=args.flush_interval,
+                               size=None if args.flush_size is None else int(args.flush_size * 1024 * 1024),
+                               squash=args.squash)
+    DEBUG = args.debug
+    CONFIG_FILE = args.config_file
+    INIT = args.init
+    JOBS = args.jobs
+    COPY_STRATEGY = args.copy_strategy
+    COMPARE = args.compare
+    DELTA_THRESHOLD_BYTES = args.delta_threshold * 1024 * 1024
+    WATCH = args.watch
+    DEBOUNCE = args.debounce
+    DIRECT = args.direct
+    PROFILE = args.profile
+    CPROFILE = args.cprofile
+    BATCH = args.batch
+    CONCURRENCY = args.concurrency
+
+    if BATCH is not None and WATCH:
+        parser.error('--batch can\'t be combined with --watch')
+    if BATCH is not None and (PROFILE or CPROFILE):
+        parser.error('--batch syncs in worker processes which can\'t be profiled')
+    if DIRECT and (PUSH != PUSH_WAIT or FLUSH_POLICY != FlushPolicy()):
+        parser.error('--direct pushes every commit right away, it can\'t be combined with --push or the flush options')
+
+    # Set Logging Level
+    if DEBUG:
+        for handler in logging.root.handlers[:]:
+            logging.root.removeHandler(handler)
+        logging.basicConfig(level=logging.DEBUG, format=FORMAT)
+
+    logger.debug('Config file: {0}'.format(CONFIG_FILE))
+    
+    if INIT:
+        logger.info('Generate a template setting.json')
+        with open('settings_default.json', 'w') as f:
+            f.writelines(json.dumps(DEFAULT_SETTING, indent=4))
+        sys.exit()
+
+    # a profile covers the whole run, all batches in watch mode
+    profiler = Profiler() if PROFILE else None
+    cprofiler = cProfile.Profile() if CPROFILE else None
+    try:
+        with ExitStack() as stack:
+            if profiler is not None:
+                stack.enter_context(profiler.activate())
+            if cprofiler is not None:
+                cprofiler.enable()
+                stack.callback(cprofiler.disable)
+            if COMMAND == 'status':
+                print_status(status(CONFIG_FILE, jobs=JOBS, compare=COMPARE))
+            elif COMMAND == 'restore':
+                logger.info('Restored {0} files'.format(restore(CONFIG_FILE, restore_dir=RESTORE_DIR)))
+            elif BATCH is not None:
+                config_files = find_config_files(BATCH)
+                if not config_files:
+                    raise SyncError('No config files found in {0}'.format(', '.join(BATCH)))
+                started = time.perf_counter()
+                results = batch(config_files, concurrency=CONCURRENCY, direct=DIRECT, jobs=JOBS, copy_strategy=COPY_STRATEGY, delta_threshold=DELTA_THRESHOLD_BYTES, full=FULL, push_mode=PUSH, flush_policy=FLUSH_POLICY, compare=COMPARE)
+                log_batch_summary(results, time.perf_counter() - started)
+                if any(result['status'] == 'failed' for result in results):
+                    sys.exit(1)
+            elif WATCH:
+                watch(CONFIG_FILE, debounce=DEBOUNCE, direct=DIRECT, jobs=JOBS, copy_strategy=COPY_STRATEGY, delta_threshold=DELTA_THRESHOLD_BYTES, full=FULL, push_mode=PUSH, flush_policy=FLUSH_POLICY, compare=COMPARE, phases=profiler)
+            elif DIRECT:
+                sync_direct(CONFIG_FILE, jobs=JOBS, push_mode=PUSH, flush_policy=FLUSH_POLICY, phases=profiler)
+            else:
+                sync(CONFIG_FILE, jobs=JOBS, copy_strategy=COPY_STRATEGY, delta_threshold=DELTA_THRESHOLD_BYTES, full=FULL, push_mode=PUSH, flush_policy=FLUSH_POLICY, compare=COMPARE, phases=profiler)
+            wait_for_push()
+    except (SyncError, WatchError) as error:
+        logger.error(error)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        logger.info('Stopped')
+    finally:
+        if profiler is not None:
+            profiler.write_report(PROFILE)
+            logger.info('Profile report written to {0}'.format(PROFILE))
+        if cprofiler is not None:
+            cprofiler.dump_stats(CPROFILE)
+            logger.info('cProfile stats written to {0}'.format(CPROFILE))
 
 
 if __name__ == '__main__':
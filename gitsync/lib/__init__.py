@@ -1,3 +1,19 @@
 from .file import *
+from .delta import *
 from .folder import *
 from .util import *
+from .manifest import *
+from .executor import *
+from .watch import *
+from .stage import *
+from .odb import *
+from .ignore import *
+from .profile import *
+from .push import *
+from .flush import *
+from .store import *
+from .index import *
+from .blobs import *
+from .journal import *
+from .history import *
+from .schedule import *
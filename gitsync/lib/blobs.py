@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Index Blobs
+
+Looks up the blob sha1 the git index records for a repo copy, so a changed
+source can be compared by hashing it alone: its git blob hash either equals
+the recorded one or the copy is outdated. An index entry only describes the
+copy while the copy's stat still matches what the index recorded for it,
+otherwise the copy is compared by content as before.
+"""
+from os import path, stat
+from stat import S_IFMT, S_IFREG
+from threading import Lock
+import struct
+from .profile import count, STAT_CALLS
+
+__all__ = ['IndexBlobs', 'read_index_blobs', 'COMPARE_CONTENT', 'COMPARE_INDEX', 'COMPARE_MODES']
+
+# compare changed sources with their repo copies byte by byte, or with the blob recorded in the git index
+COMPARE_CONTENT = 'content'
+COMPARE_INDEX = 'index'
+
+COMPARE_MODES = [COMPARE_CONTENT, COMPARE_INDEX]
+
+# private constant
+# signature, version, number of entries
+HEADER = struct.Struct('>4sII')
+# ctime s/ns, mtime s/ns, dev, ino, mode, uid, gid, size, sha1, flags
+ENTRY = struct.Struct('>10I20sH')
+EXTENDED_FLAG = 0x4000
+STAGE_MASK = 0x3000
+# index entries hold the low 32 bits of size and inode
+LOW_BITS = 0xffffffff
+
+
+def _varint(data, offset):
+    # offset encoding of index v4 path prefixes
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7f
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7f)
+    return value, offset
+
+
+def read_index_blobs(git_dir):
+    """Blobs of the regular files of a git index, conflicted entries excluded
+
+    Arguments:
+        git_dir {str} -- Git dir
+
+    Returns:
+        dict -- Path relative to the work tree to (sha1 hex, size, mtime_ns, inode) as recorded by the index,
+                None if there is no index or its version isn't supported
+    """
+    try:
+        with open(path.join(git_dir, 'index'), 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    if len(data) < HEADER.size:
+        return None
+    signature, version, entries = HEADER.unpack_from(data)
+    if signature != b'DIRC' or version not in (2, 3, 4):
+        return None
+    blobs = {}
+    offset = HEADER.size
+    name = b''
+    for _ in range(entries):
+        start = offset
+        (_, _, mtime_s, mtime_ns, _, inode, mode, _, _, size, sha, flags) = ENTRY.unpack_from(data, offset)
+        offset += ENTRY.size
+        if version >= 3 and flags & EXTENDED_FLAG:
+            offset += 2
+        if version == 4:
+            strip, offset = _varint(data, offset)
+            end = data.index(b'\0', offset)
+            name = name[:len(name) - strip] + data[offset:end]
+            offset = end + 1
+        else:
+            end = data.index(b'\0', offset)
+            name = data[offset:end]
+            # NUL padded to a multiple of 8 bytes, at least one NUL
+            offset = start + ((end - start) // 8 + 1) * 8
+        if flags & STAGE_MASK or S_IFMT(mode) != S_IFREG:
+            continue
+        blobs[name.decode('utf-8', 'surrogateescape')] = (sha.hex(), size, mtime_s * 1000000000 + mtime_ns, inode)
+    return blobs
+
+
+class IndexBlobs(object):
+    """Blobs the git index of a repo records for its copies, read once on first use
+
+    Arguments:
+        repo_dir {str} -- Work tree of the repo
+        git_dir {str} -- Git dir of the repo
+    """
+
+    def __init__(self, repo_dir, git_dir):
+        self.repo_dir = repo_dir
+        self.git_dir = git_dir
+        self._blobs = None
+        self._index_mtime_ns = None
+        self._lock = Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._blobs is None:
+                try:
+                    self._index_mtime_ns = stat(path.join(self.git_dir, 'index')).st_mtime_ns
+                except FileNotFoundError:
+                    self._index_mtime_ns = 0
+                self._blobs = read_index_blobs(self.git_dir) or {}
+        return self._blobs
+
+    def blob_of(self, dst_path):
+        """Blob sha1 of a repo copy as recorded by the index
+
+        Arguments:
+            dst_path {str} -- Path of the copy
+
+        Returns:
+            str -- Hex sha1, None if the index has no entry for the copy or the copy changed since it was indexed
+        """
+        recorded = self._load().get(path.relpath(dst_path, self.repo_dir).replace(path.sep, '/'))
+        if recorded is None:
+            return None
+        count(STAT_CALLS)
+        try:
+            stat_result = stat(dst_path)
+        except OSError:
+            return None
+        sha, size, mtime_ns, inode = recorded
+        if stat_result.st_size & LOW_BITS != size or stat_result.st_mtime_ns != mtime_ns:
+            return None
+        if inode and stat_result.st_ino & LOW_BITS != inode:
+            return None
+        # racily clean: written within the timestamp granularity of the index, the copy may have changed unnoticed
+        if stat_result.st_mtime_ns >= self._index_mtime_ns:
+            return None
+        return sha
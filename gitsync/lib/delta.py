@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Delta Copy
+
+Updates large destination files in place, rewriting only the fixed-size
+blocks whose content differs from the source. Block digests of every
+destination are cached, so the next update doesn't read it again. Unlike
+other copies an update isn't atomic: one interrupted halfway leaves the
+destination partly rewritten, for the journal recovery to have it checked
+again.
+"""
+from os import path, fstat, stat, replace, remove, makedirs
+from hashlib import blake2b, sha1
+import struct
+from .profile import count, BYTES_READ
+
+__all__ = ['BlockCache', 'delta_copy', 'DELTA_THRESHOLD', 'BLOCK_SIZE']
+
+# files of at least DELTA_THRESHOLD bytes are updated block by block
+DELTA_THRESHOLD = 64 * 1024 * 1024
+BLOCK_SIZE = 1024 * 1024
+
+# private constant
+DIGEST_SIZE = 16
+# size, mtime_ns and inode of the destination the digests describe, and the block size
+HEADER = struct.Struct('<QQQQ')
+
+
+def _signature(stat_result):
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+class BlockCache(object):
+    """Block digests of destination files, one cache file per destination
+
+    Arguments:
+        cache_dir {str} -- Dir holding the cache files, created when needed
+
+    Keyword Arguments:
+        threshold {int} -- Minimum file size updated block by block (default: {DELTA_THRESHOLD})
+        block_size {int} -- Block size (default: {BLOCK_SIZE})
+    """
+
+    def __init__(self, cache_dir, threshold=DELTA_THRESHOLD, block_size=BLOCK_SIZE):
+        self.cache_dir = cache_dir
+        self.threshold = threshold
+        self.block_size = block_size
+
+    def _entry_path(self, dst_path):
+        return path.join(self.cache_dir, sha1(path.abspath(dst_path).encode()).hexdigest())
+
+    def load(self, dst_path, stat_result):
+        """Block digests of a destination, None if there are none for its current state
+
+        Arguments:
+            dst_path {str} -- Destination path
+            stat_result {os.stat_result} -- Stat result of the destination
+
+        Returns:
+            list -- Digests
+        """
+        try:
+            with open(self._entry_path(dst_path), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        size, mtime_ns, inode, block_size = HEADER.unpack_from(data)
+        if (size, mtime_ns, inode) != _signature(stat_result) or block_size != self.block_size:
+            return None
+        body = data[HEADER.size:]
+        if len(body) != -(-size // block_size) * DIGEST_SIZE:
+            return None
+        return [body[offset:offset + DIGEST_SIZE] for offset in range(0, len(body), DIGEST_SIZE)]
+
+    def store(self, dst_path, stat_result, digests):
+        """Save block digests of a destination in its current state
+
+        Arguments:
+            dst_path {str} -- Destination path
+            stat_result {os.stat_result} -- Stat result of the destination
+            digests {list} -- Digests
+        """
+        makedirs(self.cache_dir, exist_ok=True)
+        entry_path = self._entry_path(dst_path)
+        tmp_path = '{0}.tmp'.format(entry_path)
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(*(_signature(stat_result) + (self.block_size,))))
+            f.write(b''.join(digests))
+        replace(tmp_path, entry_path)
+
+    def discard(self, dst_path):
+        """Forget the digests of a destination
+
+        Arguments:
+            dst_path {str} -- Destination path
+        """
+        try:
+            remove(self._entry_path(dst_path))
+        except FileNotFoundError:
+            pass
+
+
+def _read_block(f, view):
+    """Read into view until it is full or the file ends, returning the number of bytes read"""
+    length = 0
+    while length < len(view):
+        read = f.readinto(view[length:])
+        if not read:
+            break
+        length += read
+    return length
+
+
+def delta_copy(src_path, dst_path, cache):
+    """Make an existing destination identical to its source by rewriting the blocks which differ
+
+    The destination is only read for blocks without a cached digest. A source
+    which shrinks meanwhile is copied up to where it ends and the destination
+    cut there, the next sync sees its new signature and checks it again.
+
+    Arguments:
+        src_path {str} -- Source path
+        dst_path {str} -- Destination path, must exist
+        cache {BlockCache} -- Block digests
+
+    Returns:
+        tuple -- (size, bytes written)
+    """
+    block_size = cache.block_size
+    written = 0
+    dst_read = 0
+    digests = []
+    buffer = bytearray(block_size)
+    dst_buffer = bytearray(block_size)
+    with open(src_path, 'rb', buffering=0) as src, open(dst_path, 'r+b') as dst:
+        size = fstat(src.fileno()).st_size
+        dst_stat = fstat(dst.fileno())
+        prev_digests = cache.load(dst_path, dst_stat) or []
+        if dst_stat.st_size != size:
+            dst.truncate(size)
+            # the old last block may have been partial
+            prev_digests = prev_digests[:min(dst_stat.st_size, size) // block_size]
+        for index, offset in enumerate(range(0, size, block_size)):
+            wanted = min(block_size, size - offset)
+            length = _read_block(src, memoryview(buffer)[:wanted])
+            if length < wanted:
+                # the source shrank while it was read
+                size = offset + length
+                dst.truncate(size)
+                if not length:
+                    break
+            block = memoryview(buffer)[:length]
+            digest = blake2b(block, digest_size=DIGEST_SIZE).digest()
+            if index < len(prev_digests) and length == wanted:
+                changed = prev_digests[index] != digest
+            else:
+                dst.seek(offset)
+                changed = dst_buffer[:_read_block(dst, memoryview(dst_buffer)[:length])] != block
+                dst_read += length
+            if changed:
+                dst.seek(offset)
+                dst.write(block)
+                written += length
+            digests.append(digest)
+            if length < wanted:
+                break
+    count(BYTES_READ, size + dst_read)
+    cache.store(dst_path, stat(dst_path), digests)
+    return size, written
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Sync Executor
+
+Runs copy/delete operations concurrently while they are still being planned.
+An operation waits for earlier operations on the same path, on one of its
+parent dirs or on anything below it, so deleting a destination always happens
+before copying into it. A move touches both its old and its new path.
+"""
+from os import path, stat, lstat
+from collections import namedtuple
+from functools import partial
+from threading import BoundedSemaphore, Lock
+from concurrent.futures import ThreadPoolExecutor, wait
+from .file import copy_file, copy_link, delete_file, COPY
+from .folder import copy_dir, delete_dir, move_path
+
+__all__ = ['Operation', 'DELETE_FILE', 'DELETE_DIR', 'COPY_FILE', 'COPY_DIR', 'COPY_LINK', 'MOVE', 'DEFAULT_JOBS',
+           'plan_operations', 'collect_operations', 'run_operation', 'execute_operations']
+
+DELETE_FILE = 'delete_file'
+DELETE_DIR = 'delete_dir'
+COPY_FILE = 'copy_file'
+COPY_DIR = 'copy_dir'
+# copies a symlink in a synced dir as a link, like copy_dir does
+COPY_LINK = 'copy_link'
+# moves a repo copy, src_path is its old path in the repo
+MOVE = 'move'
+
+DEFAULT_JOBS = 8
+
+# private constant
+# operations submitted but not finished yet per job, bounds memory while planning runs ahead
+PENDING_PER_JOB = 4
+
+# a tuple with empty __slots__, so records carry no per-instance dict
+Operation = namedtuple('Operation', ['action', 'src_path', 'dst_path'])
+
+
+def plan_operations(src_files_to_be_copied, src_dirs_to_be_copied, dst_files_to_be_deleted, dst_dirs_to_be_deleted,
+                    moves=None):
+    """Turn the result of check_sync_state into a list of operations, moves first, then deletions
+
+    Keyword Arguments:
+        moves {dict} -- Old repo path to new repo path of moved repo copies (default: {None})
+
+    Returns:
+        list -- Operations
+    """
+    operations = [Operation(MOVE, old_path, new_path) for old_path, new_path in (moves or {}).items()]
+    operations.extend(Operation(DELETE_FILE, None, dst_path) for dst_path in dst_files_to_be_deleted)
+    operations.extend(Operation(DELETE_DIR, None, dst_path) for dst_path in dst_dirs_to_be_deleted)
+    operations.extend(Operation(COPY_FILE, src_path, dst_path) for src_path, dst_path in src_files_to_be_copied.items())
+    operations.extend(Operation(COPY_DIR, src_path, dst_path) for src_path, dst_path in src_dirs_to_be_copied.items())
+    return operations
+
+
+def collect_operations(operations, moves=None):
+    """Group operations by action, the inverse of plan_operations, symlinks count as files to be copied
+
+    Arguments:
+        operations {iterable} -- Operations
+
+    Keyword Arguments:
+        moves {dict} -- Filled with old repo path to new repo path of moves, which are dropped if not given (default: {None})
+
+    Returns:
+        tuple -- files to be copied, dirs to be copied, files to be deleted, dirs to be deleted
+    """
+    src_files_to_be_copied = {}
+    src_dirs_to_be_copied = {}
+    dst_files_to_be_deleted = []
+    dst_dirs_to_be_deleted = []
+    for operation in operations:
+        if operation.action in (COPY_FILE, COPY_LINK):
+            src_files_to_be_copied[operation.src_path] = operation.dst_path
+        elif operation.action == COPY_DIR:
+            src_dirs_to_be_copied[operation.src_path] = operation.dst_path
+        elif operation.action == DELETE_FILE:
+            dst_files_to_be_deleted.append(operation.dst_path)
+        elif operation.action == MOVE:
+            if moves is not None:
+                moves[operation.src_path] = operation.dst_path
+        else:
+            dst_dirs_to_be_deleted.append(operation.dst_path)
+    return src_files_to_be_copied, src_dirs_to_be_copied, dst_files_to_be_deleted, dst_dirs_to_be_deleted
+
+
+def run_operation(operation, ignore=[], strategy=COPY, stats=None, block_cache=None, large_store=None):
+    """Perform a single operation
+
+    Arguments:
+        operation {Operation} -- Operation
+
+    Keyword Arguments:
+        ignore {list} -- Ignore patterns or IgnoreMatcher used in copy_dir (default: {[]})
+        strategy {str} -- Copy strategy, see copy_file (default: {COPY})
+        stats {CopyStats} -- Records the copy strategy used (default: {None})
+        block_cache {BlockCache} -- Enables delta copies of large files, see copy_file (default: {None})
+        large_store {LargeFileStore} -- Keeps the files it applies to, see copy_file (default: {None})
+    """
+    if operation.action == DELETE_FILE:
+        delete_file(operation.dst_path)
+        if block_cache is not None:
+            block_cache.discard(operation.dst_path)
+    elif operation.action == DELETE_DIR:
+        delete_dir(operation.dst_path)
+    elif operation.action == COPY_FILE:
+        copy_file(operation.src_path, operation.dst_path, strategy=strategy, stats=stats, block_cache=block_cache,
+                  large_store=large_store)
+    elif operation.action == COPY_LINK:
+        copy_link(operation.src_path, operation.dst_path, stats=stats)
+    elif operation.action == MOVE:
+        move_path(operation.src_path, operation.dst_path)
+        if block_cache is not None:
+            block_cache.discard(operation.src_path)
+    elif operation.action == COPY_DIR:
+        copy_dir(operation.src_path, operation.dst_path, ignore=ignore, strategy=strategy, stats=stats,
+                 large_store=large_store)
+    else:
+        raise ValueError('Unknown operation {0}'.format(operation.action))
+
+
+def _touched(operation):
+    # repo paths an operation changes, the source of a move is removed by it
+    if operation.action == MOVE:
+        return [operation.dst_path, operation.src_path]
+    return [operation.dst_path]
+
+
+def _dependencies(paths, scheduled):
+    dependencies = set()
+    for touched in paths:
+        current = touched
+        while True:
+            if current in scheduled:
+                dependencies.add(scheduled[current])
+            parent = path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+        prefix = path.join(touched, '')
+        dependencies.update(future for scheduled_path, future in scheduled.items()
+                            if scheduled_path.startswith(prefix))
+    return list(dependencies)
+
+
+def _run(operation, dependencies, options, journal=None, number=None):
+    # dependencies were submitted earlier and the pool picks tasks in order,
+    # so they are already running or finished
+    wait(dependencies)
+    entry = None
+    if journal is not None and operation.action in (COPY_FILE, COPY_LINK):
+        # the source as it was before the copy, if it changes meanwhile the next sync sees it
+        stat_result = (lstat if operation.action == COPY_LINK else stat)(operation.src_path)
+        entry = [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+    run_operation(operation, **options)
+    if journal is not None:
+        journal.done(number, entry)
+
+
+def execute_operations(operations, jobs=DEFAULT_JOBS, ignore=[], strategy=COPY, stats=None, max_pending=None,
+                       block_cache=None, large_store=None, journal=None):
+    """Perform operations concurrently, keeping the order of operations touching the same path
+
+    Operations are pulled from the iterable only while fewer than max_pending
+    are unfinished, so a generator planning them keeps running alongside and
+    memory stays bounded. Failures don't stop other operations, they are
+    collected and returned.
+
+    Arguments:
+        operations {iterable} -- Operations in planned order
+
+    Keyword Arguments:
+        jobs {int} -- Maximum number of operations run concurrently (default: {DEFAULT_JOBS})
+        ignore {list} -- Ignore patterns or IgnoreMatcher used in copy_dir (default: {[]})
+        strategy {str} -- Copy strategy, see copy_file (default: {COPY})
+        stats {CopyStats} -- Records the copy strategy used (default: {None})
+        max_pending {int} -- Maximum number of unfinished operations, PENDING_PER_JOB per job if not given (default: {None})
+        block_cache {BlockCache} -- Enables delta copies of large files, see copy_file (default: {None})
+        large_store {LargeFileStore} -- Keeps the files it applies to, see copy_file (default: {None})
+        journal {Journal} -- Records every operation before it starts and once it finished (default: {None})
+
+    Returns:
+        list -- (operation, error) of every failed operation
+    """
+    jobs = max(1, jobs)
+    options = {'ignore': ignore, 'strategy': strategy, 'stats': stats, 'block_cache': block_cache,
+               'large_store': large_store}
+    slots = BoundedSemaphore(max_pending or jobs * PENDING_PER_JOB)
+    lock = Lock()
+    # unfinished operations by the paths they touch, what later operations may have to wait for
+    scheduled = {}
+    failures = []
+
+    def finished(operation, future):
+        error = future.exception()
+        with lock:
+            for touched in _touched(operation):
+                if scheduled.get(touched) is future:
+                    del scheduled[touched]
+            if error is not None:
+                failures.append((operation, error))
+        slots.release()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for operation in operations:
+            slots.acquire()
+            number = journal.plan(operation) if journal is not None else None
+            with lock:
+                touched = _touched(operation)
+                dependencies = _dependencies(touched, scheduled)
+                future = executor.submit(_run, operation, dependencies, options, journal, number)
+                for touched_path in touched:
+                    scheduled[touched_path] = future
+            future.add_done_callback(partial(finished, operation))
+    return failures
@@ -2,28 +2,258 @@
 """File Operations
 
 """
-from shutil import copyfile, ignore_patterns
-from os import remove
+from shutil import copyfile, copymode, ignore_patterns
+from os import remove, link, replace, fstat, path, readlink, symlink
+from threading import Lock
+import errno
+import os
+from .profile import count, BYTES_READ, BYTES_COPIED
+from .delta import delta_copy
 
-__all__ = ['copy_file', 'delete_file']
+try:
+    from fcntl import ioctl
+except ImportError:
+    # not available on this platform
+    ioctl = None
 
+__all__ = ['copy_file', 'copy_link', 'delete_file', 'CopyStats', 'COPY_STRATEGIES', 'TMP_SUFFIX']
 
-def copy_file(src_path, dst_path):
+AUTO = 'auto'
+REFLINK = 'reflink'
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+HARDLINK = 'hardlink'
+COPY = 'copy'
+# used by auto and copy for large files which already exist in the repo, not selectable
+DELTA = 'delta'
+# files kept in a large file store get a pointer in the repo whatever the strategy
+POINTER = 'pointer'
+
+COPY_STRATEGIES = [AUTO, REFLINK, COPY_FILE_RANGE, HARDLINK, COPY]
+
+# copies are written next to their destination with this suffix and renamed into place once complete
+TMP_SUFFIX = '.gitsync-tmp'
+
+# private constant
+FICLONE = 0x40049409
+CHUNK_SIZE = 64 * 1024 * 1024
+# errors meaning the strategy isn't supported for these files, so the next one is tried
+UNSUPPORTED_ERRORS = (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP,
+                      errno.ENOTTY, errno.EBADF, errno.EPERM, errno.EMLINK)
+
+
+class CopyStats(object):
+    """Thread-safe counters of which copy strategy handled how many files and bytes
+
+    Bytes copied by any other strategy than plain copy never go through userspace
+    and are counted as saved, so are unchanged blocks of delta copies.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.files = {}
+        self.bytes = {}
+        self._saved = 0
+
+    def record(self, strategy, size, saved=None):
+        with self._lock:
+            self.files[strategy] = self.files.get(strategy, 0) + 1
+            self.bytes[strategy] = self.bytes.get(strategy, 0) + size
+            self._saved += (0 if strategy == COPY else size) if saved is None else saved
+
+    @property
+    def bytes_saved(self):
+        return self._saved
+
+    def summary(self):
+        used = ', '.join('{0} {1} files'.format(strategy, count) for strategy, count in sorted(self.files.items()))
+        return '{0} (saved {1} bytes of userspace copying)'.format(used or 'no files copied', self.bytes_saved)
+
+
+def _unsupported(error):
+    return isinstance(error, OSError) and error.errno in UNSUPPORTED_ERRORS
+
+
+def _reflink(src_fd, dst_fd, size):
+    if ioctl is None:
+        raise OSError(errno.ENOSYS, 'reflink is not supported on this platform')
+    ioctl(dst_fd, FICLONE, src_fd)
+    return size
+
+
+def _copy_file_range(src_fd, dst_fd, size):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, 'copy_file_range is not supported on this platform')
+    copied = 0
+    while copied < size:
+        sent = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _sendfile(src_fd, dst_fd, size):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, 'sendfile is not supported on this platform')
+    copied = 0
+    while copied < size:
+        sent = os.sendfile(dst_fd, src_fd, copied, min(CHUNK_SIZE, size - copied))
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _kernel_copy(src_path, dst_path, methods):
+    """Copy a file with the first of given fd-level methods the filesystem supports
+
+    Returns:
+        tuple -- (strategy, size), strategy is None if none of methods is supported or one of them copied less
+                 than the size of the source, which is then left to a userspace copy
+    """
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        size = fstat(src.fileno()).st_size
+        for strategy, method in methods:
+            try:
+                copied = method(src.fileno(), dst.fileno(), size)
+            except OSError as error:
+                if not _unsupported(error):
+                    raise error
+                copied = None
+            if copied == size:
+                return strategy, size
+            # start over with the next method
+            dst.truncate(0)
+            os.lseek(dst.fileno(), 0, os.SEEK_SET)
+            os.lseek(src.fileno(), 0, os.SEEK_SET)
+            if copied is not None:
+                # the source ended early, e.g. it shrank meanwhile, a userspace copy takes what it holds now
+                break
+    return None, size
+
+
+def _hardlink(src_path, dst_path):
+    src_path = path.realpath(src_path)
+    tmp_path = dst_path + TMP_SUFFIX
+    link(src_path, tmp_path)
+    replace(tmp_path, dst_path)
+    return HARDLINK, os.stat(dst_path).st_size
+
+
+def _delta_applies(src_path, dst_path, strategy, block_cache):
+    if block_cache is None or strategy not in (AUTO, COPY):
+        return False
+    if path.islink(dst_path) or not path.isfile(dst_path):
+        return False
+    return os.stat(src_path).st_size >= block_cache.threshold
+
+
+def copy_file(src_path, dst_path, strategy=COPY, stats=None, block_cache=None, large_store=None):
     """Copy a file from source path to specific destination
 
+    Strategies other than plain copy fall back to the next cheaper one if the
+    filesystem doesn't support them: reflink, copy_file_range, sendfile, copy.
+    With a block cache, auto and copy update large existing destinations in
+    place, rewriting only the blocks that changed. Files the large file store
+    takes are replaced by a pointer. Other copies are written aside and
+    renamed over the destination once complete.
+
     Arguments:
         src_path {str} -- Source path
         dst_path {str} -- Destination path
 
+    Keyword Arguments:
+        strategy {str} -- One of COPY_STRATEGIES (default: {COPY})
+        stats {CopyStats} -- Records the strategy used (default: {None})
+        block_cache {BlockCache} -- Enables delta copies of files above its threshold (default: {None})
+        large_store {LargeFileStore} -- Keeps the files it applies to, see LargeFileStore.applies (default: {None})
+
     Raises:
         error -- raises if any error occurred in this operation.
     """
     try:
-        copyfile(src_path, dst_path, follow_symlinks=True)
+        used = None
+        if path.exists(dst_path) and path.samefile(src_path, dst_path):
+            # hardlinked by a previous sync, never write through it into the source
+            remove(dst_path)
+        if large_store is not None and large_store.applies(dst_path, os.stat(src_path).st_size):
+            size, added = large_store.write_pointer(src_path, dst_path)
+            if stats is not None:
+                stats.record(POINTER, size, saved=size - added)
+            count(BYTES_COPIED, added)
+            return
+        if _delta_applies(src_path, dst_path, strategy, block_cache):
+            size, written = delta_copy(src_path, dst_path, block_cache)
+            if stats is not None:
+                stats.record(DELTA, size, saved=size - written)
+            count(BYTES_COPIED, written)
+            return
+        if strategy == HARDLINK:
+            try:
+                used, size = _hardlink(src_path, dst_path)
+            except OSError as error:
+                if not _unsupported(error):
+                    raise error
+        if used is None:
+            # a destination is either its old or its new copy, never a partial one
+            tmp_path = dst_path + TMP_SUFFIX
+            try:
+                if strategy not in (COPY, HARDLINK):
+                    methods = [(REFLINK, _reflink), (COPY_FILE_RANGE, _copy_file_range), (SENDFILE, _sendfile)]
+                    if strategy == COPY_FILE_RANGE:
+                        methods = methods[1:]
+                    used, size = _kernel_copy(src_path, tmp_path, methods)
+                if used is None:
+                    copyfile(src_path, tmp_path, follow_symlinks=True)
+                    used, size = COPY, os.stat(tmp_path).st_size
+                if path.exists(dst_path):
+                    # like writing into it did, the copy keeps the mode of the destination
+                    copymode(dst_path, tmp_path)
+                replace(tmp_path, dst_path)
+            except BaseException:
+                if path.lexists(tmp_path):
+                    remove(tmp_path)
+                raise
+        if stats is not None:
+            stats.record(used, size)
+        count(BYTES_COPIED, size)
+        if used == COPY:
+            count(BYTES_READ, size)
     except Exception as error:
         raise error
 
 
+def copy_link(src_path, dst_path, stats=None):
+    """Copy a symlink as a link, the way copy_dir copies the links in a dir
+
+    The link is created aside and renamed over the destination, so like with
+    copy_file a destination is either its old or its new copy.
+
+    Arguments:
+        src_path {str} -- Source path of the symlink
+        dst_path {str} -- Destination path
+
+    Keyword Arguments:
+        stats {CopyStats} -- Records the copy (default: {None})
+
+    Raises:
+        error -- raises if any error occurred in this operation.
+    """
+    target = readlink(src_path)
+    tmp_path = dst_path + TMP_SUFFIX
+    if path.lexists(tmp_path):
+        remove(tmp_path)
+    symlink(target, tmp_path)
+    try:
+        replace(tmp_path, dst_path)
+    except BaseException:
+        remove(tmp_path)
+        raise
+    if stats is not None:
+        stats.record(COPY, 0)
+
+
 def delete_file(file_path):
     """Delete a file with given path
 
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Flush Policy
+
+Every sync which changes something commits locally, a flush policy decides
+when the commits collected since the last push are pushed: after a number
+of commits, once the oldest of them is old enough, or once enough bytes
+changed. Unpushed auto-commits can be squashed into one before the push.
+"""
+from collections import namedtuple
+from os import path, remove, replace
+import json
+import time
+
+__all__ = ['FlushPolicy', 'load_pending', 'save_pending', 'clear_pending', 'add_pending', 'is_flush_due',
+           'squash_unpushed', 'PENDING_FILE']
+
+# commits not pushed yet by the flush policy are recorded in this file of the git dir
+PENDING_FILE = 'gitsync-pending'
+
+# push after commits commits, interval seconds or size bytes, whichever comes first, None never triggers;
+# the default pushes every commit
+FlushPolicy = namedtuple('FlushPolicy', ['commits', 'interval', 'size', 'squash'])
+FlushPolicy.__new__.__defaults__ = (1, None, None, False)
+
+
+def _empty():
+    return {'commits': 0, 'bytes': 0, 'since': None, 'remotes': []}
+
+
+def load_pending(git_dir):
+    """Commits held back since the last push
+
+    Arguments:
+        git_dir {str} -- Git dir
+
+    Returns:
+        dict -- commits, bytes changed by them, since when (epoch seconds, None if there are none) and
+                remotes, required remotes the last push didn't reach
+    """
+    try:
+        with open(path.join(git_dir, PENDING_FILE)) as f:
+            pending = json.load(f)
+    except (OSError, ValueError):
+        return _empty()
+    record = _empty()
+    record.update((key, pending[key]) for key in record if key in pending)
+    return record
+
+
+def save_pending(git_dir, pending):
+    """Record commits held back since the last push
+
+    Arguments:
+        git_dir {str} -- Git dir
+        pending {dict} -- As returned by load_pending
+    """
+    file_path = path.join(git_dir, PENDING_FILE)
+    with open(file_path + '.tmp', 'w') as f:
+        json.dump(pending, f)
+    replace(file_path + '.tmp', file_path)
+
+
+def clear_pending(git_dir):
+    """Forget held back commits once they are pushed
+
+    Arguments:
+        git_dir {str} -- Git dir
+    """
+    try:
+        remove(path.join(git_dir, PENDING_FILE))
+    except FileNotFoundError:
+        pass
+
+
+def add_pending(pending, size, now=None):
+    """Count one more commit held back
+
+    Arguments:
+        pending {dict} -- As returned by load_pending
+        size {int} -- Bytes changed by the commit
+
+    Keyword Arguments:
+        now {float} -- Epoch seconds of the commit (default: {None}, the current time)
+
+    Returns:
+        dict -- Updated record
+    """
+    record = dict(pending)
+    record['commits'] += 1
+    record['bytes'] += size
+    if record['since'] is None:
+        record['since'] = time.time() if now is None else now
+    return record
+
+
+def is_flush_due(policy, pending, now=None):
+    """Whether held back commits are to be pushed now
+
+    Arguments:
+        policy {FlushPolicy} -- Flush policy
+        pending {dict} -- As returned by load_pending
+
+    Keyword Arguments:
+        now {float} -- Epoch seconds (default: {None}, the current time)
+
+    Returns:
+        bool -- True if any limit of the policy is reached
+    """
+    if not pending['commits']:
+        return False
+    if policy.commits is not None and pending['commits'] >= policy.commits:
+        return True
+    if policy.size is not None and pending['bytes'] >= policy.size:
+        return True
+    if policy.interval is not None and pending['since'] is not None:
+        now = time.time() if now is None else now
+        return now - pending['since'] >= policy.interval
+    return False
+
+
+def squash_unpushed(repo, message):
+    """Replace the commits not on the remote-tracking branch yet by a single one with the same tree
+
+    Nothing happens unless all of them are linear commits with given message,
+    so merges and commits made by hand are never rewritten.
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        message {str} -- Message of auto-commits, also used for the squashed commit
+
+    Returns:
+        int -- Number of commits squashed, 0 if nothing was done
+    """
+    from git import Commit
+    try:
+        tracking = repo.active_branch.tracking_branch()
+        base = tracking.commit if tracking is not None else None
+    except (TypeError, ValueError):
+        # detached HEAD or no such remote-tracking branch
+        return 0
+    if base is None:
+        return 0
+    commits = list(repo.iter_commits('{0}..HEAD'.format(base.hexsha)))
+    if len(commits) < 2:
+        return 0
+    if any(len(commit.parents) != 1 or commit.message != message for commit in commits):
+        return 0
+    if commits[-1].parents[0] != base:
+        return 0
+    Commit.create_from_tree(repo, commits[0].tree, message, parent_commits=[base], head=True)
+    return len(commits)
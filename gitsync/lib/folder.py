@@ -1,11 +1,13 @@
 #!/usr/bin/env python3
-from shutil import copyfile, copytree, rmtree, move, ignore_patterns, Error
-from os import remove
+from shutil import copyfile, copytree, copystat, rmtree, move, ignore_patterns, Error
+from os import remove, path, rename, makedirs
+from .file import copy_file, COPY
+from .ignore import IgnoreMatcher
 
-__all__ = ['copy_dir', 'delete_dir']
+__all__ = ['copy_dir', 'delete_dir', 'move_path']
 
 
-def copy_dir(src_path, dst_path, ignore=[]):
+def copy_dir(src_path, dst_path, ignore=[], strategy=COPY, stats=None, large_store=None):
     """Copy a folder recursively from source path to specific destination
     
     Arguments:
@@ -13,18 +15,42 @@ def copy_dir(src_path, dst_path, ignore=[]):
         dst_path {str} -- Destination path
     
     Keyword Arguments:
-        ignore {list} -- Ignore patterns used in the operation where any directory or file named with one of patterns is ignored (default: {[]})
+        ignore {list} -- Ignore patterns used in the operation where any directory or file named with one of patterns is ignored, or an IgnoreMatcher rooted at the repo (default: {[]})
+        strategy {str} -- Copy strategy of files, see copy_file (default: {COPY})
+        stats {CopyStats} -- Records the strategy used for each file (default: {None})
+        large_store {LargeFileStore} -- Keeps the files it applies to, see copy_file (default: {None})
     
     Raises:
         error -- raises if any error occurred in this operation.
     """
+    def copy_function(src, dst):
+        copy_file(src, dst, strategy=strategy, stats=stats, large_store=large_store)
+        copystat(src, dst)
+
+    if isinstance(ignore, IgnoreMatcher):
+        ignore_function = _matcher_ignore(ignore, src_path, dst_path)
+    else:
+        ignore_function = ignore_patterns(*ignore)
+
     try:
         copytree(src_path, dst_path, symlinks=True,
-                 ignore=ignore_patterns(*ignore))
+                 ignore=ignore_function, copy_function=copy_function)
     except Exception as error:
         raise error
 
 
+def _matcher_ignore(matcher, src_path, dst_path):
+    """copytree ignore function matching entries by their destination"""
+    base = matcher.base_of(dst_path)
+
+    def ignore_function(src_dir, names):
+        rel_dir = path.relpath(src_dir, src_path)
+        rel_dir = base if rel_dir == path.curdir else path.join(base, rel_dir)
+        return set(name for name in names
+                   if matcher.match(path.join(rel_dir, name), path.isdir(path.join(src_dir, name))))
+    return ignore_function
+
+
 def delete_dir(dir_path):
     """Delete a folder recursively with given path
     
@@ -44,3 +70,17 @@ def delete_dir(dir_path):
         pass
     except Exception as error:
         raise error
+
+
+def move_path(src_path, dst_path):
+    """Move a file or folder within the same filesystem, creating missing parent dirs of the destination
+
+    Arguments:
+        src_path {str} -- Current path
+        dst_path {str} -- New path, must not exist
+
+    Raises:
+        error -- raises if any error occurred in this operation.
+    """
+    makedirs(path.dirname(dst_path), exist_ok=True)
+    rename(src_path, dst_path)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""History Policy
+
+Keeps a backup repo from growing with its history, opted in by the history
+section of a config: the upstream branch is fetched no deeper than a number
+of commits, auto-commits older than a retention window are squashed into a
+single snapshot commit from time to time, and the repo is garbage collected
+on a schedule so what neither of them keeps reachable is eventually dropped
+from disk.
+"""
+from collections import namedtuple
+from os import path, replace
+import json
+import time
+
+__all__ = ['HistoryPolicy', 'load_history_policy', 'pull_history', 'compact_history', 'rewritten_upstream', 'collect_garbage',
+           'is_maintenance_due', 'mark_maintenance', 'HISTORY_KEY', 'HISTORY_FILE', 'SNAPSHOT_MESSAGE',
+           'COMPACT', 'GC']
+
+# config section of the history policy
+HISTORY_KEY = 'history'
+
+# when maintenance last ran is recorded in this file of the git dir
+HISTORY_FILE = 'gitsync-history'
+
+# message of the commit squashed auto-commits are replaced by, with the date of the newest of them
+SNAPSHOT_MESSAGE = '[(auto-git) snapshot of history up to {0}]'
+
+# maintenance tasks
+COMPACT = 'compact'
+GC = 'gc'
+
+# fetch depth in commits, retention window, compaction and gc intervals in seconds; None disables each of them
+HistoryPolicy = namedtuple('HistoryPolicy', ['depth', 'retention', 'compact_interval', 'gc_interval'])
+HistoryPolicy.__new__.__defaults__ = (None, None, 86400.0, 7 * 86400.0)
+
+# private constant
+DAY = 86400.0
+SNAPSHOT_PREFIX = SNAPSHOT_MESSAGE[:SNAPSHOT_MESSAGE.index('{')]
+
+
+def _days(options, key, default):
+    days = options.get(key, default)
+    return None if days is None else float(days) * DAY
+
+
+def load_history_policy(config):
+    """History policy set up by the history section of a config
+
+    Arguments:
+        config {dict} -- Config, history holds depth, retention_days, compact_interval_days (default 1) and
+                         gc_interval_days (default 7), null disables one
+
+    Raises:
+        ValueError -- Raises if depth is less than 1
+
+    Returns:
+        HistoryPolicy -- Policy, None if the config has no history section
+    """
+    options = config.get(HISTORY_KEY)
+    if not options:
+        return None
+    depth = options.get('depth')
+    if depth is not None and int(depth) < 1:
+        raise ValueError('History depth must be at least 1')
+    return HistoryPolicy(depth=None if depth is None else int(depth),
+                         retention=_days(options, 'retention_days', None),
+                         compact_interval=_days(options, 'compact_interval_days', 1),
+                         gc_interval=_days(options, 'gc_interval_days', 7))
+
+
+def _is_auto(commit, message):
+    # git commit -m ends messages with a newline, GitPython doesn't
+    return commit.message.rstrip('\n') == message or commit.message.startswith(SNAPSHOT_PREFIX)
+
+
+def pull_history(repo, remote, message, depth=None):
+    """Fetch the upstream branch, at most depth commits deep, and bring the current branch up to it
+
+    A branch the remote rewrote, e.g. compacted by another machine, replaces
+    the local one as long as the local commits it lacks are auto-commits:
+    the sync redoes what they changed.
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        remote {git.Remote} -- Remote
+        message {str} -- Message of auto-commits
+
+    Keyword Arguments:
+        depth {int} -- Fetch depth in commits, None fetches all history (default: {None})
+
+    Returns:
+        str -- How the branch was updated: 'fast-forward', 'reset' or 'merge', None if it was up to date
+    """
+    options = {} if depth is None else {'depth': depth}
+    tracking = repo.active_branch.tracking_branch()
+    if tracking is None:
+        remote.pull(**options)
+        return 'merge'
+    try:
+        fetched = tracking.commit.hexsha
+    except ValueError:
+        # nothing fetched yet
+        fetched = None
+    remote.fetch(tracking.remote_head, **options)
+    upstream = tracking.commit
+    head = repo.head.commit
+    if upstream == head or repo.is_ancestor(upstream, head):
+        return None
+    if repo.is_ancestor(head, upstream):
+        repo.git.merge('--ff-only', upstream.hexsha)
+        return 'fast-forward'
+    if fetched is not None and all(_is_auto(commit, message)
+                                   for commit in repo.iter_commits('{0}..{1}'.format(fetched, head.hexsha))):
+        repo.git.reset('--hard', upstream.hexsha)
+        return 'reset'
+    repo.git.merge(upstream.hexsha)
+    return 'merge'
+
+
+def _shallow_commits(git_dir):
+    try:
+        with open(path.join(git_dir, 'shallow')) as f:
+            return set(f.read().split())
+    except FileNotFoundError:
+        return set()
+
+
+def compact_history(repo, message, cutoff):
+    """Squash the auto-commits older than cutoff into one snapshot commit and replay the newer commits on top
+
+    Only the first-parent chain of HEAD is looked at. Squashing stops at the
+    first older commit which isn't an auto-commit or a snapshot, at merges and
+    at the boundary of a shallow repo, which are all kept; nothing happens if
+    a merge is among the newer commits. Trees, authors and dates stay as they
+    were, only the commit ids of the replayed commits change.
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        message {str} -- Message of auto-commits
+        cutoff {float} -- Epoch seconds, commits made before are squashed
+
+    Returns:
+        int -- Number of commits squashed, 0 if nothing was done
+    """
+    from git import Commit
+    shallow = _shallow_commits(repo.git_dir)
+    newer = []
+    squashed = []
+    base = None
+    for commit in repo.iter_commits('HEAD', first_parent=True):
+        if not squashed and commit.committed_date >= cutoff:
+            if len(commit.parents) != 1 or commit.hexsha in shallow:
+                return 0
+            newer.append(commit)
+            continue
+        if not _is_auto(commit, message) or len(commit.parents) > 1 or commit.hexsha in shallow:
+            base = commit
+            break
+        squashed.append(commit)
+    if len(squashed) < 2:
+        return 0
+    newest = squashed[0]
+    parent = Commit.create_from_tree(
+        repo, newest.tree, SNAPSHOT_MESSAGE.format(newest.committed_datetime.strftime('%Y-%m-%d %H:%M:%S %z')),
+        parent_commits=[base] if base is not None else [], head=not newer, author=newest.author,
+        committer=newest.committer, author_date=newest.authored_datetime, commit_date=newest.committed_datetime)
+    for index, commit in enumerate(reversed(newer)):
+        parent = Commit.create_from_tree(
+            repo, commit.tree, commit.message, parent_commits=[parent], head=index == len(newer) - 1,
+            author=commit.author, committer=commit.committer, author_date=commit.authored_datetime,
+            commit_date=commit.committed_datetime)
+    return len(squashed)
+
+
+def rewritten_upstream(repo):
+    """Commit of the upstream branch which HEAD no longer descends from, as after compacting pushed commits
+
+    Arguments:
+        repo {git.Repo} -- Repo
+
+    Returns:
+        str -- Hex sha of the upstream commit, None if HEAD descends from it or there is no upstream branch
+    """
+    try:
+        tracking = repo.active_branch.tracking_branch()
+        upstream = tracking.commit if tracking is not None else None
+    except (TypeError, ValueError):
+        # detached HEAD or nothing fetched yet
+        return None
+    if upstream is None or repo.is_ancestor(upstream, repo.head.commit):
+        return None
+    return upstream.hexsha
+
+
+def collect_garbage(repo):
+    """Repack the repo and drop what history no longer reaches
+
+    Git's own expiry applies (gc.reflogExpireUnreachable, gc.pruneExpire),
+    so squashed commits stay recoverable from the reflog for a while and go
+    with a later run.
+
+    Arguments:
+        repo {git.Repo} -- Repo
+    """
+    repo.git.gc('--quiet')
+
+
+def _load_record(git_dir):
+    try:
+        with open(path.join(git_dir, HISTORY_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_maintenance_due(git_dir, task, interval, now=None):
+    """Whether a maintenance task is due
+
+    Arguments:
+        git_dir {str} -- Git dir
+        task {str} -- COMPACT or GC
+        interval {float} -- Seconds between runs, None never runs
+
+    Keyword Arguments:
+        now {float} -- Epoch seconds (default: {None}, the current time)
+
+    Returns:
+        bool -- True if the task never ran or ran at least interval seconds ago
+    """
+    if interval is None:
+        return False
+    last = _load_record(git_dir).get(task)
+    now = time.time() if now is None else now
+    return last is None or now - last >= interval
+
+
+def mark_maintenance(git_dir, task, now=None):
+    """Record that a maintenance task ran
+
+    Arguments:
+        git_dir {str} -- Git dir
+        task {str} -- COMPACT or GC
+
+    Keyword Arguments:
+        now {float} -- Epoch seconds (default: {None}, the current time)
+    """
+    record = _load_record(git_dir)
+    record[task] = time.time() if now is None else now
+    file_path = path.join(git_dir, HISTORY_FILE)
+    with open(file_path + '.tmp', 'w') as f:
+        json.dump(record, f)
+    replace(file_path + '.tmp', file_path)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""Ignore Matcher
+
+Compiles ignore patterns once with gitignore semantics: globs, `**`,
+patterns anchored to the repo root, dir-only patterns and negation. Paths
+are matched relative to the repo root, like the .gitignore written from them.
+"""
+from os import path
+import re
+
+__all__ = ['IgnoreMatcher', 'as_matcher']
+
+# private constant
+GLOB_CHARS = re.compile(r'[*?\[\\]')
+
+
+def _translate(glob):
+    """Translate a gitignore glob to a regex, `*` and `?` never match `/`"""
+    result = []
+    index = 0
+    length = len(glob)
+    while index < length:
+        char = glob[index]
+        if glob.startswith('**/', index) and (index == 0 or glob[index - 1] == '/'):
+            result.append('(?:.*/)?')
+            index += 3
+            continue
+        if glob.startswith('/**', index) and index + 3 == length:
+            result.append('/.*')
+            break
+        if char == '*':
+            result.append('[^/]*')
+        elif char == '?':
+            result.append('[^/]')
+        elif char == '\\' and index + 1 < length:
+            index += 1
+            result.append(re.escape(glob[index]))
+        elif char == '[':
+            end = glob.find(']', index + 2 if glob.startswith('[!', index) or glob.startswith('[^', index) else index + 1)
+            if end < 0:
+                result.append(re.escape(char))
+            else:
+                body = glob[index + 1:end]
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                result.append('[{0}]'.format(body.replace('\\', '\\\\')))
+                index = end
+        else:
+            result.append(re.escape(char))
+        index += 1
+    return ''.join(result)
+
+
+def _compile(regexes):
+    if not regexes:
+        return None
+    return re.compile('(?:{0})$'.format('|'.join(regexes)))
+
+
+class _Run(object):
+    """Consecutive patterns of the same sign, matched at once"""
+
+    __slots__ = ('negated', 'names', 'dir_names', 'name_regex', 'dir_name_regex', 'regex', 'dir_regex')
+
+    def __init__(self, negated, rules):
+        self.negated = negated
+        # unanchored patterns never contain a slash, so they only look at the basename,
+        # through a set if they have no glob characters either
+        self.names = set()
+        self.dir_names = set()
+        name_regexes = []
+        dir_name_regexes = []
+        regexes = []
+        dir_regexes = []
+        for glob, anchored, dir_only in rules:
+            if anchored:
+                (dir_regexes if dir_only else regexes).append(_translate(glob))
+            elif GLOB_CHARS.search(glob):
+                (dir_name_regexes if dir_only else name_regexes).append(_translate(glob))
+            else:
+                (self.dir_names if dir_only else self.names).add(glob)
+        self.name_regex = _compile(name_regexes)
+        self.dir_name_regex = _compile(dir_name_regexes)
+        self.regex = _compile(regexes)
+        self.dir_regex = _compile(dir_regexes)
+
+    def match(self, rel_path, name, is_dir):
+        if name in self.names or (self.name_regex is not None and self.name_regex.match(name)):
+            return True
+        if self.regex is not None and self.regex.match(rel_path):
+            return True
+        if not is_dir:
+            return False
+        if name in self.dir_names or (self.dir_name_regex is not None and self.dir_name_regex.match(name)):
+            return True
+        return self.dir_regex is not None and self.dir_regex.match(rel_path) is not None
+
+
+class IgnoreMatcher(object):
+    """Compiled ignore patterns
+
+    The last matching pattern decides, so a negated pattern re-includes what an
+    earlier one ignored. Walkers should skip ignored dirs without descending into
+    them, which is also why git can't re-include a file of an ignored dir.
+
+    Arguments:
+        patterns {list} -- Patterns in gitignore syntax
+
+    Keyword Arguments:
+        root {str} -- Path the patterns are relative to, normally the repo dir (default: {None})
+    """
+
+    def __init__(self, patterns, root=None):
+        self.patterns = list(patterns)
+        self.root = root
+        self._runs = []
+        rules = []
+        negated = False
+        for pattern in self.patterns:
+            pattern = pattern.rstrip('\n')
+            if not pattern.strip() or pattern.startswith('#'):
+                continue
+            this_negated = pattern.startswith('!')
+            if this_negated:
+                pattern = pattern[1:]
+            elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            # a slash at the beginning or in the middle anchors the pattern to the root
+            anchored = '/' in pattern
+            pattern = pattern.lstrip('/')
+            if not pattern:
+                continue
+            if rules and this_negated != negated:
+                self._runs.append(_Run(negated, rules))
+                rules = []
+            negated = this_negated
+            rules.append((pattern, anchored, dir_only))
+        if rules:
+            self._runs.append(_Run(negated, rules))
+        self._runs.reverse()
+
+    def __bool__(self):
+        return bool(self._runs)
+
+    def relative(self, abs_path):
+        """Path relative to root of the matcher, '' for root itself"""
+        rel_path = path.relpath(abs_path, self.root) if self.root is not None else abs_path
+        return '' if rel_path == path.curdir else rel_path.replace(path.sep, '/')
+
+    def base_of(self, dir_path):
+        """Path of a dir relative to root to prefix paths walked under it, '' if the matcher has no root"""
+        return self.relative(dir_path) if self.root is not None else ''
+
+    def match(self, rel_path, is_dir=False):
+        """Whether a path relative to root is ignored
+
+        Arguments:
+            rel_path {str} -- Path relative to root, with '/' separators
+
+        Keyword Arguments:
+            is_dir {bool} -- Whether the path is a directory (default: {False})
+
+        Returns:
+            bool -- Whether ignored
+        """
+        name = rel_path.rpartition('/')[2]
+        for run in self._runs:
+            if run.match(rel_path, name, is_dir):
+                return not run.negated
+        return False
+
+    def match_path(self, abs_path, is_dir=False):
+        """Whether an absolute path under root is ignored"""
+        return self.match(self.relative(abs_path), is_dir)
+
+
+def as_matcher(ignore, root=None):
+    """Return ignore as is if it is an IgnoreMatcher already, otherwise compile it
+
+    Arguments:
+        ignore {IgnoreMatcher|list} -- Matcher or patterns, None for nothing ignored
+
+    Keyword Arguments:
+        root {str} -- Root of compiled patterns (default: {None})
+
+    Returns:
+        IgnoreMatcher -- Matcher
+    """
+    if isinstance(ignore, IgnoreMatcher):
+        return ignore
+    return IgnoreMatcher(ignore or [], root=root)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""Manifest Index
+
+Keeps manifest entries in a binary file read through mmap: a header, then
+fixed-width records sorted by key, then the keys themselves. Lookups are a
+binary search over the records, so nothing is parsed when the file is opened.
+Changes are appended to a log next to it and folded into a rewritten table
+once the log grows past a fraction of the table.
+
+Entries are grouped in tables, e.g. ('files',) or ('dirs', source dir). A key
+is the table path and the entry name joined by NUL bytes, so every table is a
+contiguous range of the sorted records.
+"""
+from os import fstat, replace, remove
+from collections.abc import Mapping, ItemsView
+from bisect import bisect_left
+from mmap import mmap, ACCESS_READ
+import json
+import struct
+
+__all__ = ['ManifestIndex', 'EntriesView', 'write_index', 'diff_entries', 'iter_keyed', 'table_prefix', 'LOG_SUFFIX', 'COMPACT_RATIO', 'COMPACT_MIN']
+
+# changes to the index are appended to the file of the index path with this suffix
+LOG_SUFFIX = '.log'
+
+# the log is folded into the index once it has more than COMPACT_RATIO times the number of records, and COMPACT_MIN
+COMPACT_RATIO = 0.25
+COMPACT_MIN = 1024
+
+# private constant
+MAGIC = b'GSMANIDX'
+VERSION = 1
+# magic, version, number of records
+HEADER = struct.Struct('<8sIQ')
+# key offset, key length, flags, size, mtime_ns, inode, git blob sha1
+RECORD = struct.Struct('<QIIQqQ20s')
+KEY_LOCATION = struct.Struct('<QI')
+DIR_FLAG = 1
+DIGEST_FLAG = 2
+SEPARATOR = '\0'
+DELETED = object()
+
+
+def _encode(name):
+    return name.encode('utf-8', 'surrogateescape')
+
+
+def _decode(key):
+    return key.decode('utf-8', 'surrogateescape')
+
+
+def table_prefix(table):
+    """Key prefix of a table
+
+    Arguments:
+        table {tuple} -- Table path, e.g. ('files',) or ('dirs', source dir)
+
+    Returns:
+        bytes -- Prefix of all keys of the table
+    """
+    return _encode(''.join(part + SEPARATOR for part in table))
+
+
+def _pack(key_offset, key_length, entry):
+    if entry is None:
+        return RECORD.pack(key_offset, key_length, DIR_FLAG, 0, 0, 0, b'')
+    size, mtime_ns, inode, digest = entry
+    if digest is None:
+        return RECORD.pack(key_offset, key_length, 0, size, mtime_ns, inode, b'')
+    return RECORD.pack(key_offset, key_length, DIGEST_FLAG, size, mtime_ns, inode, bytes.fromhex(digest))
+
+
+def write_index(index_path, items):
+    """Write entries as a new index, replacing the old one and its log
+
+    The file is written aside and renamed into place, readers which still map
+    the old one keep reading it.
+
+    Arguments:
+        index_path {str} -- Index file path
+        items {iterable} -- (key, entry) pairs in any order, entries are None for dirs
+    """
+    items = sorted(items, key=lambda item: item[0])
+    tmp_path = '{0}.tmp'.format(index_path)
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(items)))
+        key_offset = HEADER.size + RECORD.size * len(items)
+        for key, entry in items:
+            f.write(_pack(key_offset, len(key), entry))
+            key_offset += len(key)
+        for key, _ in items:
+            f.write(key)
+    replace(tmp_path, index_path)
+    try:
+        remove(index_path + LOG_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def iter_keyed(table, entries):
+    """Entries of a table by their key in the index
+
+    Arguments:
+        table {tuple} -- Table path
+        entries {dict} -- Entry name to entry
+
+    Yields:
+        tuple -- (key, entry)
+    """
+    prefix = table_prefix(table)
+    for name, entry in entries.items():
+        yield prefix + _encode(name), entry
+
+
+def diff_entries(index, table, entries):
+    """Changes which turn a table of an index into given entries
+
+    Arguments:
+        index {ManifestIndex} -- Index
+        table {tuple} -- Table path
+        entries {dict} -- Entry name to entry
+
+    Returns:
+        tuple -- (changes, deleted) as taken by ManifestIndex.update
+    """
+    old = dict(index.iter_prefix(table_prefix(table)))
+    changes = {}
+    for key, entry in iter_keyed(table, entries):
+        if old.pop(key, DELETED) != entry:
+            changes[key] = entry
+    return changes, list(old)
+
+
+class ManifestIndex(object):
+    """Entries of an index and its log as they were when opened
+
+    The file stays mapped until the index is closed, which a with block does
+    on exit.
+
+    Arguments:
+        index_path {str} -- Index file path, doesn't need to exist
+
+    Raises:
+        ValueError -- raises if the file isn't an index of this version, or is truncated
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.count = 0
+        self._map = None
+        base = None
+        try:
+            with open(index_path, 'rb') as f:
+                stat_result = fstat(f.fileno())
+                base = (stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+                if stat_result.st_size:
+                    self._map = mmap(f.fileno(), 0, access=ACCESS_READ)
+        except FileNotFoundError:
+            pass
+        if self._map is not None:
+            try:
+                self._check()
+            except ValueError:
+                self.close()
+                raise
+        self._log = {}
+        log_size = self._read_log()
+        self._log_keys = sorted(self._log)
+        # identifies the state read, a writer which finds the same stamp on disk knows nothing changed since
+        self.stamp = (base, log_size)
+
+    def _check(self):
+        size = len(self._map)
+        if size < HEADER.size:
+            raise ValueError('{0} is truncated'.format(self.index_path))
+        magic, version, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{0} isn\'t a manifest index of version {1}'.format(self.index_path, VERSION))
+        if size < HEADER.size + self.count * RECORD.size:
+            raise ValueError('{0} is truncated'.format(self.index_path))
+        if self.count:
+            # keys follow the records in order, the last one ends the file
+            key_offset, key_length = KEY_LOCATION.unpack_from(self._map, HEADER.size + (self.count - 1) * RECORD.size)
+            if key_offset + key_length > size:
+                raise ValueError('{0} is truncated'.format(self.index_path))
+
+    def close(self):
+        """Unmap the index file, entries can't be looked up afterwards"""
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_log(self):
+        size = 0
+        try:
+            with open(self.index_path + LOG_SUFFIX, 'rb') as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # torn line of an interrupted append, nothing after it was written
+                        break
+                    self._log[_encode(change[0])] = change[1] if len(change) > 1 else DELETED
+                    size += len(line)
+        except FileNotFoundError:
+            pass
+        return size
+
+    def _key(self, position):
+        key_offset, key_length = KEY_LOCATION.unpack_from(self._map, HEADER.size + position * RECORD.size)
+        return self._map[key_offset:key_offset + key_length]
+
+    def _record(self, position):
+        key_offset, key_length, flags, size, mtime_ns, inode, digest = RECORD.unpack_from(
+            self._map, HEADER.size + position * RECORD.size)
+        key = self._map[key_offset:key_offset + key_length]
+        if flags & DIR_FLAG:
+            return key, None
+        return key, [size, mtime_ns, inode, digest.hex() if flags & DIGEST_FLAG else None]
+
+    def _lower_bound(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, key):
+        """Entry of a key
+
+        Arguments:
+            key {bytes} -- Key
+
+        Raises:
+            KeyError -- raises if there is no such entry
+
+        Returns:
+            list -- Entry, None for dirs
+        """
+        if key in self._log:
+            entry = self._log[key]
+            if entry is DELETED:
+                raise KeyError(key)
+            return list(entry) if entry is not None else None
+        position = self._lower_bound(key)
+        if position < self.count:
+            found, entry = self._record(position)
+            if found == key:
+                return entry
+        raise KeyError(key)
+
+    def iter_prefix(self, prefix):
+        """Entries whose key starts with prefix, in key order
+
+        Arguments:
+            prefix {bytes} -- Key prefix
+
+        Yields:
+            tuple -- (key, entry)
+        """
+        position = self._lower_bound(prefix)
+        log_position = bisect_left(self._log_keys, prefix)
+        while True:
+            key = self._key(position) if position < self.count else None
+            if key is not None and not key.startswith(prefix):
+                key = None
+            log_key = self._log_keys[log_position] if log_position < len(self._log_keys) else None
+            if log_key is not None and not log_key.startswith(prefix):
+                log_key = None
+            if log_key is not None and (key is None or log_key <= key):
+                entry = self._log[log_key]
+                if entry is not DELETED:
+                    yield log_key, list(entry) if entry is not None else None
+                if log_key == key:
+                    position += 1
+                log_position += 1
+            elif key is not None:
+                yield self._record(position)
+                position += 1
+            else:
+                return
+
+    def update(self, changes, deleted):
+        """Append changes to the log, or fold the log and them into a new index once the log is large enough
+
+        Arguments:
+            changes {dict} -- Key to entry of added and changed entries
+            deleted {list} -- Keys of removed entries
+        """
+        log_count = len(set(self._log).union(changes, deleted))
+        if log_count > max(COMPACT_MIN, COMPACT_RATIO * self.count):
+            items = dict(self.iter_prefix(b''))
+            items.update(changes)
+            for key in deleted:
+                items.pop(key, None)
+            write_index(self.index_path, items.items())
+            return
+        lines = [json.dumps([_decode(key), entry]) for key, entry in sorted(changes.items())]
+        lines.extend(json.dumps([_decode(key)]) for key in sorted(deleted))
+        with open(self.index_path + LOG_SUFFIX, 'a') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+
+class _EntriesItems(ItemsView):
+
+    def __iter__(self):
+        view = self._mapping
+        start = len(view.prefix)
+        for key, entry in view.index.iter_prefix(view.prefix):
+            yield _decode(key[start:]), entry
+
+
+class EntriesView(Mapping):
+    """Read-only mapping of entry name to entry over one table of an index
+
+    Arguments:
+        index {ManifestIndex} -- Index
+        table {tuple} -- Table path
+    """
+
+    def __init__(self, index, table):
+        self.index = index
+        self.table = tuple(table)
+        self.prefix = table_prefix(table)
+        self._len = None
+
+    def __getitem__(self, name):
+        return self.index.lookup(self.prefix + _encode(name))
+
+    def __iter__(self):
+        for name, _ in self.items():
+            yield name
+
+    def __len__(self):
+        if self._len is None:
+            self._len = sum(1 for _ in self.index.iter_prefix(self.prefix))
+        return self._len
+
+    def items(self):
+        return _EntriesItems(self)
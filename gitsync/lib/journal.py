@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""Sync Journal
+
+Write-ahead record of what a sync does to the repo work tree: every
+operation is written down before it starts and marked done once it
+finished, along with the stat signature its source had when copied. If a
+sync dies halfway, the next one cleans up what the unfinished operations
+left behind and takes the finished copies as synced, so it only redoes
+what is really left.
+
+A journal is a file of JSON lines, one segment per sync which wrote into
+the repo, each starting with the HEAD it worked on.
+"""
+from os import path, remove
+from threading import Lock
+import json
+from .executor import Operation, COPY_FILE, COPY_DIR, COPY_LINK
+from .file import TMP_SUFFIX
+from .folder import delete_dir
+
+__all__ = ['Journal', 'load_journal', 'recover_operations', 'JOURNAL_FILE']
+
+# journal file in the repo dir, next to .state
+JOURNAL_FILE = '.state.journal'
+
+# private constant
+PLAN = 'plan'
+DONE = 'done'
+
+
+class Journal(object):
+    """Journal segment of the current sync, appended to what earlier interrupted syncs left
+
+    Arguments:
+        journal_path {str} -- Journal file path
+        head {str} -- HEAD the sync writes on top of
+    """
+
+    def __init__(self, journal_path, head):
+        self.journal_path = journal_path
+        self._lock = Lock()
+        self._count = 0
+        self._file = open(journal_path, 'a')
+        self._write({'head': head})
+
+    def _write(self, record):
+        with self._lock:
+            self._file.write(json.dumps(record) + '\n')
+            # lines reach the OS before the work they announce, so they survive the process dying
+            self._file.flush()
+
+    def plan(self, operation):
+        """Record an operation about to start
+
+        Arguments:
+            operation {Operation} -- Operation
+
+        Returns:
+            int -- Number of the operation in this segment
+        """
+        with self._lock:
+            number = self._count
+            self._count += 1
+        self._write([PLAN, number, operation.action, operation.src_path, operation.dst_path])
+        return number
+
+    def done(self, number, entry=None):
+        """Record an operation as finished
+
+        Arguments:
+            number {int} -- As returned by plan
+
+        Keyword Arguments:
+            entry {list} -- Stat signature of the copied source, [size, mtime_ns, inode] (default: {None})
+        """
+        self._write([DONE, number, entry])
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def discard(self):
+        """Close and delete the journal once its sync is committed"""
+        self.close()
+        try:
+            remove(self.journal_path)
+        except FileNotFoundError:
+            pass
+
+
+def load_journal(journal_path):
+    """Read what interrupted syncs left in a journal
+
+    Arguments:
+        journal_path {str} -- Journal file path
+
+    Returns:
+        dict -- head of the last segment, pending operations it didn't finish, done operations finished by any
+                segment and copied, the stat entry of every source whose copy finished keyed by source path;
+                None if there is no journal
+    """
+    try:
+        with open(journal_path) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return None
+    journal = {'head': None, 'pending': [], 'done': [], 'copied': {}}
+    planned = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # torn line of the write the sync died in
+            break
+        if isinstance(record, dict):
+            journal['head'] = record.get('head')
+            planned = {}
+        elif record[0] == PLAN:
+            operation = Operation(*record[2:5])
+            planned[record[1]] = operation
+            # copied again, whatever the earlier copy was
+            journal['copied'].pop(operation.src_path, None)
+        elif record[0] == DONE:
+            operation = planned.pop(record[1], None)
+            if operation is None:
+                continue
+            journal['done'].append(operation)
+            if operation.action in (COPY_FILE, COPY_LINK) and record[2] is not None:
+                journal['copied'][operation.src_path] = record[2]
+    journal['pending'] = list(planned.values())
+    return journal
+
+
+def recover_operations(operations, block_cache=None):
+    """Clean up what unfinished operations left in the work tree
+
+    Copies write a temp file renamed into place, so a file is either the old or the
+    new copy and only the temp file is removed. Delta copies are the exception,
+    they rewrite blocks of the repo copy in place: its block digests are dropped,
+    and the next plan compares it by content, see merge_copied. A dir copied as a
+    whole is removed to be copied again. Deletions and moves are left to the next plan.
+
+    Arguments:
+        operations {list} -- Unfinished operations
+
+    Keyword Arguments:
+        block_cache {BlockCache} -- Block digests of repo copies updated by delta copies (default: {None})
+
+    Returns:
+        list -- Paths removed
+    """
+    removed = []
+    for operation in operations:
+        if operation.action in (COPY_FILE, COPY_LINK):
+            tmp_path = operation.dst_path + TMP_SUFFIX
+            if path.lexists(tmp_path):
+                remove(tmp_path)
+                removed.append(tmp_path)
+            elif operation.action == COPY_FILE and block_cache is not None:
+                block_cache.discard(operation.dst_path)
+        elif operation.action == COPY_DIR and path.isdir(operation.dst_path):
+            delete_dir(operation.dst_path)
+            removed.append(operation.dst_path)
+    return removed
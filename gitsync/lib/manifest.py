@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""Stat Manifest
+
+Records size, mtime_ns, inode and content hash of every synced source file
+so that the next run only re-checks entries whose stat signature changed.
+Renamed files and dirs are told apart from new ones by their signature or
+hash, and their repo copies moved rather than copied again.
+"""
+from os import path, scandir, readlink, fsencode
+from stat import S_ISLNK, S_ISREG
+from filecmp import cmp
+from hashlib import sha1
+from .ignore import as_matcher
+from .profile import count, STAT_CALLS, CONTENT_COMPARES, INDEX_COMPARES, BYTES_READ
+from .store import is_pointer_of
+from .executor import Operation, COPY_FILE, COPY_DIR, COPY_LINK, DELETE_FILE, DELETE_DIR, MOVE, collect_operations
+
+__all__ = ['MANIFEST_KEY', 'file_signature', 'file_digest', 'link_digest', 'check_entry', 'iter_scan_dir', 'scan_dir']
+
+# key of the manifest stored along with the config in the .state file
+MANIFEST_KEY = 'manifest'
+
+# private constant
+READ_SIZE = 1024 * 1024
+
+
+def file_signature(stat_result):
+    """Stat signature of a file (size, mtime_ns, inode)
+
+    Arguments:
+        stat_result {os.stat_result} -- Stat result of the file
+
+    Returns:
+        list -- [size, mtime_ns, inode]
+    """
+    return [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+
+
+def file_digest(file_path):
+    """Content hash of a file, identical to what `git hash-object` reports
+
+    Arguments:
+        file_path {str} -- File path
+
+    Returns:
+        str -- Hex digest
+    """
+    with open(file_path, 'rb') as f:
+        f.seek(0, 2)
+        digest = sha1('blob {0}\0'.format(f.tell()).encode())
+        f.seek(0)
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+        count(BYTES_READ, f.tell())
+    return digest.hexdigest()
+
+
+def link_digest(link_path):
+    """Hash of a symlink, identical to the blob git records for it
+
+    Arguments:
+        link_path {str} -- Path of the symlink
+
+    Returns:
+        str -- Hex digest
+    """
+    target = fsencode(readlink(link_path))
+    return sha1('blob {0}\0'.format(len(target)).encode() + target).hexdigest()
+
+
+def check_entry(src_path, dst_path, stat_result, prev_entry=None, blobs=None):
+    """Decide whether a source file has to be synced given its manifest entry of the last sync
+
+    The destination is only looked at when the last entry has no content hash,
+    and only read if blobs don't know its hash either. A destination which is
+    the large file pointer of the source counts as synced. A symlink is hashed
+    by its target and compared with the link at the destination, other files
+    which aren't regular are never synced.
+
+    Arguments:
+        src_path {str} -- Source path
+        dst_path {str} -- Destination path
+        stat_result {os.stat_result} -- Stat result of the source file, of the link itself for a symlink
+
+    Keyword Arguments:
+        prev_entry {list} -- Manifest entry of the last sync (default: {None})
+        blobs {IndexBlobs} -- Blob hashes the git index records for repo copies (default: {None})
+
+    Returns:
+        tuple -- (to_sync, entry) where entry is the manifest entry of the current source file
+    """
+    signature = file_signature(stat_result)
+    if prev_entry is not None and prev_entry[:3] == signature:
+        return False, prev_entry
+
+    if S_ISLNK(stat_result.st_mode):
+        digest = link_digest(src_path)
+        to_sync = not path.islink(dst_path) or readlink(dst_path) != readlink(src_path)
+        return to_sync, signature + [digest]
+    if not S_ISREG(stat_result.st_mode):
+        # fifos, sockets and devices have no content to copy
+        return False, signature + [None]
+
+    digest = file_digest(src_path)
+    if prev_entry is not None and prev_entry[3] is not None:
+        to_sync = prev_entry[3] != digest
+    elif path.islink(dst_path) or not path.exists(dst_path):
+        # a link left from a symlinked source is replaced by the file
+        to_sync = True
+    else:
+        blob = blobs.blob_of(dst_path) if blobs is not None else None
+        if blob is not None:
+            count(INDEX_COMPARES)
+            to_sync = blob != digest and not is_pointer_of(dst_path, src_path, stat_result.st_size)
+        elif is_pointer_of(dst_path, src_path, stat_result.st_size):
+            to_sync = False
+        else:
+            count(CONTENT_COMPARES)
+            count(BYTES_READ, stat_result.st_size * 2)
+            to_sync = not cmp(src_path, dst_path)
+    return to_sync, signature + [digest]
+
+
+def _stat(entry):
+    count(STAT_CALLS)
+    # symlinks are recorded as links, the way copy_dir copies them
+    return entry.stat(follow_symlinks=not entry.is_symlink())
+
+
+def _copy(src_path, dst_path):
+    return Operation(COPY_LINK if path.islink(src_path) else COPY_FILE, src_path, dst_path)
+
+
+def _is_under(rel_path, dirs):
+    parent = path.dirname(rel_path)
+    while parent:
+        if parent in dirs:
+            return True
+        parent = path.dirname(parent)
+    return False
+
+
+def _known_dir(rel_dir, prev_entries):
+    # nearest dir of rel_dir which the last sync already knew
+    while rel_dir and prev_entries.get(rel_dir, False) is not None:
+        rel_dir = path.dirname(rel_dir)
+    return rel_dir
+
+
+def _subtrees(rel_dirs, entries):
+    """Entries under each of the given dirs keyed by their path relative to it"""
+    subtrees = dict((rel_dir, {}) for rel_dir in rel_dirs)
+    if not subtrees:
+        return subtrees
+    for rel_path, entry in entries.items():
+        parent = path.dirname(rel_path)
+        while parent:
+            if parent in subtrees:
+                subtrees[parent][path.relpath(rel_path, parent)] = entry
+                break
+            parent = path.dirname(parent)
+    return subtrees
+
+
+def _match_dirs(new_dirs, gone_dirs, entries, prev_entries):
+    """Pair new dirs with gone dirs sharing most files of unchanged signature, at least half of the new ones"""
+    new_subtrees = _subtrees(new_dirs, entries)
+    gone_subtrees = _subtrees(gone_dirs, prev_entries)
+    owners = {}
+    for gone_dir, subtree in gone_subtrees.items():
+        for entry in subtree.values():
+            if entry:
+                owners[tuple(entry[:3])] = gone_dir
+    pairs = []
+    used = set()
+    for new_dir in new_dirs:
+        hits = {}
+        files = [entry for entry in new_subtrees[new_dir].values() if entry]
+        for entry in files:
+            gone_dir = owners.get(tuple(entry[:3]))
+            if gone_dir is not None and gone_dir not in used:
+                hits[gone_dir] = hits.get(gone_dir, 0) + 1
+        if not hits:
+            continue
+        gone_dir = max(hits, key=hits.get)
+        if hits[gone_dir] * 2 >= len(files):
+            used.add(gone_dir)
+            pairs.append((gone_dir, new_dir, gone_subtrees[gone_dir], new_subtrees[new_dir]))
+    return pairs
+
+
+def _reconcile(new_dir, old_subtree, new_subtree, src_root, dst_root, entries):
+    """Operations turning a moved repo copy of a dir into a copy of its source, keeping hashes of unchanged files"""
+    operations = []
+    copied = set()
+    for rel_path in sorted(new_subtree):
+        if _is_under(rel_path, copied):
+            continue
+        entry = new_subtree[rel_path]
+        prev_entry = old_subtree.get(rel_path, False)
+        src_path = path.join(src_root, new_dir, rel_path)
+        dst_path = path.join(dst_root, new_dir, rel_path)
+        if entry is None:
+            if prev_entry is None:
+                continue
+            if prev_entry:
+                operations.append(Operation(DELETE_FILE, None, dst_path))
+            operations.append(Operation(COPY_DIR, src_path, dst_path))
+            copied.add(rel_path)
+            continue
+        if prev_entry is None:
+            operations.append(Operation(DELETE_DIR, None, dst_path))
+        elif prev_entry and prev_entry[:3] == entry[:3]:
+            entries[path.join(new_dir, rel_path)] = prev_entry
+            continue
+        operations.append(_copy(src_path, dst_path))
+
+    # old dirs which are gone or a file now were deleted as a whole
+    replaced = set(rel_path for rel_path, prev_entry in old_subtree.items()
+                   if prev_entry is None and new_subtree.get(rel_path, False) is not None)
+    for rel_path in sorted(old_subtree):
+        if rel_path in new_subtree or _is_under(rel_path, replaced):
+            continue
+        operations.append(Operation(DELETE_DIR if old_subtree[rel_path] is None else DELETE_FILE, None,
+                                    path.join(dst_root, new_dir, rel_path)))
+    return operations
+
+
+def iter_scan_dir(src_root, dst_root, entries, prev_entries=None, ignore=None, only=None, blobs=None):
+    """Walk a source dir and diff it against its manifest entries of the last sync, yielding operations during the walk
+
+    Only the source side is walked. Without previous entries nothing is
+    diffed and the entries of the current source dir are just recorded.
+    Copies of new files and dirs are held back until the walk is done, so
+    the repo copies of renamed ones are moved instead: files by signature or
+    content hash, dirs by the signatures of the files they hold.
+
+    Arguments:
+        src_root {str} -- Source dir path
+        dst_root {str} -- Destination dir path
+        entries {dict} -- Filled with the manifest entries of the source dir, complete once the generator is exhausted
+
+    Keyword Arguments:
+        prev_entries {dict} -- Manifest entries of the last sync keyed by relative path, None for dirs (default: {None})
+        ignore {IgnoreMatcher} -- Ignored entries are pruned before they are looked at (default: {None})
+        only {iterable} -- Relative dir paths to rescan non-recursively, other entries are kept from prev_entries (default: {None})
+        blobs {IndexBlobs} -- Blob hashes of repo copies, compared rather than the copies themselves (default: {None})
+
+    Yields:
+        Operation -- Operations to sync the destination dir
+    """
+    diff = prev_entries is not None
+    prev_entries = prev_entries if diff else {}
+    ignore = as_matcher(ignore)
+    ignore_base = ignore.base_of(dst_root)
+
+    entries.clear()
+    # (relative dir path, whether the dir is copied entirely)
+    if only is None or not diff:
+        pending = [('', not diff)]
+    else:
+        entries.update(prev_entries.items())
+        pending = [(rel_dir, False) for rel_dir in set(_known_dir(rel_dir, prev_entries) for rel_dir in only)]
+    seen = set()
+    scanned = set()
+    # new names whose copies wait for rename detection
+    new_dirs = []
+    new_files = []
+    signatures = None
+    while pending:
+        rel_dir, in_new_dir = pending.pop()
+        if not in_new_dir:
+            scanned.add(rel_dir)
+        if not path.isdir(path.join(src_root, rel_dir)):
+            # removed meanwhile, its parent tells
+            continue
+        with scandir(path.join(src_root, rel_dir)) as it:
+            for entry in it:
+                rel_path = path.join(rel_dir, entry.name)
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if ignore and ignore.match(path.join(ignore_base, rel_path), is_dir):
+                    continue
+                src_path = entry.path
+                dst_path = path.join(dst_root, rel_path)
+                prev_entry = prev_entries.get(rel_path, False)
+                seen.add(rel_path)
+
+                if is_dir:
+                    entries[rel_path] = None
+                    new_dir = in_new_dir or prev_entry is not None
+                    if new_dir and not in_new_dir:
+                        if prev_entry is False:
+                            new_dirs.append(rel_path)
+                        else:
+                            # a file was there
+                            yield Operation(DELETE_FILE, None, dst_path)
+                            yield Operation(COPY_DIR, src_path, dst_path)
+                    if only is None or new_dir:
+                        pending.append((rel_path, new_dir))
+                    continue
+
+                stat_result = _stat(entry)
+                if in_new_dir:
+                    entries[rel_path] = file_signature(stat_result) + [None]
+                    continue
+                if prev_entry is False:
+                    if signatures is None:
+                        signatures = dict((tuple(entry[:3]), rel) for rel, entry in prev_entries.items() if entry)
+                    moved_from = signatures.get(tuple(file_signature(stat_result)))
+                    if moved_from is not None:
+                        # most likely renamed, hashed later if not
+                        entries[rel_path] = file_signature(stat_result) + [prev_entries[moved_from][3]]
+                        new_files.append((rel_path, stat_result, moved_from))
+                        continue
+                    to_sync, entries[rel_path] = check_entry(src_path, dst_path, stat_result, blobs=blobs)
+                    if to_sync:
+                        new_files.append((rel_path, stat_result, None))
+                    continue
+                if prev_entry is None:
+                    # a dir was there
+                    yield Operation(DELETE_DIR, None, dst_path)
+                to_sync, entries[rel_path] = check_entry(
+                    src_path, dst_path, stat_result, prev_entry or None, blobs=blobs)
+                if to_sync:
+                    yield _copy(src_path, dst_path)
+
+    # items listed in previous entries no longer exist in scanned dirs
+    gone = [rel_path for rel_path in prev_entries
+            if rel_path not in seen and path.dirname(rel_path) in scanned]
+    gone_dirs = set(rel_path for rel_path in gone if prev_entries[rel_path] is None)
+    moved = set()
+    movable = [rel_path for rel_path in new_dirs if not path.lexists(path.join(dst_root, rel_path))]
+    for old_dir, new_dir, old_subtree, new_subtree in _match_dirs(movable, gone_dirs, entries, prev_entries):
+        moved.add(old_dir)
+        new_dirs.remove(new_dir)
+        yield Operation(MOVE, path.join(dst_root, old_dir), path.join(dst_root, new_dir))
+        for operation in _reconcile(new_dir, old_subtree, new_subtree, src_root, dst_root, entries):
+            yield operation
+    for rel_path in new_dirs:
+        yield Operation(COPY_DIR, path.join(src_root, rel_path), path.join(dst_root, rel_path))
+
+    gone_files = dict((rel_path, prev_entries[rel_path]) for rel_path in gone
+                      if rel_path not in gone_dirs and not _is_under(rel_path, gone_dirs))
+    digests = dict((entry[3], rel_path) for rel_path, entry in gone_files.items() if entry[3] is not None)
+    for rel_path, stat_result, moved_from in new_files:
+        src_path = path.join(src_root, rel_path)
+        dst_path = path.join(dst_root, rel_path)
+        if moved_from not in gone_files or moved_from in moved:
+            if moved_from is not None:
+                # a hardlink or a copy kept the signature, the borrowed hash doesn't hold
+                to_sync, entries[rel_path] = check_entry(src_path, dst_path, stat_result, blobs=blobs)
+                if not to_sync:
+                    continue
+            moved_from = digests.get(entries[rel_path][3])
+        if moved_from is not None and moved_from not in moved and not path.lexists(dst_path):
+            moved.add(moved_from)
+            yield Operation(MOVE, path.join(dst_root, moved_from), dst_path)
+        else:
+            yield _copy(src_path, dst_path)
+
+    for rel_path in sorted(gone):
+        entries.pop(rel_path, None)
+        if rel_path in moved or _is_under(rel_path, gone_dirs):
+            continue
+        yield Operation(DELETE_DIR if rel_path in gone_dirs else DELETE_FILE, None, path.join(dst_root, rel_path))
+    if gone_dirs and only is not None:
+        for rel_path in [rel_path for rel_path in entries if _is_under(rel_path, gone_dirs)]:
+            del entries[rel_path]
+
+
+def scan_dir(src_root, dst_root, prev_entries=None, ignore=None, only=None, blobs=None):
+    """Walk a source dir and diff it against its manifest entries of the last sync
+
+    See iter_scan_dir.
+
+    Arguments:
+        src_root {str} -- Source dir path
+        dst_root {str} -- Destination dir path
+
+    Keyword Arguments:
+        prev_entries {dict} -- Manifest entries of the last sync keyed by relative path, None for dirs (default: {None})
+        ignore {IgnoreMatcher} -- Ignored entries are pruned before they are looked at (default: {None})
+        only {iterable} -- Relative dir paths to rescan non-recursively, other entries are kept from prev_entries (default: {None})
+        blobs {IndexBlobs} -- Blob hashes of repo copies, compared rather than the copies themselves (default: {None})
+
+    Returns:
+        tuple -- files to be copied, dirs to be copied, files to be deleted, dirs to be deleted and manifest entries of the source dir
+    """
+    entries = {}
+    operations = collect_operations(iter_scan_dir(src_root, dst_root, entries, prev_entries=prev_entries,
+                                                  ignore=ignore, only=only, blobs=blobs))
+    return operations + (entries,)
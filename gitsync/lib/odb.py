@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Object Database Sync
+
+Writes changed sources straight into the repo's object database as blobs and
+commits a tree built from them, without materializing files under repo_dir.
+"""
+from os import path, scandir, stat, readlink
+from stat import S_ISLNK
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from .manifest import file_signature
+from .ignore import as_matcher
+from .profile import count, STAT_CALLS, BYTES_READ
+from .push import push_targets
+
+__all__ = ['DIRECT_MANIFEST_KEY', 'fetch_fast_forward', 'plan_objects', 'write_objects', 'commit_objects', 'push_branch']
+
+# key of the direct mode entries in the manifest, keyed by path in the repo
+DIRECT_MANIFEST_KEY = 'direct'
+
+# private constant
+MODE_FILE = 0o100644
+MODE_EXECUTABLE = 0o100755
+MODE_SYMLINK = 0o120000
+
+
+def _file_mode(stat_result):
+    if S_ISLNK(stat_result.st_mode):
+        return MODE_SYMLINK
+    return MODE_EXECUTABLE if stat_result.st_mode & 0o111 else MODE_FILE
+
+
+def _iter_sources(config, ignore):
+    """Yield (path in repo, source path, stat result) of every source file"""
+    for src_path, dst_item in config['files'].items():
+        count(STAT_CALLS)
+        yield path.normpath(dst_item), src_path, stat(src_path)
+
+    for src_root, dst_item in config['dirs'].items():
+        pending = [(src_root, path.normpath(dst_item))]
+        while pending:
+            src_dir, dst_dir = pending.pop()
+            with scandir(src_dir) as it:
+                for entry in it:
+                    dst_path = path.join(dst_dir, entry.name)
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if ignore and ignore.match(dst_path, is_dir):
+                        continue
+                    if is_dir:
+                        pending.append((entry.path, dst_path))
+                    else:
+                        # symlinks are kept as links, like copy_dir does
+                        count(STAT_CALLS)
+                        yield dst_path, entry.path, entry.stat(follow_symlinks=False)
+
+
+def _remote_branch(repo):
+    branch = repo.active_branch
+    tracking = branch.tracking_branch()
+    return branch, tracking.remote_head if tracking is not None else branch.name
+
+
+def fetch_fast_forward(repo, remote):
+    """Fetch the upstream branch and fast-forward the current branch to it, without touching the working tree
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        remote {git.Remote} -- Remote
+
+    Raises:
+        ValueError -- Raises if local and remote history diverged
+
+    Returns:
+        bool -- Whether the branch moved
+    """
+    branch, remote_branch = _remote_branch(repo)
+    remote_commit = remote.fetch(remote_branch)[0].commit
+    local_commit = branch.commit
+    if remote_commit == local_commit or repo.is_ancestor(remote_commit, local_commit):
+        return False
+    if not repo.is_ancestor(local_commit, remote_commit):
+        raise ValueError('Local branch {0} and remote branch {1} diverged'.format(branch.name, remote_branch))
+    branch.commit = remote_commit
+    if not repo.bare:
+        repo.git.read_tree(remote_commit.hexsha)
+    return True
+
+
+def push_branch(repo, targets):
+    """Push the current branch to its upstream branch, which also works for bare repos without tracking config
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        targets {list} -- PushTarget of each remote, all pushed to the branch name of the upstream branch
+
+    Returns:
+        list -- Result of each remote as returned by push_targets
+    """
+    branch, remote_branch = _remote_branch(repo)
+    return push_targets(repo, targets, refspec='{0}:{1}'.format(branch.name, remote_branch))
+
+
+def _tree_entries(commit):
+    return {blob.path: (blob.hexsha, blob.mode) for blob in commit.tree.traverse() if blob.type == 'blob'}
+
+
+def _mapped_paths(config):
+    return set(path.normpath(dst_item) for section in ('files', 'dirs') for dst_item in config.get(section, {}).values())
+
+
+def _is_mapped(dst_path, mapped):
+    while dst_path:
+        if dst_path in mapped:
+            return True
+        dst_path = path.dirname(dst_path)
+    return False
+
+
+def plan_objects(repo, config, ignore=None, prev_entries=None, prev_config=None):
+    """Compare sources against the HEAD tree
+
+    Sources whose stat signature matches their entry of the last sync are
+    taken as unchanged, the others are written to the object database anyway
+    as that reads them only once; unchanged content just doesn't change the tree.
+    Only files at or under destinations of sources, current ones or those of the
+    last sync, are removed; other files of the tree are kept.
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        config {dict} -- Current config
+
+    Keyword Arguments:
+        ignore {IgnoreMatcher} -- Ignored entries are pruned, matched by their path in the repo (default: {None})
+        prev_entries {dict} -- Direct mode manifest entries of the last sync (default: {None})
+        prev_config {dict} -- Last sync state, copies of sources it mapped which no longer are get removed (default: {None})
+
+    Returns:
+        tuple -- sources to be written {path in repo: (source path, mode)}, paths in repo to be removed, manifest entries
+    """
+    prev_entries = prev_entries or {}
+    ignore = as_matcher(ignore)
+    tree_entries = _tree_entries(repo.head.commit)
+    to_write = {}
+    entries = {}
+    for dst_path, src_path, stat_result in _iter_sources(config, ignore):
+        signature = file_signature(stat_result)
+        mode = _file_mode(stat_result)
+        tree_entry = tree_entries.get(dst_path)
+        prev_entry = prev_entries.get(dst_path)
+        if (tree_entry is not None and prev_entry is not None and prev_entry[:3] == signature
+                and prev_entry[3] == tree_entry[0] and mode == tree_entry[1]):
+            entries[dst_path] = prev_entry
+            continue
+        to_write[dst_path] = (src_path, mode)
+        entries[dst_path] = signature + [None]
+
+    mapped = _mapped_paths(config) | _mapped_paths(prev_config or {})
+    to_remove = [dst_path for dst_path in tree_entries
+                 if dst_path not in entries and _is_mapped(dst_path, mapped) and not ignore.match(dst_path)]
+    return to_write, to_remove, entries
+
+
+def _write_blob(repo, src_path, mode):
+    from gitdb import IStream
+
+    if mode == MODE_SYMLINK:
+        data = readlink(src_path).encode()
+        return repo.odb.store(IStream('blob', len(data), BytesIO(data))).binsha
+    with open(src_path, 'rb') as f:
+        size = stat(f.fileno()).st_size
+        count(BYTES_READ, size)
+        return repo.odb.store(IStream('blob', size, f)).binsha
+
+
+def write_objects(repo, to_write, entries, jobs=8):
+    """Write sources into the object database as blobs
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        to_write {dict} -- Sources to be written {path in repo: (source path, mode)}
+        entries {dict} -- Manifest entries, filled with blob hashes
+
+    Keyword Arguments:
+        jobs {int} -- Maximum number of blobs written concurrently (default: {8})
+
+    Returns:
+        dict -- {path in repo: (hex sha, mode)}
+    """
+    from gitdb.util import bin_to_hex
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {dst_path: executor.submit(_write_blob, repo, src_path, mode)
+                   for dst_path, (src_path, mode) in to_write.items()}
+    blobs = {}
+    for dst_path, future in futures.items():
+        hexsha = bin_to_hex(future.result()).decode('ascii')
+        entries[dst_path][3] = hexsha
+        blobs[dst_path] = (hexsha, to_write[dst_path][1])
+    return blobs
+
+
+def commit_objects(repo, blobs, to_remove, message):
+    """Commit a tree of HEAD with given blobs replaced and paths removed
+
+    Nothing is committed if the resulting tree equals the HEAD tree.
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        blobs {dict} -- {path in repo: (hex sha, mode)}
+        to_remove {list} -- Paths in repo to be removed
+        message {str} -- Commit message
+
+    Returns:
+        git.Commit -- New commit, None if nothing changed
+    """
+    from git import IndexFile, Commit, Blob
+    from git.index.typ import IndexEntry
+    from gitdb.util import hex_to_bin
+
+    parent = repo.head.commit
+    index = IndexFile.from_tree(repo, parent)
+    for dst_path in to_remove:
+        index.entries.pop((dst_path, 0), None)
+    for dst_path, (hexsha, mode) in blobs.items():
+        index.entries[(dst_path, 0)] = IndexEntry.from_blob(Blob(repo, hex_to_bin(hexsha), mode, dst_path))
+    tree = index.write_tree()
+    if tree.binsha == parent.tree.binsha:
+        return None
+    commit = Commit.create_from_tree(repo, tree, message, parent_commits=[parent], head=True)
+    if not repo.bare:
+        # keep the index in line with HEAD, the working tree is left as it is
+        index.write(path.join(repo.git_dir, 'index'))
+    return commit
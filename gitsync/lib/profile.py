@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Profiling
+
+Records wall time per phase of a sync run and, while a Profiler is active,
+counts the I/O done by the lib functions and times every git subprocess.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+import json
+import os
+import tempfile
+import time
+
+__all__ = ['Phases', 'Profiler', 'count', 'STAT_CALLS', 'CONTENT_COMPARES', 'INDEX_COMPARES', 'BYTES_READ', 'BYTES_COPIED']
+
+# counters kept by an active Profiler
+STAT_CALLS = 'stat_calls'
+CONTENT_COMPARES = 'content_compares'
+INDEX_COMPARES = 'index_compares'
+BYTES_READ = 'bytes_read'
+BYTES_COPIED = 'bytes_copied'
+
+# private constant
+COUNTERS = [STAT_CALLS, CONTENT_COMPARES, INDEX_COMPARES, BYTES_READ, BYTES_COPIED]
+# git writes an event per line into this file for every git process, children included
+TRACE_ENV = 'GIT_TRACE2_EVENT'
+
+# profiler the lib functions count into, set by Profiler.activate
+_active = None
+
+
+def count(name, amount=1):
+    """Add to a counter of the active profiler, nothing happens if none is active
+
+    Arguments:
+        name {str} -- Counter name
+
+    Keyword Arguments:
+        amount {int} -- Amount to add (default: {1})
+    """
+    profiler = _active
+    if profiler is not None:
+        profiler.add(name, amount)
+
+
+class Phases(object):
+    """Wall time per phase of a sync run, in seconds and in the order phases started"""
+
+    def __init__(self):
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase name, repeated phases add up
+
+        Arguments:
+            name {str} -- Phase name
+        """
+        self.timings.setdefault(name, 0.0)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+
+class Profiler(Phases):
+    """Phases plus I/O counters and git subprocess durations
+
+    Counters only move while the profiler is activated. Hooks are called as
+    hook(name, seconds) whenever a phase ends, e.g. to feed a metrics system.
+
+    Keyword Arguments:
+        hooks {list} -- Callables called with each finished phase (default: {None})
+    """
+
+    def __init__(self, hooks=None):
+        super().__init__()
+        self.counters = OrderedDict((name, 0) for name in COUNTERS)
+        self.git_commands = []
+        self._hooks = list(hooks or [])
+        self._lock = Lock()
+        self._started = None
+        self._elapsed = 0.0
+
+    def add_hook(self, hook):
+        """Call hook(name, seconds) whenever a phase ends
+
+        Arguments:
+            hook {callable} -- Hook
+        """
+        self._hooks.append(hook)
+
+    def record(self, name, seconds):
+        super().record(name, seconds)
+        for hook in self._hooks:
+            hook(name, seconds)
+
+    def add(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    @contextmanager
+    def activate(self):
+        """Count I/O of the lib functions and trace git processes started within the enclosed block"""
+        global _active
+        previous, _active = _active, self
+        fd, trace_path = tempfile.mkstemp(prefix='gitsync-trace-', suffix='.json')
+        os.close(fd)
+        previous_trace = os.environ.get(TRACE_ENV)
+        os.environ[TRACE_ENV] = trace_path
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self._elapsed += time.perf_counter() - started
+            _active = previous
+            if previous_trace is None:
+                del os.environ[TRACE_ENV]
+            else:
+                os.environ[TRACE_ENV] = previous_trace
+            self.git_commands.extend(_read_trace(trace_path))
+            os.remove(trace_path)
+
+    def report(self):
+        """Profile of everything recorded so far
+
+        Returns:
+            dict -- JSON serializable report
+        """
+        return OrderedDict([
+            ('elapsed_s', round(self._elapsed, 6)),
+            ('phases_s', OrderedDict((name, round(seconds, 6)) for name, seconds in self.timings.items())),
+            ('counters', OrderedDict(self.counters)),
+            ('git_s', round(sum(command['seconds'] for command in self.git_commands), 6)),
+            ('git_commands', self.git_commands),
+        ])
+
+    def write_report(self, report_path):
+        """Write the report as JSON
+
+        Arguments:
+            report_path {str} -- Report file path
+        """
+        with open(report_path, 'w') as f:
+            json.dump(self.report(), f, indent=4)
+
+
+def _read_trace(trace_path):
+    """Durations of top level git processes from a trace2 event file, children are counted in their parents"""
+    starts = {}
+    commands = []
+    with open(trace_path, errors='replace') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            sid = event.get('sid', '')
+            if '/' in sid:
+                continue
+            if event.get('event') == 'start':
+                starts[sid] = event.get('argv', [])
+            elif event.get('event') == 'exit' and sid in starts:
+                commands.append(OrderedDict([
+                    ('command', ' '.join(starts.pop(sid))),
+                    ('seconds', round(event.get('t_abs', 0.0), 6)),
+                    ('code', event.get('code')),
+                ]))
+    # long-lived processes, e.g. `git cat-file --batch`, may not have exited yet
+    return commands
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Push
+
+Pushes either in place, on a background thread of this process, or handed
+to a detached git process which outlives it, so a sync can return sooner.
+
+A repo may be mirrored to several remotes, listed in the remotes section of
+a config. They are pushed in parallel, each with its own retries and
+timeout; a required remote fails the push, a best-effort one is only
+reported.
+"""
+from os import devnull
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import os
+import signal
+import subprocess
+import time
+
+# not available on Windows
+killpg = getattr(os, 'killpg', None)
+
+__all__ = ['PUSH_WAIT', 'PUSH_BACKGROUND', 'PUSH_DETACH', 'PUSH_MODES', 'PushTarget', 'load_push_targets',
+           'push_targets', 'push', 'wait_for_push', 'REMOTES_KEY', 'RETRY_DELAY']
+
+PUSH_WAIT = 'wait'
+PUSH_BACKGROUND = 'background'
+PUSH_DETACH = 'detach'
+
+PUSH_MODES = [PUSH_WAIT, PUSH_BACKGROUND, PUSH_DETACH]
+
+# config section listing the remotes to push to, origin alone if there is none
+REMOTES_KEY = 'remotes'
+
+# seconds before the first retry of a failed push, doubled for every further one
+RETRY_DELAY = 2.0
+
+# name of a configured remote, or a label if url is given; a push failing to a required remote fails the sync;
+# timeout in seconds per attempt, None waits for good
+PushTarget = namedtuple('PushTarget', ['name', 'url', 'required', 'retries', 'timeout'])
+PushTarget.__new__.__defaults__ = (None, True, 0, None)
+
+# private constant
+# git runs in a session of its own, so its children can be killed along with it; a process group on Windows
+SESSION_OPTIONS = {'start_new_session': True} if killpg is not None else \
+    {'creationflags': getattr(subprocess, 'CREATE_NEW_PROCESS_GROUP', 0)}
+
+# background pushes run one at a time, in order, on a single worker
+_lock = Lock()
+_executor = None
+_pending = None
+
+
+def load_push_targets(config):
+    """Remotes to push to as set up by the remotes section of a config
+
+    Arguments:
+        config {dict} -- Config, remotes lists remote names or objects of name and/or url, required (default true),
+                         retries (default 0) and timeout in seconds
+
+    Raises:
+        ValueError -- Raises if a remote has neither name nor url, or a name is used twice
+
+    Returns:
+        list -- PushTarget of each remote, origin alone if the config has no remotes section
+    """
+    options = config.get(REMOTES_KEY)
+    if not options:
+        return [PushTarget('origin')]
+    targets = []
+    for option in options:
+        if not isinstance(option, dict):
+            option = {'name': option}
+        name = option.get('name') or option.get('url')
+        if not name:
+            raise ValueError('A remote needs a name or url')
+        if any(target.name == name for target in targets):
+            raise ValueError('Remote {0} is listed twice'.format(name))
+        timeout = option.get('timeout')
+        targets.append(PushTarget(name, url=option.get('url'), required=bool(option.get('required', True)),
+                                  retries=int(option.get('retries', 0)),
+                                  timeout=None if timeout is None else float(timeout)))
+    return targets
+
+
+def _push_command(target, refspec, lease=None):
+    if target.url is None:
+        # a configured remote is pushed as git would by itself, following its push config; a forced push only
+        # overwrites what its remote-tracking branch has seen
+        return ['git', 'push'] + (['--force-with-lease'] if lease else []) + [target.name] + ([refspec] if refspec else [])
+    # a url has no remote-tracking branch, the push only overwrites the commit it is expected at
+    return ['git', 'push'] + (['--force-with-lease={0}'.format(lease)] if lease else []) + [target.url, refspec or 'HEAD']
+
+
+def _lease(repo, refspec, expected):
+    """Remote branch and the commit it is expected at, as --force-with-lease takes them"""
+    if expected is None:
+        return None
+    branch = refspec.split(':')[-1] if refspec else repo.active_branch.name
+    return '{0}:{1}'.format(branch, expected)
+
+
+def _run_push(cwd, command, timeout):
+    process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, **SESSION_OPTIONS)
+    try:
+        output, _ = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        if killpg is not None:
+            # ssh and remote helpers are children of git, they go along with it
+            killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+        process.communicate()
+        return 'timed out after {0:g}s'.format(timeout)
+    if process.returncode:
+        lines = output.decode('utf-8', 'replace').strip().splitlines()
+        errors = [line for line in lines if line.startswith(('fatal:', 'error:', ' ! '))]
+        return (errors or lines or ['git push exited with {0}'.format(process.returncode)])[0].strip()
+    return None
+
+
+def _push_target(cwd, target, refspec, lease):
+    started = time.perf_counter()
+    command = _push_command(target, refspec, lease)
+    attempts = 0
+    while True:
+        attempts += 1
+        error = _run_push(cwd, command, target.timeout)
+        if error is None or attempts > target.retries:
+            break
+        time.sleep(RETRY_DELAY * 2 ** (attempts - 1))
+    result = OrderedDict(remote=target.name, required=target.required, status='failed' if error else 'pushed',
+                         attempts=attempts, seconds=time.perf_counter() - started)
+    if error:
+        result['error'] = error
+    return result
+
+
+def push_targets(repo, targets, refspec=None, expected=None):
+    """Push the current branch to remotes in parallel and wait for all of them
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        targets {list} -- PushTarget of each remote
+
+    Keyword Arguments:
+        refspec {str} -- What to push, as git push does by itself for configured remotes and HEAD for urls
+                         if not given (default: {None})
+        expected {str} -- Commit the remote branch is expected at; if given, rewritten history replaces it as long
+                          as it is still there, or for configured remotes where their remote-tracking branch is
+                          (default: {None})
+
+    Returns:
+        list -- Result of each remote in given order: remote, required, status ('pushed' or 'failed'), attempts,
+                seconds and error if failed
+    """
+    cwd = repo.working_tree_dir or repo.git_dir
+    lease = _lease(repo, refspec, expected)
+    if len(targets) == 1:
+        return [_push_target(cwd, targets[0], refspec, lease)]
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        futures = [executor.submit(_push_target, cwd, target, refspec, lease) for target in targets]
+        return [future.result() for future in futures]
+
+
+def push(repo, targets, mode=PUSH_WAIT, log_path=None, expected=None):
+    """Push the current branch to remotes
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        targets {list} -- PushTarget of each remote
+
+    Keyword Arguments:
+        mode {str} -- One of PUSH_MODES (default: {PUSH_WAIT})
+        log_path {str} -- Output of a detached push is appended to this file, dropped if not given (default: {None})
+        expected {str} -- Commit the remote branches are expected at, see push_targets (default: {None})
+
+    Returns:
+        list|Future -- Results as returned by push_targets in wait mode, a future of them in background mode,
+                       None in detach mode which neither retries nor times out
+    """
+    global _executor, _pending
+    if mode == PUSH_WAIT:
+        return push_targets(repo, targets, expected=expected)
+    if mode == PUSH_DETACH:
+        lease = _lease(repo, None, expected)
+        with open(log_path or devnull, 'ab') as log:
+            for target in targets:
+                subprocess.Popen(_push_command(target, None, lease), cwd=repo.working_tree_dir,
+                                 stdin=subprocess.DEVNULL, stdout=log, stderr=log, **SESSION_OPTIONS)
+        return None
+    if mode != PUSH_BACKGROUND:
+        raise ValueError('Unknown push mode {0}'.format(mode))
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1)
+        _pending = _executor.submit(push_targets, repo, targets, expected=expected)
+        return _pending
+
+
+def wait_for_push():
+    """Wait until the last background push finished, its error is left to whoever holds its future"""
+    with _lock:
+        pending = _pending
+    if pending is not None:
+        pending.exception()
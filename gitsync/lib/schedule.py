@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Entry Schedule
+
+Lets entries of a config be checked at their own pace: the schedule section
+maps source paths of files and dirs to a scan interval in seconds and a
+priority. Each run only checks the entries which are due, highest priority
+first, the others keep the state of their last check. When each entry was
+last checked is kept in the manifest.
+"""
+from collections import namedtuple
+import time
+
+__all__ = ['EntrySchedule', 'load_schedule', 'due_sources', 'SCHEDULE_KEY', 'SCANNED_KEY']
+
+# config section of per-entry schedules, keyed by source path
+SCHEDULE_KEY = 'schedule'
+
+# manifest key of the epoch seconds each source was last checked at
+SCANNED_KEY = 'scanned'
+
+# seconds between checks, 0 checks on every run; entries of higher priority are checked first
+EntrySchedule = namedtuple('EntrySchedule', ['interval', 'priority'])
+EntrySchedule.__new__.__defaults__ = (0, 0)
+
+# private constant
+# runs started by a timer drift a little, an entry is due this fraction of its interval early
+SLACK = 0.05
+
+
+def load_schedule(config):
+    """Schedules set up by the schedule section of a config
+
+    Arguments:
+        config {dict} -- Config, schedule maps source paths of files and dirs to interval (seconds) and priority
+
+    Raises:
+        ValueError -- Raises if a schedule is set for a path which isn't a source, or an interval is negative
+
+    Returns:
+        dict -- Source path to EntrySchedule, empty if the config has no schedule section
+    """
+    schedules = {}
+    for src_path, options in (config.get(SCHEDULE_KEY) or {}).items():
+        if src_path not in config.get('files', {}) and src_path not in config.get('dirs', {}):
+            raise ValueError('{0} is scheduled but not a source of files or dirs'.format(src_path))
+        schedule = EntrySchedule(interval=float(options.get('interval', 0)), priority=int(options.get('priority', 0)))
+        if schedule.interval < 0:
+            raise ValueError('Scan interval of {0} is negative'.format(src_path))
+        schedules[src_path] = schedule
+    return schedules
+
+
+def due_sources(config, scanned, now=None):
+    """Sources of files and dirs due to be checked
+
+    Arguments:
+        config {dict} -- Config
+        scanned {dict} -- Source path to epoch seconds of its last check, as kept in the manifest under SCANNED_KEY
+
+    Keyword Arguments:
+        now {float} -- Epoch seconds (default: {None}, the current time)
+
+    Returns:
+        list -- Source paths, highest priority first and in config order among equal priorities
+    """
+    schedules = load_schedule(config)
+    now = time.time() if now is None else now
+    due = []
+    for src_path in list(config.get('files', {})) + list(config.get('dirs', {})):
+        schedule = schedules.get(src_path, EntrySchedule())
+        last = scanned.get(src_path)
+        if last is None or now - last >= schedule.interval * (1 - SLACK):
+            due.append((-schedule.priority, len(due), src_path))
+    return [src_path for _, _, src_path in sorted(due)]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Staging
+
+Stages only the paths a sync touched, so git never has to re-stat the
+whole working tree.
+"""
+from os import path
+
+__all__ = ['reset_staging', 'stage_paths']
+
+# private constant
+PATHS_PER_CALL = 1000
+
+
+def _chunks(items, size=PATHS_PER_CALL):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def reset_staging(repo):
+    """Reset the index to HEAD, keeping cached stat info of unchanged entries
+
+    Arguments:
+        repo {git.Repo} -- Repo
+    """
+    repo.git.read_tree('-m', 'HEAD')
+
+
+def stage_paths(repo, added, removed):
+    """Stage the given paths only
+
+    Arguments:
+        repo {git.Repo} -- Repo
+        added {iterable} -- Paths written by the sync, files or dirs
+        removed {iterable} -- Paths deleted by the sync, files or dirs
+
+    Raises:
+        GitCommandError -- raises if git fails for another reason than ignored paths
+    """
+    from git import GitCommandError
+
+    repo_dir = repo.working_tree_dir
+    removed = sorted(set(path.relpath(item, repo_dir) for item in removed))
+    added = sorted(set(path.relpath(item, repo_dir) for item in added))
+    for chunk in _chunks(removed):
+        repo.git.rm('--cached', '-r', '-q', '--ignore-unmatch', '--', *chunk)
+    for chunk in _chunks(added):
+        try:
+            repo.git.add('-A', '--', *chunk)
+        except GitCommandError as error:
+            # other paths are still staged when some are ignored by .gitignore
+            if error.status != 1 or 'ignored' not in str(error.stderr):
+                raise error
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Large File Store
+
+Large files are split into fixed-size chunks kept in a content-addressed
+store outside of git, and the repo only gets a small pointer file listing
+the chunks. Identical chunks are stored once, whichever file and version
+they belong to. Stores are reached through a backend, new ones are added
+with register_backend.
+"""
+from os import path, makedirs, replace, remove, walk, getpid
+from hashlib import sha256
+from threading import get_ident
+from .ignore import IgnoreMatcher
+from .profile import count, BYTES_READ
+from .file import TMP_SUFFIX
+
+__all__ = ['Backend', 'LocalBackend', 'LargeFileStore', 'register_backend', 'open_backend', 'read_pointer',
+           'is_pointer_of', 'iter_pointers', 'load_large_store', 'POINTER_HEADER', 'CHUNK_SIZE', 'LARGE_FILES_KEY']
+
+# config key of the large file store settings
+LARGE_FILES_KEY = 'large_files'
+
+# first line of every pointer file
+POINTER_HEADER = b'gitsync-pointer 1\n'
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# private constant
+# pointers are read only up to this size, a 100 GiB file takes less than 2 MiB of chunk lines
+MAX_POINTER_SIZE = 4 * 1024 * 1024
+
+
+class Backend(object):
+    """Keeps chunks by key, the hex sha256 of their content"""
+
+    def has(self, key):
+        raise NotImplementedError()
+
+    def put(self, key, data):
+        raise NotImplementedError()
+
+    def get(self, key):
+        raise NotImplementedError()
+
+
+class LocalBackend(Backend):
+    """Chunks as files of a local dir, e.g. on another disk or a mounted share
+
+    Arguments:
+        root {str} -- Store dir, created when needed
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return path.join(self.root, key[:2], key[2:])
+
+    def has(self, key):
+        return path.exists(self._path(key))
+
+    def put(self, key, data):
+        chunk_path = self._path(key)
+        makedirs(path.dirname(chunk_path), exist_ok=True)
+        # concurrent writers of the same chunk each rename a complete file into place
+        tmp_path = '{0}.{1}.{2}.tmp'.format(chunk_path, getpid(), get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        replace(tmp_path, chunk_path)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+
+# backend name to factory called with the store settings
+BACKENDS = {
+    'local': lambda options: LocalBackend(options['path'])
+}
+
+
+def register_backend(name, factory):
+    """Make a backend available to the 'backend' setting of large_files
+
+    Arguments:
+        name {str} -- Backend name
+        factory {callable} -- Called with the large_files settings, returns a Backend
+    """
+    BACKENDS[name] = factory
+
+
+def open_backend(options):
+    """Backend for the large_files settings
+
+    Arguments:
+        options {dict} -- large_files settings, 'backend' defaults to 'local'
+
+    Raises:
+        ValueError -- raises if the backend is unknown
+
+    Returns:
+        Backend -- Backend
+    """
+    name = options.get('backend', 'local')
+    if name not in BACKENDS:
+        raise ValueError('Unknown large file store backend {0}'.format(name))
+    return BACKENDS[name](options)
+
+
+def load_large_store(config):
+    """Store set up by the large_files section of a config
+
+    Arguments:
+        config {dict} -- Config, large_files holds backend, the settings of the backend (path for local),
+                         min_size_mb and patterns
+
+    Returns:
+        LargeFileStore -- Store, None if the config has no large_files section
+    """
+    options = config.get(LARGE_FILES_KEY)
+    if not options:
+        return None
+    min_size_mb = options.get('min_size_mb')
+    min_size = None if min_size_mb is None else int(min_size_mb * 1024 * 1024)
+    return LargeFileStore(open_backend(options), config['repo_dir'], min_size=min_size,
+                          patterns=options.get('patterns'))
+
+
+def read_pointer(file_path):
+    """Parse a pointer file
+
+    Arguments:
+        file_path {str} -- File path
+
+    Returns:
+        dict -- sha256, size and chunks, None if the file isn't a pointer
+    """
+    with open(file_path, 'rb') as f:
+        if f.read(len(POINTER_HEADER)) != POINTER_HEADER:
+            return None
+        data = f.read(MAX_POINTER_SIZE)
+    pointer = {'chunks': []}
+    for line in data.decode('ascii', errors='replace').splitlines():
+        key, _, value = line.partition(' ')
+        if key == 'chunk':
+            pointer['chunks'].append(value)
+        elif key == 'size':
+            pointer['size'] = int(value)
+        elif key == 'sha256':
+            pointer['sha256'] = value
+    if 'size' not in pointer or 'sha256' not in pointer:
+        return None
+    return pointer
+
+
+def is_pointer_of(pointer_path, src_path, size):
+    """Whether a repo file is the pointer of what a source holds now
+
+    Only a pointer of the same size has the source read, to compare its sha256.
+
+    Arguments:
+        pointer_path {str} -- Repo file path
+        src_path {str} -- Source path
+        size {int} -- Source size
+
+    Returns:
+        bool -- True if the repo file is a pointer recording the size and sha256 of the source
+    """
+    try:
+        pointer = read_pointer(pointer_path)
+    except OSError:
+        return False
+    if pointer is None or pointer['size'] != size:
+        return False
+    digest = sha256()
+    with open(src_path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+        count(BYTES_READ, f.tell())
+    return digest.hexdigest() == pointer['sha256']
+
+
+def iter_pointers(root):
+    """Find pointer files under a dir, .git excluded
+
+    Arguments:
+        root {str} -- Dir path
+
+    Yields:
+        tuple -- (file path, pointer)
+    """
+    for dir_path, dir_names, file_names in walk(root):
+        if '.git' in dir_names:
+            dir_names.remove('.git')
+        for file_name in file_names:
+            file_path = path.join(dir_path, file_name)
+            if path.islink(file_path):
+                continue
+            try:
+                pointer = read_pointer(file_path)
+            except OSError:
+                continue
+            if pointer is not None:
+                yield file_path, pointer
+
+
+class LargeFileStore(object):
+    """Decides which repo files are kept in the store and converts them to and from pointers
+
+    Arguments:
+        backend {Backend} -- Chunk store
+        root {str} -- Repo dir the patterns are relative to
+
+    Keyword Arguments:
+        min_size {int} -- Files of at least this many bytes are stored, None for no size limit (default: {None})
+        patterns {list} -- Destinations matching these gitignore-style patterns are stored whatever their size (default: {None})
+        chunk_size {int} -- Chunk size (default: {CHUNK_SIZE})
+    """
+
+    def __init__(self, backend, root, min_size=None, patterns=None, chunk_size=CHUNK_SIZE):
+        self.backend = backend
+        self.min_size = min_size
+        self.matcher = IgnoreMatcher(patterns or [], root=root)
+        self.chunk_size = chunk_size
+
+    def applies(self, dst_path, size):
+        """Whether a destination is stored as pointer
+
+        Arguments:
+            dst_path {str} -- Destination path in the repo
+            size {int} -- Source size
+
+        Returns:
+            bool -- True if stored
+        """
+        if self.min_size is not None and size >= self.min_size:
+            return True
+        return bool(self.matcher) and self.matcher.match_path(dst_path)
+
+    def write_pointer(self, src_path, dst_path):
+        """Put the chunks of a source into the store and write its pointer to the destination
+
+        Arguments:
+            src_path {str} -- Source path
+            dst_path {str} -- Destination path
+
+        Returns:
+            tuple -- (size, bytes of new chunks)
+        """
+        digest = sha256()
+        keys = []
+        size = 0
+        added = 0
+        with open(src_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                key = sha256(chunk).hexdigest()
+                if not self.backend.has(key):
+                    self.backend.put(key, chunk)
+                    added += len(chunk)
+                digest.update(chunk)
+                keys.append(key)
+                size += len(chunk)
+        count(BYTES_READ, size)
+        lines = ['sha256 {0}'.format(digest.hexdigest()), 'size {0}'.format(size)]
+        lines.extend('chunk {0}'.format(key) for key in keys)
+        tmp_path = dst_path + TMP_SUFFIX
+        with open(tmp_path, 'wb') as f:
+            f.write(POINTER_HEADER)
+            f.write(('\n'.join(lines) + '\n').encode('ascii'))
+        replace(tmp_path, dst_path)
+        return size, added
+
+    def restore(self, pointer, dst_path):
+        """Write the content a pointer refers to
+
+        Arguments:
+            pointer {dict} -- As returned by read_pointer
+            dst_path {str} -- Where the content goes
+
+        Raises:
+            ValueError -- raises if the chunks don't add up to the recorded content
+
+        Returns:
+            int -- Size
+        """
+        digest = sha256()
+        size = 0
+        tmp_path = dst_path + TMP_SUFFIX
+        try:
+            with open(tmp_path, 'wb') as f:
+                for key in pointer['chunks']:
+                    chunk = self.backend.get(key)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    f.write(chunk)
+            if size != pointer['size'] or digest.hexdigest() != pointer['sha256']:
+                raise ValueError('Content of {0} doesn\'t match its pointer'.format(dst_path))
+            replace(tmp_path, dst_path)
+        except BaseException:
+            if path.exists(tmp_path):
+                remove(tmp_path)
+            raise
+        return size
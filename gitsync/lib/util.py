@@ -1,14 +1,34 @@
 import json
-from os import path
-from filecmp import dircmp, cmp
+import time
+from os import path, stat
+from itertools import chain
+from .manifest import MANIFEST_KEY, check_entry, iter_scan_dir
+from .walker import iter_diff, DEFAULT_WORKERS
+from .executor import Operation, COPY_FILE, DELETE_FILE, DELETE_DIR, MOVE, collect_operations
+from .ignore import IgnoreMatcher
+from .profile import count, STAT_CALLS
+from .store import LARGE_FILES_KEY
+from .odb import DIRECT_MANIFEST_KEY
+from .schedule import SCHEDULE_KEY, SCANNED_KEY
+from .index import ManifestIndex, EntriesView, write_index, diff_entries, iter_keyed, table_prefix
 
-__all__ = ['load_config', 'check_last_sync', 'load_last_sync', 'save_current_sync', 'check_sync_state', 'NO_LAST_SYNC_STATE']
+__all__ = ['load_config', 'check_last_sync', 'load_last_sync', 'save_current_sync', 'find_git_dir', 'read_head', 'read_upstream', 'moved_destinations', 'merge_copied', 'iter_sync_state', 'check_sync_state', 'NO_LAST_SYNC_STATE']
 
 # private constant
 STATE_FILE = '.state'
+# manifest entries are kept in this index next to .state, which lists its tables under INDEX_KEY of the manifest
+INDEX_FILE = '.state.idx'
+INDEX_KEY = 'index'
 CONFIG = {
     'FILES': 'files',
-    'DIRS': 'dirs'
+    'DIRS': 'dirs',
+    'IGNORE': 'ignore'
+}
+# manifest sections kept in the index, by how deep their entries are nested
+INDEXED_SECTIONS = {
+    CONFIG['FILES']: 1,
+    CONFIG['DIRS']: 2,
+    DIRECT_MANIFEST_KEY: 1
 }
 
 # exposed constant
@@ -30,14 +50,299 @@ def load_last_sync(repo_dir):
     data = dict()
     with open(path.join(repo_dir, STATE_FILE)) as f:
         data = json.load(f)
+    manifest = data.get(MANIFEST_KEY)
+    if manifest is not None and INDEX_KEY in manifest:
+        try:
+            index = ManifestIndex(path.join(repo_dir, INDEX_FILE))
+        except ValueError:
+            # a damaged index leaves the manifest without entries, the sync checks every source instead
+            del data[MANIFEST_KEY]
+            return data
+        for section, roots in manifest.pop(INDEX_KEY).items():
+            if roots is None:
+                manifest[section] = EntriesView(index, (section,))
+            else:
+                manifest[section] = dict((root, EntriesView(index, (section, root))) for root in roots)
     return data
 
-def save_current_sync(repo_dir, config):
-    """save the location of files defined in settings"""
+
+def _iter_tables(manifest):
+    for section, depth in INDEXED_SECTIONS.items():
+        if section not in manifest:
+            continue
+        if depth == 1:
+            yield (section,), manifest[section]
+        else:
+            for root, entries in manifest[section].items():
+                yield (section, root), entries
+
+
+def _saved_tables(repo_dir):
+    """Tables of the index as listed by .state, None if it doesn't list any"""
+    try:
+        with open(path.join(repo_dir, STATE_FILE)) as f:
+            listing = (json.load(f).get(MANIFEST_KEY) or {}).get(INDEX_KEY)
+    except (OSError, ValueError):
+        return None
+    if listing is None:
+        return None
+    tables = set()
+    for section, roots in listing.items():
+        if roots is None:
+            tables.add((section,))
+        else:
+            tables.update((section, root) for root in roots)
+    return tables
+
+
+def _save_index(repo_dir, manifest):
+    """Write manifest entries to the index and return the rest of the manifest along with the list of tables"""
+    index_path = path.join(repo_dir, INDEX_FILE)
+    saved_tables = _saved_tables(repo_dir)
+    tables = list(_iter_tables(manifest))
+    try:
+        index = ManifestIndex(index_path) if saved_tables is not None else None
+    except ValueError:
+        index = None
+    if index is None:
+        # first save, a .state from before the index or a damaged index: write it from scratch
+        write_index(index_path, chain.from_iterable(iter_keyed(table, entries) for table, entries in tables))
+    else:
+        with index:
+            changes = {}
+            deleted = []
+            for table, entries in tables:
+                saved_tables.discard(table)
+                if isinstance(entries, EntriesView) and entries.table == table and entries.index.stamp == index.stamp:
+                    # loaded from the index as it is now and left alone
+                    continue
+                table_changes, table_deleted = diff_entries(index, table, entries)
+                changes.update(table_changes)
+                deleted.extend(table_deleted)
+            for table in saved_tables:
+                deleted.extend(key for key, _ in index.iter_prefix(table_prefix(table)))
+            if changes or deleted:
+                index.update(changes, deleted)
+
+    state = dict((key, value) for key, value in manifest.items() if key not in INDEXED_SECTIONS)
+    state[INDEX_KEY] = {}
+    for section, depth in INDEXED_SECTIONS.items():
+        if section in manifest:
+            state[INDEX_KEY][section] = None if depth == 1 else list(manifest[section])
+    return state
+
+
+def save_current_sync(repo_dir, config, manifest=None):
+    """save the location of files defined in settings along with the stat manifest of synced files
+
+    entries of the manifest go to the index next to .state, only what changed since they were loaded is written
+    """
+    state = dict(config)
+    if manifest is not None:
+        state[MANIFEST_KEY] = _save_index(repo_dir, manifest)
     with open(path.join(repo_dir, STATE_FILE), 'w') as f:
-        f.write(json.dumps(config))
+        f.write(json.dumps(state))
+
+
+def find_git_dir(repo_dir):
+    """Git dir of a repo, following the .git file of linked worktrees and submodules
+
+    Arguments:
+        repo_dir {str} -- Repo path
+
+    Returns:
+        str -- Git dir path, None if there is none
+    """
+    git_dir = path.join(repo_dir, '.git')
+    if path.isfile(git_dir):
+        # linked worktree or submodule
+        with open(git_dir) as f:
+            content = f.read().strip()
+        if not content.startswith('gitdir:'):
+            return None
+        git_dir = path.join(repo_dir, content[len('gitdir:'):].strip())
+    return git_dir if path.isdir(git_dir) else None
+
+
+def _read_ref(repo_dir, ref=None):
+    """Resolve a ref, HEAD if not given, from the files under .git"""
+    try:
+        git_dir = find_git_dir(repo_dir)
+        if git_dir is None:
+            return None
+        common_dir = git_dir
+        if path.isfile(path.join(git_dir, 'commondir')):
+            with open(path.join(git_dir, 'commondir')) as f:
+                common_dir = path.join(git_dir, f.read().strip())
+        if ref is None:
+            with open(path.join(git_dir, 'HEAD')) as f:
+                head = f.read().strip()
+            if not head.startswith('ref:'):
+                return head or None
+            ref = head[len('ref:'):].strip()
+        for ref_dir in (git_dir, common_dir):
+            if path.isfile(path.join(ref_dir, ref)):
+                with open(path.join(ref_dir, ref)) as f:
+                    return f.read().strip() or None
+        with open(path.join(common_dir, 'packed-refs')) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return None
+
+
+def read_head(repo_dir):
+    """Commit HEAD of a repo points to, read from the files under .git without running git
+
+    Arguments:
+        repo_dir {str} -- Repo path
+
+    Returns:
+        str -- Hex sha, None if it can't be resolved this way
+    """
+    return _read_ref(repo_dir)
+
+
+def read_upstream(repo_dir, remote='origin'):
+    """Commit the remote-tracking branch of the current branch points to, read like read_head
+
+    The upstream branch is assumed to have the same name as the current one.
+
+    Arguments:
+        repo_dir {str} -- Repo path
+
+    Keyword Arguments:
+        remote {str} -- Remote name (default: {'origin'})
+
+    Returns:
+        str -- Hex sha, None if it can't be resolved this way
+    """
+    try:
+        with open(path.join(find_git_dir(repo_dir) or '', 'HEAD')) as f:
+            head = f.read().strip()
+    except OSError:
+        return None
+    prefix = 'ref: refs/heads/'
+    if not head.startswith(prefix):
+        return None
+    return _read_ref(repo_dir, 'refs/remotes/{0}/{1}'.format(remote, head[len(prefix):]))
+
+
+def _overlaps(path_a, path_b):
+    return path_a == path_b or path_a.startswith(path.join(path_b, '')) or path_b.startswith(path.join(path_a, ''))
+
+
+def moved_destinations(prev_config, config):
+    """Sources still synced but to another destination than at the last sync
+
+    Only destinations which no current mapping overlaps are listed, those can be moved as a whole.
+
+    Arguments:
+        prev_config {dict} -- Last sync state or NO_LAST_SYNC_STATE
+        config {dict} -- Current config
 
-def check_sync_state(prev_config, config, repo_dir):
+    Returns:
+        dict -- Source path to (last destination, current destination), both relative to the repo
+    """
+    if prev_config == NO_LAST_SYNC_STATE:
+        return {}
+    destinations = [path.normpath(dst_item) for key in (CONFIG['FILES'], CONFIG['DIRS'])
+                    for dst_item in config[key].values()]
+    moved = {}
+    for key in (CONFIG['FILES'], CONFIG['DIRS']):
+        prev_mapping = prev_config.get(key, {})
+        for src_path, dst_item in config[key].items():
+            prev_dst_item = prev_mapping.get(src_path)
+            if prev_dst_item is None or path.normpath(prev_dst_item) == path.normpath(dst_item):
+                continue
+            if any(_overlaps(path.normpath(prev_dst_item), destination) for destination in destinations):
+                continue
+            moved[src_path] = (prev_dst_item, dst_item)
+    return moved
+
+
+def merge_copied(prev_config, config, copied, unfinished=()):
+    """Take sources whose copy an interrupted sync finished as synced, at the signature they were copied with
+
+    Sources whose copy it left unfinished lose their entries instead, as their
+    repo copies may have been partly rewritten in place, so they are compared
+    by content. Only entries of mappings unchanged since the last sync are updated.
+
+    Arguments:
+        prev_config {dict} -- Last sync state, left as it is
+        config {dict} -- Current config
+        copied {dict} -- Source path to [size, mtime_ns, inode] of the source when copied
+
+    Keyword Arguments:
+        unfinished {list} -- Source paths of copies left unfinished (default: {()})
+
+    Returns:
+        dict -- Last sync state with the entries merged into its manifest, prev_config if there is nothing to merge
+    """
+    if prev_config == NO_LAST_SYNC_STATE or not prev_config.get(MANIFEST_KEY) or not (copied or unfinished):
+        return prev_config
+    manifest = prev_config[MANIFEST_KEY]
+    files_manifest = dict(manifest.get(CONFIG['FILES'], {}).items())
+    dirs_manifest = dict(manifest.get(CONFIG['DIRS'], {}))
+    roots = [(path.join(src_path, ''), src_path) for src_path, dst_item in config[CONFIG['DIRS']].items()
+             if prev_config[CONFIG['DIRS']].get(src_path) == dst_item and src_path in dirs_manifest]
+    changes = [(src_path, list(signature) + [None]) for src_path, signature in copied.items()]
+    changes.extend((src_path, None) for src_path in unfinished)
+    # entries of a dir are copied before the first change, the last state keeps its own
+    copied_roots = set()
+    for src_path, entry in changes:
+        if src_path in config[CONFIG['FILES']]:
+            if prev_config[CONFIG['FILES']].get(src_path) == config[CONFIG['FILES']][src_path]:
+                if entry is not None:
+                    files_manifest[src_path] = entry
+                else:
+                    files_manifest.pop(src_path, None)
+            continue
+        for prefix, root in roots:
+            if src_path.startswith(prefix):
+                if root not in copied_roots:
+                    dirs_manifest[root] = dict(dirs_manifest[root].items())
+                    copied_roots.add(root)
+                if entry is not None:
+                    dirs_manifest[root][path.relpath(src_path, root)] = entry
+                else:
+                    dirs_manifest[root].pop(path.relpath(src_path, root), None)
+                break
+    merged_config = dict(prev_config)
+    merged_config[MANIFEST_KEY] = dict(manifest)
+    merged_config[MANIFEST_KEY].update({CONFIG['FILES']: files_manifest, CONFIG['DIRS']: dirs_manifest})
+    return merged_config
+
+
+def iter_sync_state(prev_config, config, repo_dir, manifest=None, workers=DEFAULT_WORKERS, changed_paths=None,
+                    blobs=None, due=None):
+    """Compare sources against repo copies, yielding the operations to sync them as they are found
+
+    Entries whose mapping, ignore patterns and large file store settings are unchanged since the last sync are
+    checked against the stat manifest saved in .state, all others are compared in full.
+    If the config has a schedule, when each entry was checked in full is kept in the manifest.
+    A destination is always deleted before anything is copied to it. Repo copies
+    of sources mapped to another destination, and of renamed files and dirs,
+    are moved rather than copied again.
+
+    Arguments:
+        prev_config {dict} -- Last sync state or NO_LAST_SYNC_STATE
+        config {dict} -- Current config
+        repo_dir {str} -- Repo path
+
+    Keyword Arguments:
+        manifest {dict} -- Filled with the stat manifest of current sources to be saved with save_current_sync once the generator is exhausted (default: {None})
+        workers {int} -- Maximum number of dir pairs compared concurrently in full compares (default: {DEFAULT_WORKERS})
+        changed_paths {iterable} -- Source paths known to be changed, entries with a manifest elsewhere are left untouched (default: {None})
+        blobs {IndexBlobs} -- Blob hashes the git index records for repo copies, compared rather than the copies themselves (default: {None})
+        due {list} -- Source paths of the entries to check in this order, e.g. by due_sources, others with a manifest are left untouched (default: {None}, all in config order)
+
+    Yields:
+        Operation -- Operations to sync the repo
+    """
     if not CONFIG['FILES'] in config:
         raise AttributeError('Invalid config file. \'{0}\' key not found'.format(CONFIG['FILES']))
     if not CONFIG['DIRS'] in config:
@@ -53,11 +358,28 @@ def check_sync_state(prev_config, config, repo_dir):
     prev_dirs_mapping = prev_config[CONFIG['DIRS']] if prev_config != NO_LAST_SYNC_STATE else dict()
     files_mapping = config[CONFIG['FILES']]
     dirs_mapping = config[CONFIG['DIRS']]
-    dst_files_to_be_deleted = []
-    dst_dirs_to_be_deleted = []
-    src_files_to_be_copied = {}
-    src_dirs_to_be_copied = {}
-    
+    ignore = IgnoreMatcher(config.get(CONFIG['IGNORE'], {}).get('patterns', []), root=repo_dir)
+    prev_manifest = prev_config.get(MANIFEST_KEY) if prev_config != NO_LAST_SYNC_STATE else None
+    if prev_manifest is None or any(prev_config.get(key) != config.get(key)
+                                    for key in (CONFIG['IGNORE'], LARGE_FILES_KEY)):
+        prev_manifest = {}
+    prev_files_manifest = prev_manifest.get(CONFIG['FILES'], {})
+    prev_dirs_manifest = prev_manifest.get(CONFIG['DIRS'], {})
+    prev_scanned = prev_manifest.get(SCANNED_KEY) or {}
+    files_manifest = {}
+    dirs_manifest = {}
+    if changed_paths is not None:
+        changed_paths = set(path.normpath(changed_path) for changed_path in changed_paths)
+    rank = {}
+    if due is not None:
+        rank = dict((src_path, index) for index, src_path in enumerate(due))
+    started = time.time()
+    checked = set()
+
+    for src_path in files_mapping:
+        if not path.exists(src_path):
+            raise FileNotFoundError('Source location {0}: No such file to check sync state'.format(src_path))
+
     # check items listed in previous state doesn't no longer exist in current items
     ### files
     for prev_src_item, prev_dst_item in prev_files_mapping.items():
@@ -65,7 +387,7 @@ def check_sync_state(prev_config, config, repo_dir):
         prev_dst_path = path.join(repo_dir, prev_dst_item)
 
         if prev_src_item not in src_items:
-            dst_files_to_be_deleted.append(prev_dst_path)
+            yield Operation(DELETE_FILE, None, prev_dst_path)
 
     ### dirs
     for prev_src_item, prev_dst_item in prev_dirs_mapping.items():
@@ -73,96 +395,119 @@ def check_sync_state(prev_config, config, repo_dir):
         prev_dst_path = path.join(repo_dir, prev_dst_item)
 
         if prev_src_item not in src_items:
-            dst_dirs_to_be_deleted.append(prev_dst_path)
+            yield Operation(DELETE_DIR, None, prev_dst_path)
 
-    # TODO: check items listed in current state whether its destination is changed
-
-    
-    # recursively look into folders and items to check distinctions from previous state
-    ## for folder item: overwrite/add files in that folder if files can't be found or is modified
-    ## for file item: compare both and overwrite in that folder if file is modified or doesn't exist
-    # files, dirs = _categorize_file_mapping(file_mapping)
+    # repo copies of sources whose destination changed are moved, as long as the manifest still describes them
+    moved = set()
+    if prev_manifest:
+        for src_path, (prev_dst_item, dst_item) in moved_destinations(prev_config, config).items():
+            prev_entries = prev_files_manifest if src_path in files_mapping else prev_dirs_manifest
+            prev_dst_path = path.join(repo_dir, prev_dst_item)
+            dst_path = path.join(repo_dir, dst_item)
+            if src_path in prev_entries and path.lexists(prev_dst_path) and not path.lexists(dst_path):
+                moved.add(src_path)
+                yield Operation(MOVE, prev_dst_path, dst_path)
 
+    # compare sources with their repo copies
     ### files
-    for src_path, dst_item in files_mapping.items():
+    for src_path, dst_item in sorted(files_mapping.items(), key=lambda item: rank.get(item[0], len(rank))):
         dst_path = path.join(repo_dir, dst_item)
 
-        if not path.exists(src_path):
-            raise FileNotFoundError('Source location {0}: No such file to check sync state'.format(src_path))
-
-        to_sync = False
-        if not path.exists(dst_path):
-            to_sync = True
-        if not to_sync:
-            is_identical = cmp(src_path, dst_path)
-            to_sync = False if is_identical else True
+        prev_entry = None
+        if prev_files_mapping.get(src_path) == dst_item or src_path in moved:
+            prev_entry = prev_files_manifest.get(src_path)
+        if prev_entry is not None and due is not None and src_path not in rank:
+            # not due, kept as last checked
+            files_manifest[src_path] = prev_entry
+            continue
+        if prev_entry is not None and changed_paths is not None and path.normpath(src_path) not in changed_paths:
+            files_manifest[src_path] = prev_entry
+            continue
+        count(STAT_CALLS)
+        to_sync, files_manifest[src_path] = check_entry(src_path, dst_path, stat(src_path), prev_entry, blobs=blobs)
+        checked.add(src_path)
         if to_sync:
-            src_files_to_be_copied.update({src_path: dst_path})
+            yield Operation(COPY_FILE, src_path, dst_path)
 
     ### dirs
-    dir_mapping = {src_path: path.join(repo_dir, dst_item) for src_path, dst_item in dirs_mapping.items()}
-    dir_src_files_to_be_copied, dir_src_dirs_to_be_copied, dir_dst_files_to_be_deleted, dir_dst_dirs_to_be_deleted = _find_diff_folders(dir_mapping)
-
-    src_files_to_be_copied.update(dir_src_files_to_be_copied)
-    src_dirs_to_be_copied.update(dir_src_dirs_to_be_copied)
-    dst_files_to_be_deleted.extend(dir_dst_files_to_be_deleted)
-    dst_dirs_to_be_deleted.extend(dir_dst_dirs_to_be_deleted)
-
-    return src_files_to_be_copied, src_dirs_to_be_copied, dst_files_to_be_deleted, dst_dirs_to_be_deleted
-        
-def _categorize_file_mapping(file_mapping):
-    files = []
-    dirs = []
-    for src_item in file_mapping.keys():
-        dirs.append(src_item) if path.isdir(src_item) else files.append(src_item)
-    return files, dirs
-
-def _find_diff_folders(dir_mapping):
-    src_dirs_to_be_copied = {}
-    src_files_to_be_copied = {}
-    dst_dirs_to_be_deleted = []
-    dst_files_to_be_deleted = []
-    common_dirs_to_be_looked_into = {}
-    for src_path, dst_path in dir_mapping.items():
-        if not path.exists(src_path):
-            raise FileNotFoundError('Source location {0}: No such dir to check sync state'.format(src_path))
-
-        copy_entire_dir = False
-        if not path.exists(dst_path):
-            copy_entire_dir = True
-            src_dirs_to_be_copied.update({src_path: dst_path})
-        if not copy_entire_dir:
-            dircmp_report = dircmp(src_path, dst_path)
-            src_only = dircmp_report.left_only
-            src_files_only = [item for item in {item : item_path for item, item_path in {item: path.join(src_path, item) for item in src_only}.items() if path.isfile(item_path)}.keys()]
-            src_dirs_only = [item for item in {item : item_path for item, item_path in {item: path.join(src_path, item) for item in src_only}.items() if path.isdir(item_path)}.keys()]
-            src_files_only_with_path = list(map(lambda item: path.join(src_path, item), src_files_only))
-            src_files_only_with_path_mapping = {src_file_only_with_path: path.join(dst_path, src_files_only[index]) for index, src_file_only_with_path in enumerate(src_files_only_with_path)}
-            src_dirs_only_with_path = list(map(lambda item: path.join(src_path, item), src_dirs_only))
-            src_dirs_only_with_path_mapping = {src_dir_only_with_path: path.join(dst_path, src_dirs_only[index]) for index, src_dir_only_with_path in enumerate(src_dirs_only_with_path)}
-            dst_only = dircmp_report.right_only
-            dst_only_with_path = list(map(lambda item: path.join(dst_path, item), dst_only))
-            dst_files_only_with_path = list(filter(lambda item: path.isfile(item), dst_only_with_path))
-            dst_dirs_only_with_path = list(filter(lambda item: path.isdir(item), dst_only_with_path))
-            diff_files = dircmp_report.diff_files
-            diff_files_with_path = list(map(lambda item: path.join(src_path, item), diff_files))
-            diff_files_with_path_mapping = {src_file_with_path: path.join(dst_path, diff_files[index]) for index, src_file_with_path in enumerate(diff_files_with_path)}
-            common_dirs = dircmp_report.common_dirs
-            common_dirs_with_path = list(map(lambda item: path.join(src_path, item), dircmp_report.common_dirs))
-            common_dirs_mapping = {common_dir_with_path: path.join(dst_path, common_dirs[index]) for index, common_dir_with_path in enumerate(common_dirs_with_path)}
-
-            src_files_to_be_copied.update(src_files_only_with_path_mapping)
-            src_files_to_be_copied.update(diff_files_with_path_mapping)
-            src_dirs_to_be_copied.update(src_dirs_only_with_path_mapping)
-            dst_files_to_be_deleted.extend(dst_files_only_with_path)
-            dst_dirs_to_be_deleted.extend(dst_dirs_only_with_path)
-            common_dirs_to_be_looked_into.update(common_dirs_mapping)
-
-    if common_dirs_to_be_looked_into:
-        src_files_to_be_copied_from_common_dirs, src_dirs_to_be_copied_from_common_dirs, dst_files_to_be_deleted_from_common_dirs, dst_dirs_to_be_deleted_from_common_dirs = _find_diff_folders(common_dirs_to_be_looked_into)
-        src_files_to_be_copied.update(src_files_to_be_copied_from_common_dirs)
-        src_dirs_to_be_copied.update(src_dirs_to_be_copied_from_common_dirs)
-        dst_files_to_be_deleted.extend(dst_files_to_be_deleted_from_common_dirs)
-        dst_dirs_to_be_deleted.extend(dst_dirs_to_be_deleted_from_common_dirs)
-
-    return src_files_to_be_copied, src_dirs_to_be_copied, dst_files_to_be_deleted, dst_dirs_to_be_deleted
+    # dirs unchanged since last sync are diffed against the manifest without walking the repo copy
+    dir_mapping = {}
+    for src_path, dst_item in sorted(dirs_mapping.items(), key=lambda item: rank.get(item[0], len(rank))):
+        dst_path = path.join(repo_dir, dst_item)
+        prev_entries = None
+        if (prev_dirs_mapping.get(src_path) == dst_item and path.isdir(dst_path)) or src_path in moved:
+            prev_entries = prev_dirs_manifest.get(src_path)
+        dirs_manifest[src_path] = {}
+        if prev_entries is None:
+            # walked as a whole, recording its manifest entries on the way
+            dir_mapping.update({src_path: dst_path})
+            checked.add(src_path)
+            continue
+        if due is not None and src_path not in rank:
+            # not due, kept as last checked
+            dirs_manifest[src_path] = prev_entries
+            continue
+
+        only = None
+        if changed_paths is not None:
+            only = _changed_dirs(src_path, changed_paths)
+            if not only:
+                dirs_manifest[src_path] = prev_entries
+                continue
+        for operation in iter_scan_dir(src_path, dst_path, dirs_manifest[src_path], prev_entries,
+                                       ignore=ignore, only=only, blobs=blobs):
+            yield operation
+        if only is None:
+            checked.add(src_path)
+
+    if dir_mapping:
+        for operation in iter_diff(dir_mapping, ignore=ignore, workers=workers, blobs=blobs, entries=dirs_manifest):
+            yield operation
+
+    if manifest is not None:
+        manifest.clear()
+        manifest.update({CONFIG['FILES']: files_manifest, CONFIG['DIRS']: dirs_manifest})
+        if config.get(SCHEDULE_KEY):
+            manifest[SCANNED_KEY] = dict((src_path, started if src_path in checked else prev_scanned[src_path])
+                                         for src_path in chain(files_mapping, dirs_mapping)
+                                         if src_path in checked or src_path in prev_scanned)
+
+
+def check_sync_state(prev_config, config, repo_dir, manifest=None, workers=DEFAULT_WORKERS, changed_paths=None,
+                     blobs=None, due=None):
+    """Compare sources against repo copies and plan the sync
+
+    See iter_sync_state.
+
+    Arguments:
+        prev_config {dict} -- Last sync state or NO_LAST_SYNC_STATE
+        config {dict} -- Current config
+        repo_dir {str} -- Repo path
+
+    Keyword Arguments:
+        manifest {dict} -- Filled with the stat manifest of current sources to be saved with save_current_sync (default: {None})
+        workers {int} -- Maximum number of dir pairs compared concurrently in full compares (default: {DEFAULT_WORKERS})
+        changed_paths {iterable} -- Source paths known to be changed, entries with a manifest elsewhere are left untouched (default: {None})
+        blobs {IndexBlobs} -- Blob hashes the git index records for repo copies, compared rather than the copies themselves (default: {None})
+        due {list} -- Source paths of the entries to check in this order, others with a manifest are left untouched (default: {None}, all)
+
+    Returns:
+        tuple -- files to be copied, dirs to be copied, files to be deleted, dirs to be deleted
+    """
+    return collect_operations(iter_sync_state(prev_config, config, repo_dir, manifest=manifest,
+                                              workers=workers, changed_paths=changed_paths, blobs=blobs, due=due))
+
+def _changed_dirs(src_root, changed_paths):
+    """Relative dirs of a source dir which contain or are changed paths"""
+    src_root = path.normpath(src_root)
+    prefix = path.join(src_root, '')
+    changed_dirs = set()
+    for changed_path in changed_paths:
+        if changed_path != src_root and not changed_path.startswith(prefix):
+            continue
+        rel_path = path.relpath(changed_path, src_root)
+        rel_path = '' if rel_path == path.curdir else rel_path
+        changed_dirs.add(path.dirname(rel_path))
+        if path.isdir(changed_path):
+            changed_dirs.add(rel_path)
+    return changed_dirs
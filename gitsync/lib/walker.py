@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Tree Walker
+
+Compares source dirs against their repo copies with os.scandir, fanning
+directory pairs out over a bounded thread pool and yielding operations as
+soon as each level is compared. The same pass can record the manifest
+entries of the sources, so a first sync walks each tree only once.
+"""
+from os import path, scandir, readlink
+from stat import S_IFMT, S_ISLNK, S_ISREG
+from filecmp import cmp, DEFAULT_IGNORES
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from .ignore import as_matcher
+from .manifest import file_signature, file_digest, link_digest
+from .store import is_pointer_of
+from .profile import count, STAT_CALLS, CONTENT_COMPARES, INDEX_COMPARES, BYTES_READ
+from .executor import Operation, COPY_FILE, COPY_DIR, COPY_LINK, DELETE_FILE, DELETE_DIR, collect_operations
+
+__all__ = ['iter_diff', 'walk_diff', 'DEFAULT_WORKERS']
+
+DEFAULT_WORKERS = 8
+
+
+def _list_dir(dir_path, ignore, rel_dir):
+    """Map entry names of a dir to (is_dir, DirEntry), a symlink to a dir isn't one"""
+    entries = {}
+    with scandir(dir_path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                is_dir = False
+            if ignore and ignore.match(path.join(rel_dir, entry.name), is_dir):
+                continue
+            entries[entry.name] = (is_dir, entry)
+    return entries
+
+
+def _entry_of(src_entry, digest=None):
+    """Manifest entry of a source as iter_scan_dir records it, None for a dir"""
+    if src_entry.is_dir(follow_symlinks=False):
+        return None
+    count(STAT_CALLS)
+    return file_signature(src_entry.stat(follow_symlinks=not src_entry.is_symlink())) + [digest]
+
+
+def _copy(src_entry, dst_path):
+    return Operation(COPY_LINK if src_entry.is_symlink() else COPY_FILE, src_entry.path, dst_path)
+
+
+def _is_identical(src_entry, dst_entry, blobs=None, digest=False):
+    """Whether a source file and its repo copy hold the same content, along with the hash of the source if digest
+    is set and it is known without reading more than the comparison does"""
+    # same shortcut as filecmp.cmp but with the stat results DirEntry already holds
+    count(STAT_CALLS, 2)
+    try:
+        src_stat = src_entry.stat(follow_symlinks=False)
+        dst_stat = dst_entry.stat(follow_symlinks=False)
+    except OSError:
+        return False, None
+    if S_IFMT(src_stat.st_mode) != S_IFMT(dst_stat.st_mode):
+        return False, None
+    if S_ISLNK(src_stat.st_mode):
+        # symlinks are copied as links, what they point to isn't compared
+        identical = readlink(src_entry.path) == readlink(dst_entry.path)
+        return identical, link_digest(src_entry.path) if digest else None
+    if not S_ISREG(src_stat.st_mode):
+        # fifos, sockets and devices have no content to copy
+        return True, None
+    if src_stat.st_size != dst_stat.st_size:
+        # the repo copy of a large file is its pointer
+        return is_pointer_of(dst_entry.path, src_entry.path, src_stat.st_size), None
+    if src_stat.st_mtime == dst_stat.st_mtime:
+        return True, blobs.blob_of(dst_entry.path) if digest and blobs is not None else None
+    blob = blobs.blob_of(dst_entry.path) if blobs is not None else None
+    if blob is not None:
+        # only the source is read
+        count(INDEX_COMPARES)
+        src_digest = file_digest(src_entry.path)
+        return src_digest == blob, src_digest
+    count(CONTENT_COMPARES)
+    if digest:
+        # both are read in full either way, hashing them leaves the hash of the source for the manifest
+        src_digest = file_digest(src_entry.path)
+        return src_digest == file_digest(dst_entry.path), src_digest
+    count(BYTES_READ, src_stat.st_size * 2)
+    return cmp(src_entry.path, dst_entry.path, shallow=False), None
+
+
+def _compare_dir(src_path, dst_path, ignore, rel_dir, blobs=None, record=None):
+    """Compare one level of a directory pair
+
+    Returns:
+        tuple -- operations of this level, a deletion right before the copy replacing it; common dirs to look into
+                 with their paths relative to the ignore root and the manifest; manifest entries of this level if
+                 record, the path of this level relative to the manifest, is given; new dirs whose entries are to
+                 be recorded
+    """
+    operations = []
+    common_dirs = {}
+    records = {} if record is not None else None
+    new_dirs = {}
+
+    src_entries = _list_dir(src_path, ignore, rel_dir)
+    dst_entries = _list_dir(dst_path, ignore, rel_dir)
+    for name, (src_is_dir, src_entry) in src_entries.items():
+        dst_item_path = path.join(dst_path, name)
+        rel_path = path.join(record, name) if records is not None else None
+        sub_record = rel_path if src_is_dir else None
+        digest = None
+        if name not in dst_entries:
+            if src_is_dir:
+                operations.append(Operation(COPY_DIR, src_entry.path, dst_item_path))
+                if sub_record is not None:
+                    new_dirs[src_entry.path] = (path.join(rel_dir, name), sub_record)
+            else:
+                operations.append(_copy(src_entry, dst_item_path))
+        else:
+            dst_is_dir, dst_entry = dst_entries[name]
+            if src_is_dir and dst_is_dir:
+                common_dirs[src_entry.path] = (dst_item_path, path.join(rel_dir, name), sub_record)
+            elif src_is_dir:
+                operations.append(Operation(DELETE_FILE, None, dst_item_path))
+                operations.append(Operation(COPY_DIR, src_entry.path, dst_item_path))
+                if sub_record is not None:
+                    new_dirs[src_entry.path] = (path.join(rel_dir, name), sub_record)
+            elif dst_is_dir:
+                operations.append(Operation(DELETE_DIR, None, dst_item_path))
+                operations.append(_copy(src_entry, dst_item_path))
+            else:
+                identical, digest = _is_identical(src_entry, dst_entry, blobs, digest=records is not None)
+                if not identical:
+                    operations.append(_copy(src_entry, dst_item_path))
+        if records is not None:
+            records[rel_path] = _entry_of(src_entry, digest)
+
+    for name, (dst_is_dir, dst_entry) in dst_entries.items():
+        if name in src_entries:
+            continue
+        operations.append(Operation(DELETE_DIR if dst_is_dir else DELETE_FILE, None, dst_entry.path))
+
+    return operations, common_dirs, records, new_dirs
+
+
+def _record_dir(src_path, ignore, rel_dir, record):
+    """Record the manifest entries of one level of a source dir copied as a whole
+
+    Returns:
+        tuple -- same as _compare_dir, no operations and common dirs
+    """
+    records = {}
+    new_dirs = {}
+    for name, (_, src_entry) in _list_dir(src_path, ignore, rel_dir).items():
+        rel_path = path.join(record, name)
+        records[rel_path] = _entry_of(src_entry)
+        if records[rel_path] is None:
+            new_dirs[src_entry.path] = (path.join(rel_dir, name), rel_path)
+    return [], {}, records, new_dirs
+
+
+def iter_diff(dir_mapping, ignore=None, workers=DEFAULT_WORKERS, blobs=None, entries=None):
+    """Compare source dirs against their destinations recursively, yielding operations while the walk goes on
+
+    Files whose content is compared are hashed rather than compared byte by
+    byte when entries are recorded, so their entries carry the hash; files
+    found identical by their stat carry it if blobs know it, new ones don't.
+
+    Arguments:
+        dir_mapping {dict} -- Source dir path to destination dir path
+
+    Keyword Arguments:
+        ignore {IgnoreMatcher} -- Ignored entries are pruned, the same names as dircmp ignores if not given (default: {None})
+        workers {int} -- Maximum number of dir pairs compared concurrently (default: {DEFAULT_WORKERS})
+        blobs {IndexBlobs} -- Blob hashes of repo copies, compared rather than the copies themselves (default: {None})
+        entries {dict} -- Filled with the manifest entries of each source dir, keyed by source dir path, as
+                          iter_scan_dir records them; complete once the walk is over (default: {None})
+
+    Raises:
+        FileNotFoundError -- Raises if a source dir doesn't exist
+
+    Yields:
+        Operation -- Operations to sync the destinations
+    """
+    ignore = as_matcher(DEFAULT_IGNORES if ignore is None else ignore)
+    for src_path in dir_mapping:
+        if not path.exists(src_path):
+            raise FileNotFoundError('Source location {0}: No such dir to check sync state'.format(src_path))
+
+    record = '' if entries is not None else None
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        # the source dir of dir_mapping each level belongs to
+        roots = {}
+
+        def submit(root, common_dirs, new_dirs):
+            futures = [executor.submit(_compare_dir, src_path, dst_path, ignore, rel_dir, blobs, record)
+                       for src_path, (dst_path, rel_dir, record) in common_dirs.items()]
+            futures += [executor.submit(_record_dir, src_path, ignore, rel_dir, record)
+                        for src_path, (rel_dir, record) in new_dirs.items()]
+            roots.update((future, root) for future in futures)
+            return futures
+
+        pending = set()
+        for src_path, dst_path in dir_mapping.items():
+            rel_dir = ignore.base_of(dst_path)
+            if entries is not None:
+                entries[src_path] = {}
+            if not path.exists(dst_path):
+                yield Operation(COPY_DIR, src_path, dst_path)
+                if entries is not None:
+                    pending.update(submit(src_path, {}, {src_path: (rel_dir, record)}))
+            else:
+                pending.update(submit(src_path, {src_path: (dst_path, rel_dir, record)}, {}))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                root = roots.pop(future)
+                operations, sub_dirs, records, new_dirs = future.result()
+                # sub dirs are compared while the caller works on this level
+                pending.update(submit(root, sub_dirs, new_dirs))
+                if records is not None:
+                    entries[root].update(records)
+                for operation in operations:
+                    yield operation
+
+
+def walk_diff(dir_mapping, ignore=None, workers=DEFAULT_WORKERS, blobs=None):
+    """Compare source dirs against their destinations recursively
+
+    Arguments:
+        dir_mapping {dict} -- Source dir path to destination dir path
+
+    Keyword Arguments:
+        ignore {IgnoreMatcher} -- Ignored entries are pruned, the same names as dircmp ignores if not given (default: {None})
+        workers {int} -- Maximum number of dir pairs compared concurrently (default: {DEFAULT_WORKERS})
+        blobs {IndexBlobs} -- Blob hashes of repo copies, compared rather than the copies themselves (default: {None})
+
+    Raises:
+        FileNotFoundError -- Raises if a source dir doesn't exist
+
+    Returns:
+        tuple -- files to be copied, dirs to be copied, files to be deleted, dirs to be deleted
+    """
+    return collect_operations(iter_diff(dir_mapping, ignore=ignore, workers=workers, blobs=blobs))
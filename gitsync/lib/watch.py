@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""Source Watcher
+
+Subscribes to inotify events of sources and merges bursts of changes into
+debounced batches of changed paths. Linux only.
+"""
+from os import path, scandir, read, close
+from select import select
+import ctypes
+import ctypes.util
+import errno
+import struct
+import time
+from .ignore import as_matcher
+
+__all__ = ['Watcher', 'WatchError', 'FULL_RESCAN']
+
+# returned instead of changed paths when events were lost
+FULL_RESCAN = None
+
+# private constant
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+
+class WatchError(Exception):
+    pass
+
+
+def _load_libc():
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise WatchError('inotify is not supported on this platform')
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+class Watcher(object):
+    """Watch source files and dirs recursively
+
+    Files are watched through their parent dirs, so they are still followed
+    when an editor replaces them by renaming.
+
+    Arguments:
+        files {iterable} -- Source file paths
+        dirs {dict} -- Source dir paths to their paths in the repo
+
+    Keyword Arguments:
+        ignore {IgnoreMatcher} -- Ignored dirs aren't watched and their events are dropped, matched by path in the repo (default: {None})
+    """
+
+    def __init__(self, files, dirs, ignore=None):
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatchError('inotify_init1 failed: {0}'.format(errno.errorcode.get(ctypes.get_errno())))
+        self._ignore = as_matcher(ignore)
+        # watch descriptor to dir path, and to path in the repo for dirs watched recursively
+        self._dirs = {}
+        self._trees = {}
+        self._files = set(path.normpath(file_path) for file_path in files)
+        for parent in set(path.dirname(file_path) for file_path in self._files):
+            self._add_watch(parent)
+        for dir_path, dst_item in dirs.items():
+            self._add_tree(path.normpath(dir_path), path.normpath(dst_item))
+
+    def close(self):
+        close(self._fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _add_watch(self, dir_path, rel_dir=None):
+        wd = self._libc.inotify_add_watch(self._fd, dir_path.encode(), WATCH_MASK | IN_ONLYDIR)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise WatchError('inotify watch limit reached, raise fs.inotify.max_user_watches')
+            # gone meanwhile
+            return
+        self._dirs[wd] = dir_path
+        if rel_dir is not None:
+            self._trees[wd] = rel_dir
+
+    def _add_tree(self, dir_path, rel_dir):
+        pending = [(dir_path, rel_dir)]
+        while pending:
+            current, rel_current = pending.pop()
+            self._add_watch(current, rel_current)
+            try:
+                with scandir(current) as it:
+                    for entry in it:
+                        rel_path = path.join(rel_current, entry.name)
+                        if entry.is_dir(follow_symlinks=False) and not self._ignore.match(rel_path, True):
+                            pending.append((entry.path, rel_path))
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+
+    def _read_events(self):
+        """Read pending events
+
+        Returns:
+            set -- Changed paths, FULL_RESCAN if the event queue overflowed
+        """
+        changed = set()
+        overflow = False
+        while True:
+            try:
+                data = read(self._fd, READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                dir_path = self._dirs.get(wd)
+                if dir_path is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._dirs[wd]
+                    self._trees.pop(wd, None)
+                    continue
+                if not name:
+                    # the watched dir itself
+                    if wd in self._trees:
+                        changed.add(dir_path)
+                    continue
+                event_path = path.join(dir_path, name)
+                if wd not in self._trees:
+                    # parent of a watched file
+                    if event_path in self._files:
+                        changed.add(event_path)
+                    continue
+                rel_path = path.join(self._trees[wd], name)
+                if self._ignore.match(rel_path, bool(mask & IN_ISDIR)):
+                    continue
+                changed.add(event_path)
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(event_path, rel_path)
+        return FULL_RESCAN if overflow else changed
+
+    def wait(self, debounce=2.0, max_delay=60.0):
+        """Block until sources change and return once no more events arrived for debounce seconds
+
+        Keyword Arguments:
+            debounce {float} -- Quiet period closing a batch in seconds (default: {2.0})
+            max_delay {float} -- Longest time a batch is held back by continuous changes in seconds (default: {60.0})
+
+        Returns:
+            set -- Changed paths, FULL_RESCAN if events were lost
+        """
+        select([self._fd], [], [])
+        changed = set()
+        started = time.monotonic()
+        while True:
+            events = self._read_events()
+            if events is FULL_RESCAN or changed is FULL_RESCAN:
+                changed = FULL_RESCAN
+            else:
+                changed.update(events)
+            timeout = min(debounce, max_delay - (time.monotonic() - started))
+            if timeout <= 0:
+                return changed
+            readable, _, _ = select([self._fd], [], [], timeout)
+            if not readable:
+                return changed
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Delta copies of large files into their existing repo copies"""
+from unittest import mock
+from hashlib import blake2b
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitsync.lib.delta import BlockCache, delta_copy
+
+BLOCK_SIZE = 16
+
+
+class DeltaCopyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache = BlockCache(os.path.join(self.root, 'blocks'), threshold=0, block_size=BLOCK_SIZE)
+        self.src_path = os.path.join(self.root, 'src')
+        self.dst_path = os.path.join(self.root, 'dst')
+
+    def write(self, file_path, content):
+        with open(file_path, 'wb') as f:
+            f.write(content)
+
+    def read(self, file_path):
+        with open(file_path, 'rb') as f:
+            return f.read()
+
+    def test_only_changed_blocks_are_written(self):
+        content = bytes(range(64))
+        self.write(self.src_path, content)
+        self.write(self.dst_path, content[:16] + b'x' * 16 + content[32:])
+        self.assertEqual(delta_copy(self.src_path, self.dst_path, self.cache), (64, 16))
+        self.assertEqual(self.read(self.dst_path), content)
+
+        # cached digests stand for the destination, which isn't read again
+        changed = content[:48] + b'y' * 16
+        self.write(self.src_path, changed)
+        with mock.patch('gitsync.lib.delta.count') as count:
+            self.assertEqual(delta_copy(self.src_path, self.dst_path, self.cache), (64, 16))
+        count.assert_called_once_with(mock.ANY, 64)
+        self.assertEqual(self.read(self.dst_path), changed)
+
+    def test_destination_is_rewritten_in_place(self):
+        self.write(self.src_path, b'a' * 40)
+        self.write(self.dst_path, b'b' * 40)
+        inode = os.stat(self.dst_path).st_ino
+        # not written aside and renamed like other copies, what has been written stays if the copy is interrupted
+        with mock.patch('gitsync.lib.delta.blake2b', side_effect=[mock.DEFAULT, RuntimeError()], wraps=blake2b):
+            with self.assertRaises(RuntimeError):
+                delta_copy(self.src_path, self.dst_path, self.cache)
+        self.assertEqual(self.read(self.dst_path), b'a' * 16 + b'b' * 24)
+        self.assertEqual(os.stat(self.dst_path).st_ino, inode)
+        self.assertEqual(sorted(os.listdir(self.root)), ['dst', 'src'])
+
+        delta_copy(self.src_path, self.dst_path, self.cache)
+        self.assertEqual(self.read(self.dst_path), b'a' * 40)
+        self.assertEqual(os.stat(self.dst_path).st_ino, inode)
+
+    def test_destination_size_follows_the_source(self):
+        self.write(self.src_path, b'a' * 20)
+        self.write(self.dst_path, b'a' * 50)
+        delta_copy(self.src_path, self.dst_path, self.cache)
+        self.assertEqual(self.read(self.dst_path), b'a' * 20)
+        self.write(self.src_path, b'a' * 20 + b'b' * 30)
+        delta_copy(self.src_path, self.dst_path, self.cache)
+        self.assertEqual(self.read(self.dst_path), b'a' * 20 + b'b' * 30)
+
+    def test_source_shrinking_meanwhile_cuts_the_destination(self):
+        self.write(self.src_path, b'a' * 64)
+        self.write(self.dst_path, b'b' * 64)
+        real_fstat = os.fstat
+        calls = []
+
+        def fstat(fd):
+            # the size is taken, then the source is cut before it is read
+            stat_result = real_fstat(fd)
+            if not calls:
+                calls.append(fd)
+                os.truncate(self.src_path, 24)
+            return stat_result
+
+        with mock.patch('gitsync.lib.delta.fstat', side_effect=fstat):
+            self.assertEqual(delta_copy(self.src_path, self.dst_path, self.cache), (24, 24))
+        self.assertEqual(self.read(self.dst_path), b'a' * 24)
+        # the digests stored match what the destination holds now
+        self.assertEqual(len(self.cache.load(self.dst_path, os.stat(self.dst_path))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
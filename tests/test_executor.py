@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Ordering of concurrent sync operations"""
+from unittest import mock
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from gitsync.lib.executor import (Operation, COPY_FILE, COPY_DIR, DELETE_FILE, DELETE_DIR, MOVE, _dependencies,
+                                  _touched, execute_operations)
+
+
+class DependenciesTest(unittest.TestCase):
+
+    def test_waits_for_the_same_path_its_parents_and_what_is_below(self):
+        scheduled = {'/r/a': 'a', '/r/a/b': 'a/b', '/r/a/b/c': 'a/b/c', '/r': 'r', '/r/ab': 'ab', '/r/x': 'x'}
+        self.assertEqual(set(_dependencies(['/r/a/b'], scheduled)), {'a/b', 'a', 'r', 'a/b/c'})
+
+    def test_a_name_prefix_is_no_parent(self):
+        scheduled = {'/r/a': 'a', '/r/ab/c': 'ab/c'}
+        self.assertEqual(_dependencies(['/r/ab'], scheduled), ['ab/c'])
+        self.assertEqual(_dependencies(['/r/a/b'], scheduled), ['a'])
+
+    def test_a_move_touches_both_its_paths(self):
+        operation = Operation(MOVE, '/r/old', '/r/new')
+        self.assertEqual(_touched(operation), ['/r/new', '/r/old'])
+        scheduled = {'/r/old/f': 'f', '/r/other': 'other'}
+        self.assertEqual(_dependencies(_touched(operation), scheduled), ['f'])
+
+
+class ExecuteOperationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def path(self, *names):
+        return os.path.join(self.root, *names)
+
+    def test_operations_on_related_paths_run_in_planned_order(self):
+        order = []
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def run_operation(operation, **options):
+            if operation.dst_path == self.path('dst'):
+                # later operations below it must not overtake the slow deletion
+                release.wait(5)
+            with lock:
+                order.append(operation)
+
+        operations = [Operation(DELETE_DIR, None, self.path('dst')),
+                      Operation(COPY_FILE, self.path('src', 'f'), self.path('dst', 'f')),
+                      Operation(DELETE_FILE, None, self.path('unrelated'))]
+        with mock.patch('gitsync.lib.executor.run_operation', side_effect=run_operation):
+            timer = threading.Timer(0.2, release.set)
+            timer.start()
+            self.assertEqual(execute_operations(operations, jobs=4), [])
+            timer.join()
+        self.assertEqual(order, [operations[2], operations[0], operations[1]])
+
+    def test_failures_are_collected_and_others_still_run(self):
+        os.makedirs(self.path('src', 'dir'))
+        with open(self.path('src', 'dir', 'f'), 'w') as f:
+            f.write('f\n')
+        operations = [Operation(COPY_FILE, self.path('src', 'missing'), self.path('dst', 'missing')),
+                      Operation(COPY_DIR, self.path('src', 'dir'), self.path('dst', 'dir'))]
+        os.makedirs(self.path('dst'))
+        failures = execute_operations(operations, jobs=2)
+        self.assertEqual([operation for operation, _ in failures], operations[:1])
+        self.assertIsInstance(failures[0][1], FileNotFoundError)
+        self.assertTrue(os.path.isfile(self.path('dst', 'dir', 'f')))
+
+
+if __name__ == '__main__':
+    unittest.main()
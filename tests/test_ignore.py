@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Ignore patterns matched with gitignore semantics"""
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from gitsync.lib.ignore import IgnoreMatcher, as_matcher
+
+
+class IgnoreMatcherTest(unittest.TestCase):
+
+    def assertIgnored(self, matcher, *rel_paths, is_dir=False):
+        for rel_path in rel_paths:
+            self.assertTrue(matcher.match(rel_path, is_dir), rel_path)
+
+    def assertKept(self, matcher, *rel_paths, is_dir=False):
+        for rel_path in rel_paths:
+            self.assertFalse(matcher.match(rel_path, is_dir), rel_path)
+
+    def test_unanchored_patterns_match_the_name_at_any_depth(self):
+        matcher = IgnoreMatcher(['target', '*.log'])
+        self.assertIgnored(matcher, 'target', 'a/target', 'a/b/target', 'x.log', 'a/x.log')
+        self.assertKept(matcher, 'targets', 'a/target.txt', 'x.log.gz', 'log')
+
+    def test_a_slash_anchors_the_pattern_to_the_root(self):
+        matcher = IgnoreMatcher(['/build', 'docs/*.html'])
+        self.assertIgnored(matcher, 'build', 'docs/index.html')
+        self.assertKept(matcher, 'a/build', 'a/docs/index.html', 'docs/sub/index.html')
+
+    def test_double_star(self):
+        matcher = IgnoreMatcher(['**/cache', 'logs/**', 'a/**/z'])
+        self.assertIgnored(matcher, 'cache', 'x/y/cache', 'logs/1', 'logs/x/2', 'a/z', 'a/b/c/z')
+        self.assertKept(matcher, 'logs', 'b/a/z')
+
+    def test_dir_only_patterns(self):
+        matcher = IgnoreMatcher(['node_modules/', '/out/'])
+        self.assertIgnored(matcher, 'node_modules', 'a/node_modules', 'out', is_dir=True)
+        self.assertKept(matcher, 'node_modules', 'out')
+        self.assertKept(matcher, 'a/out', is_dir=True)
+
+    def test_the_last_matching_pattern_decides(self):
+        matcher = IgnoreMatcher(['*.log', '!keep.log', 'keep.log/', '/tmp/keep.log'])
+        self.assertIgnored(matcher, 'x.log', 'tmp/keep.log')
+        self.assertKept(matcher, 'keep.log', 'a/keep.log')
+        self.assertIgnored(matcher, 'keep.log', is_dir=True)
+
+        matcher = IgnoreMatcher(['!keep.log', '*.log'])
+        self.assertIgnored(matcher, 'keep.log')
+
+    def test_escapes_comments_and_blank_lines(self):
+        matcher = IgnoreMatcher(['# comment', '', '\\#hash', '\\!bang', 'a\\*b', 'x[0-9]', 'y[!0-9]'])
+        self.assertIgnored(matcher, '#hash', '!bang', 'a*b', 'x1', 'ya')
+        self.assertKept(matcher, '# comment', 'comment', 'axb', 'xa', 'y1')
+        self.assertFalse(IgnoreMatcher(['# only a comment']))
+
+    def test_paths_relative_to_root(self):
+        matcher = as_matcher(['/tree/sub'], root=os.path.join(os.sep, 'repo'))
+        self.assertIs(as_matcher(matcher), matcher)
+        self.assertEqual(matcher.base_of(os.path.join(os.sep, 'repo')), '')
+        self.assertTrue(matcher.match_path(os.path.join(os.sep, 'repo', 'tree', 'sub'), True))
+        self.assertFalse(matcher.match_path(os.path.join(os.sep, 'repo', 'sub'), True))
+
+
+class GitAgreementTest(unittest.TestCase):
+    """The matcher agrees with git on the .gitignore written from the same patterns"""
+
+    PATTERNS = ['*.log', '!keep.log', '/build', 'docs/**/*.html', 'cache/', '!/cache/', 'tmp?', '[ab].txt']
+    PATHS = ['x.log', 'keep.log', 'a/keep.log', 'build', 'a/build', 'docs/x.html', 'docs/a/b/x.html', 'a/docs/x.html',
+             'cache/', 'a/cache/', 'tmp1', 'tmp12', 'a.txt', 'c.txt']
+
+    def test_same_result_as_git_check_ignore(self):
+        root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, root)
+        subprocess.run(['git', 'init', '-q', root], check=True)
+        with open(os.path.join(root, '.gitignore'), 'w') as f:
+            f.write('\n'.join(self.PATTERNS) + '\n')
+        result = subprocess.run(['git', 'check-ignore', '--no-index', '--stdin'], cwd=root, stdout=subprocess.PIPE,
+                                input='\n'.join(self.PATHS).encode())
+        ignored_by_git = set(result.stdout.decode().splitlines())
+
+        matcher = IgnoreMatcher(self.PATTERNS)
+        for rel_path in self.PATHS:
+            is_dir = rel_path.endswith('/')
+            self.assertEqual(matcher.match(rel_path.rstrip('/'), is_dir), rel_path in ignored_by_git, rel_path)
+
+
+if __name__ == '__main__':
+    unittest.main()
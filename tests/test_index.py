@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Manifest index, its log and their compaction"""
+from unittest import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitsync.lib.index import ManifestIndex, EntriesView, write_index, diff_entries, iter_keyed, LOG_SUFFIX
+from gitsync.lib.util import save_current_sync, load_last_sync, MANIFEST_KEY, INDEX_FILE
+
+DIGEST = 'ab' * 20
+
+
+class IndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.index_path = os.path.join(self.root, 'index')
+
+    def open_index(self):
+        index = ManifestIndex(self.index_path)
+        self.addCleanup(index.close)
+        return index
+
+
+class ManifestIndexTest(IndexTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.entries = {'a': [1, 10, 100, DIGEST], 'b': [2, 20, 200, None], 'd': None, 'd/c': [3, 30, 300, None]}
+        write_index(self.index_path, iter_keyed(('dirs', '/src'), self.entries))
+
+    def test_entries_read_back(self):
+        index = self.open_index()
+        view = EntriesView(index, ('dirs', '/src'))
+        self.assertEqual(dict(view.items()), self.entries)
+        self.assertEqual(view['a'], [1, 10, 100, DIGEST])
+        self.assertIsNone(view['d'])
+        self.assertNotIn('c', view)
+        self.assertEqual(len(EntriesView(index, ('dirs', '/other'))), 0)
+
+    def test_the_log_overrides_the_table(self):
+        index = self.open_index()
+        changes, deleted = diff_entries(index, ('dirs', '/src'), {'a': [1, 11, 100, None], 'aa': [4, 40, 400, None],
+                                                                  'd': None, 'd/c': [3, 30, 300, None]})
+        self.assertEqual(deleted, [b'dirs\0/src\0b'])
+        index.update(changes, deleted)
+        self.assertTrue(os.path.exists(self.index_path + LOG_SUFFIX))
+
+        view = EntriesView(self.open_index(), ('dirs', '/src'))
+        self.assertEqual(list(view.items()), [('a', [1, 11, 100, None]), ('aa', [4, 40, 400, None]),
+                                              ('d', None), ('d/c', [3, 30, 300, None])])
+        self.assertNotIn('b', view)
+
+    def test_a_torn_log_line_ends_the_log(self):
+        index = self.open_index()
+        index.update({b'dirs\0/src\0a': [9, 90, 900, None]}, [])
+        with open(self.index_path + LOG_SUFFIX, 'a') as f:
+            f.write('["dirs\\u0000/src\\u0000b"')
+        view = EntriesView(self.open_index(), ('dirs', '/src'))
+        self.assertEqual(view['a'], [9, 90, 900, None])
+        self.assertEqual(view['b'], [2, 20, 200, None])
+
+    def test_a_large_log_is_folded_into_a_new_table(self):
+        index = self.open_index()
+        with mock.patch('gitsync.lib.index.COMPACT_MIN', 1):
+            index.update({b'dirs\0/src\0e': [5, 50, 500, None]}, [b'dirs\0/src\0b'])
+        self.assertFalse(os.path.exists(self.index_path + LOG_SUFFIX))
+        compacted = self.open_index()
+        self.assertEqual(compacted.count, 4)
+        self.assertEqual(list(EntriesView(compacted, ('dirs', '/src'))), ['a', 'd', 'd/c', 'e'])
+        # the old mapping still reads the table it was opened with
+        self.assertEqual(EntriesView(index, ('dirs', '/src'))['b'], [2, 20, 200, None])
+
+    def test_damaged_files_are_rejected(self):
+        with open(self.index_path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.index_path) - 1)
+        with self.assertRaises(ValueError):
+            ManifestIndex(self.index_path)
+        with open(self.index_path, 'wb') as f:
+            f.write(b'not an index at all')
+        with self.assertRaises(ValueError):
+            ManifestIndex(self.index_path)
+
+    def test_a_missing_file_is_an_empty_index(self):
+        index = ManifestIndex(os.path.join(self.root, 'missing'))
+        self.assertEqual(list(index.iter_prefix(b'')), [])
+
+
+class SavedStateTest(IndexTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.config = {'repo_dir': self.root, 'files': {}, 'dirs': {'/src': 'tree'}}
+        self.manifest = {'files': {'/a': [1, 10, 100, None]}, 'dirs': {'/src': {'x': [2, 20, 200, DIGEST]}}}
+
+    def test_manifest_round_trip(self):
+        save_current_sync(self.root, self.config, self.manifest)
+        manifest = load_last_sync(self.root)[MANIFEST_KEY]
+        self.assertEqual(dict(manifest['files'].items()), self.manifest['files'])
+        self.assertEqual(dict(manifest['dirs']['/src'].items()), self.manifest['dirs']['/src'])
+
+    def test_a_corrupt_index_drops_the_manifest_and_is_rewritten(self):
+        save_current_sync(self.root, self.config, self.manifest)
+        with open(os.path.join(self.root, INDEX_FILE), 'wb') as f:
+            f.write(b'garbage')
+        state = load_last_sync(self.root)
+        self.assertNotIn(MANIFEST_KEY, state)
+        self.assertEqual(state['dirs'], self.config['dirs'])
+
+        # the sync after a rescan saves its manifest from scratch
+        save_current_sync(self.root, self.config, self.manifest)
+        manifest = load_last_sync(self.root)[MANIFEST_KEY]
+        self.assertEqual(dict(manifest['dirs']['/src'].items()), self.manifest['dirs']['/src'])
+
+
+if __name__ == '__main__':
+    unittest.main()
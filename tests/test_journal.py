@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Recovery from a sync which died halfway through its operations"""
+from unittest import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitsync.lib.executor import Operation, COPY_FILE, COPY_DIR, COPY_LINK, DELETE_FILE, MOVE, execute_operations
+from gitsync.lib.file import TMP_SUFFIX, copy_file as real_copy_file
+from gitsync.lib.journal import Journal, load_journal, recover_operations
+
+
+class JournalTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.journal_path = os.path.join(self.root, 'journal')
+
+    def path(self, *names):
+        return os.path.join(self.root, *names)
+
+    def write(self, file_path, content):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(content)
+
+
+class LoadJournalTest(JournalTestCase):
+
+    def test_no_journal(self):
+        self.assertIsNone(load_journal(self.journal_path))
+
+    def test_unfinished_operations_are_pending(self):
+        copy = Operation(COPY_FILE, '/src/a', '/dst/a')
+        delete = Operation(DELETE_FILE, None, '/dst/b')
+        journal = Journal(self.journal_path, 'head1')
+        journal.done(journal.plan(copy), [1, 10, 100])
+        journal.plan(delete)
+        journal.close()
+
+        loaded = load_journal(self.journal_path)
+        self.assertEqual(loaded['head'], 'head1')
+        self.assertEqual(loaded['pending'], [delete])
+        self.assertEqual(loaded['done'], [copy])
+        self.assertEqual(loaded['copied'], {'/src/a': [1, 10, 100]})
+
+    def test_a_later_segment_copying_again_forgets_the_earlier_copy(self):
+        copy = Operation(COPY_FILE, '/src/a', '/dst/a')
+        journal = Journal(self.journal_path, 'head1')
+        journal.done(journal.plan(copy), [1, 10, 100])
+        journal.close()
+        journal = Journal(self.journal_path, 'head2')
+        journal.plan(copy)
+        journal.close()
+
+        loaded = load_journal(self.journal_path)
+        self.assertEqual(loaded['head'], 'head2')
+        self.assertEqual(loaded['pending'], [copy])
+        self.assertEqual(loaded['copied'], {})
+
+    def test_a_torn_last_line_is_ignored(self):
+        copy = Operation(COPY_FILE, '/src/a', '/dst/a')
+        journal = Journal(self.journal_path, 'head1')
+        number = journal.plan(copy)
+        journal.close()
+        with open(self.journal_path, 'a') as f:
+            f.write('["done", {0}, [1, 10'.format(number))
+        self.assertEqual(load_journal(self.journal_path)['pending'], [copy])
+
+    def test_the_executor_records_what_it_finished(self):
+        self.write(self.path('src', 'a'), 'a')
+        self.write(self.path('src', 'b'), 'b')
+        os.symlink('a', self.path('src', 'link'))
+        os.makedirs(self.path('dst'))
+        operations = [Operation(COPY_FILE, self.path('src', 'a'), self.path('dst', 'a')),
+                      Operation(COPY_LINK, self.path('src', 'link'), self.path('dst', 'link')),
+                      Operation(COPY_FILE, self.path('src', 'b'), self.path('dst', 'b'))]
+        journal = Journal(self.journal_path, 'head1')
+
+        def copy_file(src_path, dst_path, **options):
+            if src_path.endswith('b'):
+                raise OSError('disk full')
+            real_copy_file(src_path, dst_path, **options)
+
+        with mock.patch('gitsync.lib.executor.copy_file', side_effect=copy_file):
+            failures = execute_operations(operations, jobs=1, journal=journal)
+        journal.close()
+        self.assertEqual([operation for operation, _ in failures], operations[2:])
+
+        loaded = load_journal(self.journal_path)
+        self.assertEqual(loaded['pending'], operations[2:])
+        stat_result = os.stat(self.path('src', 'a'))
+        link_stat = os.lstat(self.path('src', 'link'))
+        self.assertEqual(loaded['copied'], {
+            self.path('src', 'a'): [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino],
+            self.path('src', 'link'): [link_stat.st_size, link_stat.st_mtime_ns, link_stat.st_ino]})
+
+
+class RecoverOperationsTest(JournalTestCase):
+
+    def test_temp_files_of_unfinished_copies_are_removed(self):
+        dst_path = self.path('dst', 'a')
+        self.write(dst_path, 'old')
+        self.write(dst_path + TMP_SUFFIX, 'half of the new')
+        os.symlink('target', self.path('dst', 'link') + TMP_SUFFIX)
+        operations = [Operation(COPY_FILE, '/src/a', dst_path),
+                      Operation(COPY_LINK, '/src/link', self.path('dst', 'link'))]
+        self.assertEqual(recover_operations(operations),
+                         [dst_path + TMP_SUFFIX, self.path('dst', 'link') + TMP_SUFFIX])
+        self.assertEqual(sorted(os.listdir(self.path('dst'))), ['a'])
+        with open(dst_path) as f:
+            self.assertEqual(f.read(), 'old')
+
+    def test_a_delta_copy_left_halfway_loses_its_block_digests(self):
+        dst_path = self.path('dst', 'large')
+        self.write(dst_path, 'partly rewritten')
+        block_cache = mock.Mock()
+        self.assertEqual(recover_operations([Operation(COPY_FILE, '/src/large', dst_path)], block_cache), [])
+        block_cache.discard.assert_called_once_with(dst_path)
+
+        # a copy which got as far as its temp file never touched the destination in place
+        block_cache.reset_mock()
+        self.write(dst_path + TMP_SUFFIX, 'new')
+        recover_operations([Operation(COPY_FILE, '/src/large', dst_path)], block_cache)
+        block_cache.discard.assert_not_called()
+
+    def test_a_dir_copied_halfway_is_removed(self):
+        self.write(self.path('dst', 'dir', 'a'), 'a')
+        operations = [Operation(COPY_DIR, '/src/dir', self.path('dst', 'dir'))]
+        self.assertEqual(recover_operations(operations), [self.path('dst', 'dir')])
+        self.assertFalse(os.path.exists(self.path('dst', 'dir')))
+
+    def test_deletions_and_moves_are_left_to_the_next_plan(self):
+        self.write(self.path('dst', 'a'), 'a')
+        self.write(self.path('dst', 'b'), 'b')
+        operations = [Operation(DELETE_FILE, None, self.path('dst', 'a')),
+                      Operation(MOVE, self.path('dst', 'b'), self.path('dst', 'c'))]
+        self.assertEqual(recover_operations(operations), [])
+        self.assertEqual(sorted(os.listdir(self.path('dst'))), ['a', 'b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Manifest diffs telling renamed files and dirs apart from new ones"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from gitsync.lib.executor import Operation, COPY_FILE, COPY_DIR, DELETE_FILE, DELETE_DIR, MOVE
+from gitsync.lib.manifest import iter_scan_dir, file_digest, _match_dirs, _reconcile
+
+
+class ManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.src_root = os.path.join(self.root, 'src')
+        self.dst_root = os.path.join(self.root, 'dst')
+        os.makedirs(self.src_root)
+
+    def src(self, *names):
+        return os.path.join(self.src_root, *names)
+
+    def dst(self, *names):
+        return os.path.join(self.dst_root, *names)
+
+    def write(self, rel_path, content):
+        os.makedirs(os.path.dirname(self.src(rel_path)), exist_ok=True)
+        with open(self.src(rel_path), 'w') as f:
+            f.write(content)
+
+    def synced(self):
+        """Copy the sources to the destination, returning their entries as recorded by the first sync"""
+        shutil.copytree(self.src_root, self.dst_root)
+        entries = {}
+        self.assertEqual(list(iter_scan_dir(self.src_root, self.dst_root, entries)), [])
+        return entries
+
+    def scan(self, prev_entries):
+        entries = {}
+        operations = list(iter_scan_dir(self.src_root, self.dst_root, entries, prev_entries=prev_entries))
+        return operations, entries
+
+
+class MoveDetectionTest(ManifestTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for name in ('a', 'b', 'c', 'e'):
+            self.write(os.path.join('old', name), name * 10)
+        self.write('keep', 'keep')
+
+    def test_a_renamed_dir_is_moved(self):
+        prev_entries = self.synced()
+        os.rename(self.src('old'), self.src('new'))
+        operations, entries = self.scan(prev_entries)
+        self.assertEqual(operations, [Operation(MOVE, self.dst('old'), self.dst('new'))])
+        self.assertEqual(entries[os.path.join('new', 'a')], prev_entries[os.path.join('old', 'a')])
+        self.assertNotIn(os.path.join('old', 'a'), entries)
+
+    def test_a_renamed_dir_is_reconciled_with_its_source(self):
+        prev_entries = self.synced()
+        os.rename(self.src('old'), self.src('new'))
+        # half of the files it holds now are unchanged
+        self.write(os.path.join('new', 'b'), 'changed')
+        os.remove(self.src('new', 'c'))
+        self.write(os.path.join('new', 'd'), 'added')
+        operations, _ = self.scan(prev_entries)
+        self.assertEqual(operations, [Operation(MOVE, self.dst('old'), self.dst('new')),
+                                      Operation(COPY_FILE, self.src('new', 'b'), self.dst('new', 'b')),
+                                      Operation(COPY_FILE, self.src('new', 'd'), self.dst('new', 'd')),
+                                      Operation(DELETE_FILE, None, self.dst('new', 'c'))])
+
+    def test_a_dir_sharing_few_files_is_copied(self):
+        prev_entries = self.synced()
+        os.rename(self.src('old'), self.src('new'))
+        for name in ('d', 'f', 'g', 'h', 'i'):
+            self.write(os.path.join('new', name), name)
+        operations, _ = self.scan(prev_entries)
+        self.assertEqual(operations, [Operation(COPY_DIR, self.src('new'), self.dst('new')),
+                                      Operation(DELETE_DIR, None, self.dst('old'))])
+
+    def test_a_dir_isnt_moved_onto_an_existing_copy(self):
+        prev_entries = self.synced()
+        os.rename(self.src('old'), self.src('new'))
+        os.makedirs(self.dst('new'))
+        operations, _ = self.scan(prev_entries)
+        self.assertNotIn(MOVE, [operation.action for operation in operations])
+
+    def test_a_renamed_file_is_moved_by_signature(self):
+        prev_entries = self.synced()
+        os.rename(self.src('keep'), self.src('kept'))
+        operations, entries = self.scan(prev_entries)
+        self.assertEqual(operations, [Operation(MOVE, self.dst('keep'), self.dst('kept'))])
+        self.assertEqual(entries['kept'], prev_entries['keep'])
+
+    def test_a_rewritten_file_is_moved_by_hash(self):
+        prev_entries = self.synced()
+        prev_entries['keep'][3] = file_digest(self.src('keep'))
+        os.remove(self.src('keep'))
+        self.write('kept', 'keep')
+        operations, entries = self.scan(prev_entries)
+        self.assertEqual(operations, [Operation(MOVE, self.dst('keep'), self.dst('kept'))])
+        self.assertEqual(entries['kept'][3], prev_entries['keep'][3])
+
+
+class MatchDirsTest(unittest.TestCase):
+
+    def test_pairs_with_the_gone_dir_sharing_most_signatures(self):
+        prev_entries = {'x': None, 'x/1': [1, 1, 1, None], 'x/2': [2, 2, 2, None],
+                        'y': None, 'y/3': [3, 3, 3, None]}
+        entries = {'n': None, 'n/1': [1, 1, 1, None], 'n/2': [2, 2, 2, None], 'n/3': [3, 3, 3, None],
+                   'm': None, 'm/3': [3, 3, 3, None], 'm/9': [9, 9, 9, None]}
+        pairs = _match_dirs(['n', 'm'], {'x', 'y'}, entries, prev_entries)
+        self.assertEqual([(old_dir, new_dir) for old_dir, new_dir, _, _ in pairs], [('x', 'n'), ('y', 'm')])
+        self.assertEqual(pairs[0][2], {'1': [1, 1, 1, None], '2': [2, 2, 2, None]})
+
+    def test_a_gone_dir_is_paired_once(self):
+        prev_entries = {'x': None, 'x/1': [1, 1, 1, None]}
+        entries = {'n': None, 'n/1': [1, 1, 1, None], 'm': None, 'm/1': [1, 1, 1, None]}
+        self.assertEqual(len(_match_dirs(['n', 'm'], {'x'}, entries, prev_entries)), 1)
+
+
+class ReconcileTest(unittest.TestCase):
+
+    def test_type_changes_within_a_moved_dir(self):
+        old_subtree = {'f': [1, 1, 1, 'h'], 'd': None, 'd/g': [2, 2, 2, None], 'gone': [3, 3, 3, None]}
+        new_subtree = {'f': None, 'f/x': [4, 4, 4, None], 'd': [5, 5, 5, None]}
+        entries = dict(('n/' + rel_path, entry) for rel_path, entry in new_subtree.items())
+        operations = _reconcile('n', old_subtree, new_subtree, '/src', '/dst', entries)
+        self.assertEqual(operations, [Operation(DELETE_DIR, None, '/dst/n/d'),
+                                      Operation(COPY_FILE, '/src/n/d', '/dst/n/d'),
+                                      Operation(DELETE_FILE, None, '/dst/n/f'),
+                                      Operation(COPY_DIR, '/src/n/f', '/dst/n/f'),
+                                      Operation(DELETE_FILE, None, '/dst/n/gone')])
+
+    def test_unchanged_files_keep_their_hash(self):
+        old_subtree = {'f': [1, 1, 1, 'h']}
+        entries = {'n/f': [1, 1, 1, None]}
+        self.assertEqual(_reconcile('n', old_subtree, {'f': [1, 1, 1, None]}, '/src', '/dst', entries), [])
+        self.assertEqual(entries['n/f'], [1, 1, 1, 'h'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""Which entries of a config are due to be checked"""
+import unittest
+
+from gitsync.lib.schedule import EntrySchedule, load_schedule, due_sources, SCHEDULE_KEY
+
+NOW = 1000000.0
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.config = {
+            'files': {'/home/rc': '.rc', '/home/profile': '.profile'},
+            'dirs': {'/home/photos': 'photos', '/home/notes': 'notes'},
+            SCHEDULE_KEY: {
+                '/home/photos': {'interval': 3600},
+                '/home/notes': {'interval': 60, 'priority': 10}
+            }
+        }
+
+    def test_load_schedule(self):
+        self.assertEqual(load_schedule(self.config), {'/home/photos': EntrySchedule(3600.0, 0),
+                                                      '/home/notes': EntrySchedule(60.0, 10)})
+        self.assertEqual(load_schedule({'files': {}}), {})
+
+    def test_invalid_schedules(self):
+        self.config[SCHEDULE_KEY]['/home/missing'] = {'interval': 60}
+        with self.assertRaises(ValueError):
+            load_schedule(self.config)
+        del self.config[SCHEDULE_KEY]['/home/missing']
+        self.config[SCHEDULE_KEY]['/home/rc'] = {'interval': -1}
+        with self.assertRaises(ValueError):
+            due_sources(self.config, {}, now=NOW)
+
+    def test_never_checked_sources_are_due_by_priority_then_config_order(self):
+        self.assertEqual(due_sources(self.config, {}, now=NOW),
+                         ['/home/notes', '/home/rc', '/home/profile', '/home/photos'])
+
+    def test_sources_are_due_once_their_interval_passed(self):
+        scanned = dict((src_path, NOW - 120) for src_path in list(self.config['files']) + list(self.config['dirs']))
+        # unscheduled entries are checked on every run
+        self.assertEqual(due_sources(self.config, scanned, now=NOW), ['/home/notes', '/home/rc', '/home/profile'])
+        scanned['/home/notes'] = NOW - 30
+        scanned['/home/photos'] = NOW - 3600
+        self.assertEqual(due_sources(self.config, scanned, now=NOW), ['/home/rc', '/home/profile', '/home/photos'])
+
+    def test_a_run_a_little_early_still_counts(self):
+        scanned = {'/home/rc': NOW, '/home/profile': NOW, '/home/photos': NOW - 3500, '/home/notes': NOW - 50}
+        self.assertEqual(due_sources(self.config, scanned, now=NOW), ['/home/rc', '/home/profile', '/home/photos'])
+
+
+if __name__ == '__main__':
+    unittest.main()
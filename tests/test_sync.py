@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""End-to-end syncs against a temporary bare remote
+
+Each test sets up a bare origin, a clone of it as repo_dir and a few source
+files, then runs sync the way the command line does. Needs git and GitPython.
+"""
+from unittest import mock
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+
+from gitsync.__main__ import sync, sync_direct, SyncError, AUTO_COMMIT_MESSAGE
+from gitsync.lib import PUSH_BACKGROUND, PUSH_DETACH, SNAPSHOT_MESSAGE, FlushPolicy, wait_for_push, load_pending
+
+# seconds a detached push is waited for
+DETACH_TIMEOUT = 30.0
+
+
+def git(*args, cwd=None):
+    return subprocess.run(['git'] + list(args), cwd=cwd, check=True, stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL).stdout.decode().strip()
+
+
+class SyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='gitsync-test-')
+        self.addCleanup(shutil.rmtree, self.root)
+        self.origin = self.bare_repo('origin.git')
+        self.repo_dir = self.clone(self.origin, 'repo')
+        with open(os.path.join(self.repo_dir, 'README'), 'w') as f:
+            f.write('kept as it is\n')
+        git('add', 'README', cwd=self.repo_dir)
+        git('commit', '-qm', 'init', cwd=self.repo_dir)
+        git('push', '-q', 'origin', 'master', cwd=self.repo_dir)
+
+        self.src_dir = os.path.join(self.root, 'src')
+        self.write_source('zshrc', 'rc\n')
+        self.write_source('tree/a', 'a\n')
+        self.write_source('tree/sub/b', 'b\n')
+        self.config = {
+            'repo_dir': self.repo_dir,
+            'files': {os.path.join(self.src_dir, 'zshrc'): '.zshrc'},
+            'dirs': {os.path.join(self.src_dir, 'tree'): 'tree'},
+            'ignore': {'patterns': []},
+            '_ver': 1
+        }
+        self.config_file = os.path.join(self.root, 'settings.json')
+        self.save_config()
+
+    def bare_repo(self, name):
+        repo_path = os.path.join(self.root, name)
+        git('init', '-q', '--bare', repo_path)
+        git('symbolic-ref', 'HEAD', 'refs/heads/master', cwd=repo_path)
+        return repo_path
+
+    def clone(self, url, name):
+        clone_path = os.path.join(self.root, name)
+        git('clone', '-q', url, clone_path)
+        git('checkout', '-q', '-B', 'master', cwd=clone_path)
+        git('config', 'user.email', 'test@example.com', cwd=clone_path)
+        git('config', 'user.name', 'test', cwd=clone_path)
+        return clone_path
+
+    def write_source(self, rel_path, content):
+        src_path = os.path.join(self.src_dir, rel_path)
+        os.makedirs(os.path.dirname(src_path), exist_ok=True)
+        with open(src_path, 'w') as f:
+            f.write(content)
+
+    def save_config(self):
+        with open(self.config_file, 'w') as f:
+            json.dump(self.config, f)
+
+    def remote_file(self, remote, rel_path):
+        return git('--git-dir', remote, 'show', 'master:{0}'.format(rel_path))
+
+    def remote_messages(self, remote):
+        return git('--git-dir', remote, 'log', '--format=%s', 'master').splitlines()
+
+    def head(self, repo_path):
+        return git('rev-parse', 'HEAD', cwd=repo_path)
+
+
+class SyncTest(SyncTestCase):
+
+    def test_sync_commits_and_pushes(self):
+        self.assertTrue(sync(self.config_file))
+        self.assertEqual(self.remote_file(self.origin, '.zshrc'), 'rc')
+        self.assertEqual(self.remote_file(self.origin, 'tree/sub/b'), 'b')
+        self.assertEqual(self.remote_messages(self.origin), [AUTO_COMMIT_MESSAGE, 'init'])
+        # nothing changed since
+        self.assertFalse(sync(self.config_file))
+        self.assertEqual(len(self.remote_messages(self.origin)), 2)
+
+    def test_plans_again_when_the_pull_moves_head(self):
+        sync(self.config_file)
+        # another machine changes the repo copy meanwhile, the plan made against the old HEAD misses it
+        other = self.clone(self.origin, 'other')
+        with open(os.path.join(other, '.zshrc'), 'w') as f:
+            f.write('changed elsewhere\n')
+        git('commit', '-qam', 'edit', cwd=other)
+        git('push', '-q', 'origin', 'master', cwd=other)
+        self.write_source('tree/a', 'a2\n')
+
+        with self.assertLogs('gitsync', level='DEBUG') as logs:
+            self.assertTrue(sync(self.config_file, full=True))
+        self.assertTrue(any('plan again' in line for line in logs.output))
+        self.assertEqual(self.remote_file(self.origin, '.zshrc'), 'rc')
+        self.assertEqual(self.remote_file(self.origin, 'tree/a'), 'a2')
+
+    def test_background_push(self):
+        sync(self.config_file, push_mode=PUSH_BACKGROUND)
+        wait_for_push()
+        self.assertEqual(git('--git-dir', self.origin, 'rev-parse', 'master'), self.head(self.repo_dir))
+
+    def test_detached_push(self):
+        sync(self.config_file, push_mode=PUSH_DETACH)
+        head = self.head(self.repo_dir)
+        deadline = time.time() + DETACH_TIMEOUT
+        while git('--git-dir', self.origin, 'rev-parse', 'master') != head:
+            self.assertLess(time.time(), deadline, 'the detached push never arrived')
+            time.sleep(0.1)
+
+
+class SymlinkTest(SyncTestCase):
+
+    def test_links_in_synced_dirs_are_kept_as_links(self):
+        self.write_source('other/x', 'x\n')
+        os.symlink('../other', os.path.join(self.src_dir, 'tree', 'link'))
+        os.symlink('a', os.path.join(self.src_dir, 'tree', 'alias'))
+        self.assertTrue(sync(self.config_file))
+        self.assertEqual(os.readlink(os.path.join(self.repo_dir, 'tree', 'link')), '../other')
+        self.assertEqual(self.remote_file(self.origin, 'tree/alias'), 'a')
+
+        # what the link points to changing is no change of the link
+        time.sleep(0.01)
+        self.write_source('other/y', 'y\n')
+        self.assertFalse(sync(self.config_file))
+
+        os.remove(os.path.join(self.src_dir, 'tree', 'link'))
+        os.symlink('sub', os.path.join(self.src_dir, 'tree', 'link'))
+        self.assertTrue(sync(self.config_file))
+        self.assertEqual(self.remote_file(self.origin, 'tree/link'), 'sub')
+
+
+class MultiRemoteTest(SyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.mirror = self.bare_repo('mirror.git')
+        git('push', '-q', self.mirror, 'master', cwd=self.repo_dir)
+
+    def test_pushes_to_every_remote(self):
+        self.config['remotes'] = ['origin', {'url': self.mirror}]
+        self.save_config()
+        sync(self.config_file)
+        self.assertEqual(self.remote_file(self.origin, 'tree/a'), 'a')
+        self.assertEqual(self.remote_file(self.mirror, 'tree/a'), 'a')
+
+    def test_best_effort_remote_failing_is_only_reported(self):
+        self.config['remotes'] = ['origin', {'url': os.path.join(self.root, 'missing.git'), 'required': False}]
+        self.save_config()
+        self.assertTrue(sync(self.config_file))
+        self.assertEqual(self.remote_file(self.origin, 'tree/a'), 'a')
+        self.assertEqual(load_pending(os.path.join(self.repo_dir, '.git'))['remotes'], [])
+
+    def test_required_remote_failing_fails_the_sync_and_is_retried(self):
+        missing = os.path.join(self.root, 'missing.git')
+        self.config['remotes'] = ['origin', {'name': 'backup', 'url': missing, 'retries': 1}]
+        self.save_config()
+        with mock.patch('gitsync.lib.push.RETRY_DELAY', 0):
+            with self.assertRaises(SyncError):
+                sync(self.config_file)
+        self.assertEqual(self.remote_file(self.origin, 'tree/a'), 'a')
+        self.assertEqual(load_pending(os.path.join(self.repo_dir, '.git'))['remotes'], ['backup'])
+
+        # the next sync pushes again although nothing changed
+        self.bare_repo('missing.git')
+        self.assertTrue(sync(self.config_file))
+        self.assertEqual(self.remote_file(missing, 'tree/a'), 'a')
+        self.assertEqual(load_pending(os.path.join(self.repo_dir, '.git'))['remotes'], [])
+
+
+class DirectTest(SyncTestCase):
+
+    def test_commits_and_pushes_to_every_remote(self):
+        mirror = self.bare_repo('mirror.git')
+        git('push', '-q', mirror, 'master', cwd=self.repo_dir)
+        self.config['remotes'] = ['origin', {'url': mirror}]
+        self.save_config()
+        self.assertTrue(sync_direct(self.config_file, flush_policy=FlushPolicy()))
+        for remote in (self.origin, mirror):
+            self.assertEqual(self.remote_file(remote, 'tree/sub/b'), 'b')
+            self.assertEqual(self.remote_file(remote, 'README'), 'kept as it is')
+
+    def test_unsupported_options_are_rejected(self):
+        head = git('--git-dir', self.origin, 'rev-parse', 'master')
+        with self.assertRaises(SyncError):
+            sync_direct(self.config_file, push_mode=PUSH_BACKGROUND)
+        with self.assertRaises(SyncError):
+            sync_direct(self.config_file, flush_policy=FlushPolicy(commits=5))
+        self.config['history'] = {'retention_days': 30}
+        self.save_config()
+        with self.assertRaises(SyncError):
+            sync_direct(self.config_file)
+        self.assertEqual(git('--git-dir', self.origin, 'rev-parse', 'master'), head)
+
+
+class HistoryTest(SyncTestCase):
+
+    def sync_at(self, seconds_ago, content):
+        """Sync a change of tree/a committed seconds_ago"""
+        date = '@{0} +0000'.format(int(time.time() - seconds_ago))
+        self.write_source('tree/a', content)
+        with mock.patch.dict(os.environ, {'GIT_AUTHOR_DATE': date, 'GIT_COMMITTER_DATE': date}):
+            self.assertTrue(sync(self.config_file))
+
+    def test_compacts_old_auto_commits_on_every_remote(self):
+        mirror = self.bare_repo('mirror.git')
+        git('push', '-q', mirror, 'master', cwd=self.repo_dir)
+        self.config['remotes'] = ['origin', {'url': mirror}]
+        self.save_config()
+        for days, content in ((40, '1\n'), (39, '2\n'), (38, '3\n')):
+            self.sync_at(days * 86400, content)
+        self.assertEqual(len(self.remote_messages(self.origin)), 4)
+
+        self.config['history'] = {'retention_days': 30, 'compact_interval_days': 0, 'gc_interval_days': None}
+        self.save_config()
+        self.sync_at(0, '4\n')
+
+        for remote in (self.origin, mirror):
+            messages = self.remote_messages(remote)
+            self.assertEqual(len(messages), 3)
+            self.assertEqual(messages[0], AUTO_COMMIT_MESSAGE)
+            self.assertTrue(messages[1].startswith(SNAPSHOT_MESSAGE[:SNAPSHOT_MESSAGE.index('{')]))
+            self.assertEqual(messages[2], 'init')
+            self.assertEqual(self.remote_file(remote, 'tree/a'), '4')
+            self.assertEqual(git('--git-dir', remote, 'rev-parse', 'master'), self.head(self.repo_dir))
+
+    def test_compaction_doesnt_overwrite_unknown_remote_commits(self):
+        mirror = self.bare_repo('mirror.git')
+        git('push', '-q', mirror, 'master', cwd=self.repo_dir)
+        self.config['remotes'] = ['origin', {'url': mirror, 'required': False}]
+        self.save_config()
+        for days, content in ((40, '1\n'), (39, '2\n')):
+            self.sync_at(days * 86400, content)
+        # someone else pushed to the mirror, which this repo never saw
+        other = self.clone(mirror, 'other')
+        git('commit', '-q', '--allow-empty', '-m', 'theirs', cwd=other)
+        git('push', '-q', 'origin', 'master', cwd=other)
+
+        self.config['history'] = {'retention_days': 30, 'compact_interval_days': 0, 'gc_interval_days': None}
+        self.save_config()
+        self.sync_at(0, '3\n')
+        self.assertEqual(len(self.remote_messages(self.origin)), 3)
+        self.assertEqual(self.remote_messages(mirror)[0], 'theirs')
+
+
+if __name__ == '__main__':
+    unittest.main()